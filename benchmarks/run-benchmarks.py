@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+
+"""
+Offline Deployment Benchmarks
+=============================
+Measure the deployment scripts end to end on one Linux box without an AWS
+account. A fake Lightsail client hands out access details for a throwaway
+local sshd (or any container that trusts the given certificate), and
+synthetic app trees of configurable size are deployed to it.
+
+With the local sshd the "instance" is this machine: deploys write to
+/var/www and /opt/bitnami exactly as they would on Lightsail, so run this
+as root in a disposable container or VM.
+
+Usage:
+    python3 benchmarks/run-benchmarks.py --yes
+    python3 benchmarks/run-benchmarks.py --yes --sizes 10,1000 --output results.json
+    python3 benchmarks/run-benchmarks.py --yes --compare benchmarks/baseline.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import getpass
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from lightsail_tools import aws
+from lightsail_tools.readiness import poll, port_open
+from lightsail_tools.ssh import SSHSession
+from lightsail_tools.tracing import tracer
+
+DEFAULT_SIZES = '10,1000,10000'
+GROUPS = ('package', 'files', 'deploy', 'check')
+INSTANCE_NAME = 'benchmark-instance'
+CTLSCRIPT = '/opt/bitnami/ctlscript.sh'
+
+
+class BenchmarkError(Exception):
+    """A benchmarked operation reported failure"""
+
+
+class _Events:
+    """Accepts botocore event registrations and ignores them"""
+
+    def register(self, *args, **kwargs):
+        pass
+
+
+class FakeLightsail:
+    """Just enough of the Lightsail client for the deployment scripts"""
+
+    def __init__(self, access_details):
+        self.access_details = access_details
+        self.meta = types.SimpleNamespace(events=_Events())
+        self.exceptions = types.SimpleNamespace(NotFoundException=LookupError)
+
+    def get_instance_access_details(self, instanceName):
+        details = dict(self.access_details, instanceName=instanceName,
+                       expiresAt=time.time() + 3600)
+        return {'accessDetails': details}
+
+    def get_instance(self, instanceName):
+        ip = self.access_details['ipAddress']
+        return {'instance': {
+            'name': instanceName, 'state': {'name': 'running'},
+            'publicIpAddress': ip, 'privateIpAddress': ip,
+            'blueprintName': 'benchmark', 'bundleName': 'local',
+        }}
+
+    def get_instances(self, **kwargs):
+        return {'instances': []}
+
+    def put_instance_public_ports(self, **kwargs):
+        return {}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _write_script(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+
+
+class LocalSSHD:
+    """A throwaway sshd on 127.0.0.1 that trusts a generated user CA.
+
+    Remote sessions get a PATH with no-op shims for systemctl, curl and
+    anything else the deploy scripts need that is missing here, so no real
+    service is touched and no application has to start.
+    """
+
+    def __init__(self):
+        self.work_dir = None
+        self.process = None
+        self.port = None
+        self.created_ctlscript = False
+
+    def _keygen(self, *args):
+        subprocess.run(['ssh-keygen', '-q', *args], check=True, stdout=subprocess.DEVNULL)
+
+    def _make_shims(self, shim_dir):
+        os.makedirs(shim_dir)
+        _write_script(os.path.join(shim_dir, 'systemctl'), "#!/bin/sh\nexit 0\n")
+        _write_script(os.path.join(shim_dir, 'curl'), "#!/bin/sh\nexit 0\n")
+        # Drop -u so commands run as the benchmark user; sudo's secure_path
+        # would otherwise bypass the shims
+        _write_script(os.path.join(shim_dir, 'sudo'),
+                      '#!/bin/sh\nif [ "$1" = "-u" ]; then shift 2; fi\nexec "$@"\n')
+        if not shutil.which('mysql'):
+            _write_script(os.path.join(shim_dir, 'mysql'), "#!/bin/sh\ncat > /dev/null\n")
+        if not shutil.which('node'):
+            _write_script(os.path.join(shim_dir, 'node'), "#!/bin/sh\necho v20.0.0\n")
+        if not shutil.which('npm'):
+            _write_script(os.path.join(shim_dir, 'npm'), "#!/bin/sh\nmkdir -p node_modules\n")
+        missing_users = [user for user in ('www-data', 'bitnami', 'daemon')
+                         if subprocess.run(['id', user], capture_output=True).returncode != 0]
+        if missing_users:
+            _write_script(os.path.join(shim_dir, 'chown'),
+                          f'#!/bin/sh\n{shutil.which("chown")} "$@" 2>/dev/null || true\n')
+        if not os.path.exists(CTLSCRIPT):
+            os.makedirs(os.path.dirname(CTLSCRIPT), exist_ok=True)
+            _write_script(CTLSCRIPT, "#!/bin/sh\nexit 0\n")
+            self.created_ctlscript = True
+
+    def start(self):
+        sshd = shutil.which('sshd') or '/usr/sbin/sshd'
+        if not os.path.exists(sshd):
+            raise BenchmarkError("sshd not found; install openssh-server or use --ssh-target")
+        if os.geteuid() != 0:
+            raise BenchmarkError("the local sshd target must run as root (use a container or VM)")
+
+        self.work_dir = tempfile.mkdtemp(prefix='lightsail-benchmark-')
+        path = lambda name: os.path.join(self.work_dir, name)
+        self._keygen('-t', 'ed25519', '-N', '', '-f', path('host_key'))
+        self._keygen('-t', 'ed25519', '-N', '', '-f', path('ca'))
+        self._keygen('-t', 'ed25519', '-N', '', '-f', path('user_key'))
+        self._keygen('-s', path('ca'), '-I', 'lightsail-benchmark', '-n', getpass.getuser(),
+                     '-V', '-5m:+1d', path('user_key.pub'))
+        self._make_shims(path('shims'))
+
+        self.port = _free_port()
+        with open(path('sshd_config'), 'w') as f:
+            f.write(f"""Port {self.port}
+ListenAddress 127.0.0.1
+HostKey {path('host_key')}
+PidFile {path('sshd.pid')}
+TrustedUserCAKeys {path('ca.pub')}
+AuthorizedKeysFile none
+PasswordAuthentication no
+PermitRootLogin yes
+UsePAM no
+StrictModes no
+MaxSessions 200
+MaxStartups 200
+SetEnv PATH={path('shims')}:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin
+""")
+        os.makedirs('/run/sshd', exist_ok=True)
+        with open(path('sshd.log'), 'w') as log_file:
+            self.process = subprocess.Popen([sshd, '-D', '-e', '-f', path('sshd_config')],
+                                            stdout=log_file, stderr=log_file)
+        if not poll(lambda: port_open('127.0.0.1', self.port), 10, initial_delay=0.1, max_delay=1):
+            self.stop()
+            raise BenchmarkError("local sshd did not start")
+
+    def access_details(self):
+        with open(os.path.join(self.work_dir, 'user_key')) as f:
+            private_key = f.read()
+        with open(os.path.join(self.work_dir, 'user_key-cert.pub')) as f:
+            cert_key = f.read().strip()
+        return {'privateKey': private_key, 'certKey': cert_key, 'username': getpass.getuser(),
+                'ipAddress': '127.0.0.1', 'port': self.port}
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+        if self.created_ctlscript:
+            os.unlink(CTLSCRIPT)
+            self.created_ctlscript = False
+        if self.work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
+
+
+def target_access_details(target, key_path, cert_path):
+    """Access details for an existing SSH target given as user@host[:port]"""
+    username, _, address = target.rpartition('@')
+    host, _, port = address.partition(':')
+    with open(key_path) as f:
+        private_key = f.read()
+    with open(cert_path) as f:
+        cert_key = f.read().strip()
+    return {'privateKey': private_key, 'certKey': cert_key, 'username': username or getpass.getuser(),
+            'ipAddress': host, 'port': int(port) if port else None}
+
+
+def load_script(filename):
+    """Import one of the hyphenated deployment scripts as a module"""
+    module_name = filename[:-3].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(REPO_ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _filler(rng, size):
+    text = rng.randbytes(size // 2).hex()
+    return '\n'.join(text[i:i + 80] for i in range(0, len(text), 80)) + '\n'
+
+
+def make_tree(root, files, kind):
+    """Write a deterministic synthetic app: kind is 'node' or 'php'"""
+    rng = random.Random(files)
+    os.makedirs(root)
+    if kind == 'node':
+        _write_file(root, 'server.js', "require('http').createServer((q, s) => s.end('ok')).listen(3000);\n")
+        _write_file(root, 'package.json', json.dumps({'name': 'benchmark-app', 'version': '1.0.0'}))
+        _write_file(root, 'package-lock.json', json.dumps({
+            'name': 'benchmark-app', 'version': '1.0.0', 'lockfileVersion': 3, 'requires': True,
+            'packages': {'': {'name': 'benchmark-app', 'version': '1.0.0'}},
+        }))
+        extensions = ('js', 'css', 'html', 'json')
+    else:
+        _write_file(root, 'index.php', "<?php echo 'ok';\n")
+        _write_file(root, 'migrations/0001_initial_schema.sql', "SELECT 1;\n")
+        extensions = ('php', 'js', 'css', 'html')
+    for i in range(files):
+        rel_path = f'assets/d{i // 100:03d}/f{i:05d}.{extensions[i % len(extensions)]}'
+        _write_file(root, rel_path, _filler(rng, rng.randint(200, 4000)))
+    return root
+
+
+def _write_file(root, rel_path, content):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def touch_one(root):
+    """Change one generated file so the next deploy has a one-file delta"""
+    first = os.path.join(root, 'assets', 'd000', sorted(os.listdir(os.path.join(root, 'assets', 'd000')))[0])
+    with open(first, 'a') as f:
+        f.write(f"{time.time()}\n")
+
+
+class Runner:
+    """Times benchmarks and collects their results"""
+
+    def __init__(self, repeat, verbose=False):
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results = {}
+        # Per-phase breakdowns come from the recorded spans
+        tracer.record()
+
+    def measure(self, name, function, setup=None, warmup=0):
+        runs = []
+        for attempt in range(warmup + self.repeat):
+            if setup:
+                setup()
+            tracer.reset()
+            with contextlib.ExitStack() as stack:
+                if not self.verbose:
+                    devnull = stack.enter_context(open(os.devnull, 'w'))
+                    stack.enter_context(contextlib.redirect_stdout(devnull))
+                started = time.perf_counter()
+                ok = function()
+                elapsed = time.perf_counter() - started
+            if ok is False or ok is None:
+                raise BenchmarkError(f"{name} failed (rerun with --verbose)")
+            if attempt >= warmup:
+                runs.append(elapsed)
+        self.results[name] = {
+            'median': statistics.median(runs), 'min': min(runs), 'runs': runs,
+            'phases': [{k: row[k] for k in ('name', 'depth', 'calls', 'total', 'bytes')}
+                       for row in tracer.summary()],
+        }
+        print(f"  {name:<40} median {self.results[name]['median']:8.3f}s  min {min(runs):8.3f}s")
+
+
+def _wait_for_new_second(last):
+    """Release ids have one-second resolution; never reuse the live one"""
+    remaining = 1.05 - (time.time() - last[0])
+    if remaining > 0:
+        time.sleep(remaining)
+    last[0] = time.time()
+
+
+def benchmark_size(runner, lightsail, scripts, files, groups, work_dir):
+    qbr, deployer_module = scripts['qbr'], scripts['deploy']
+    print(f"\n📦 {files} files")
+
+    with SSHSession(lightsail, INSTANCE_NAME) as session:
+        session.run(f"sudo rm -rf {deployer_module.APP_DIR} {qbr.APP_ROOT}")
+
+    php_tree = make_tree(os.path.join(work_dir, f'php-{files}'), files, 'php')
+    node_tree = make_tree(os.path.join(work_dir, f'node-{files}'), files, 'node')
+    cwd = os.getcwd()
+
+    if 'package' in groups or 'files' in groups:
+        os.chdir(php_tree)
+        try:
+            deployer = qbr.LightsailQBRDeployer(INSTANCE_NAME)
+            if 'package' in groups:
+                runner.measure(f'create_deployment_package.cold.{files}',
+                               lambda: deployer.create_deployment_package(use_cache=False))
+                runner.measure(f'create_deployment_package.cached.{files}',
+                               lambda: deployer.create_deployment_package(use_cache=True), warmup=1)
+            if 'files' in groups:
+                def deploy_files(full):
+                    try:
+                        commands = deployer.deploy_application_files(full=full)
+                        return commands is not None and deployer.execute_deployment_commands(commands)
+                    finally:
+                        deployer.close_session()
+                runner.measure(f'deploy_application_files.full.{files}', lambda: deploy_files(True))
+                runner.measure(f'deploy_application_files.noop.{files}', lambda: deploy_files(False))
+                runner.measure(f'deploy_application_files.delta.{files}', lambda: deploy_files(False),
+                               setup=lambda: touch_one(php_tree))
+        finally:
+            os.chdir(cwd)
+
+    if 'deploy' in groups:
+        last_release = [0.0]
+
+        def deploy(full=False, change=False):
+            def setup():
+                if change:
+                    touch_one(node_tree)
+                _wait_for_new_second(last_release)
+            return setup, lambda: deployer_module.LightsailDeployer(
+                INSTANCE_NAME, lightsail=lightsail).deploy_application(node_tree, full=full)
+
+        setup, function = deploy(full=True)
+        runner.measure(f'deploy_application.full.{files}', function, setup=setup)
+        setup, function = deploy()
+        runner.measure(f'deploy_application.noop.{files}', function, setup=setup)
+        setup, function = deploy(change=True)
+        runner.measure(f'deploy_application.delta.{files}', function, setup=setup)
+
+    shutil.rmtree(php_tree)
+    shutil.rmtree(node_tree)
+
+
+def benchmark_check(runner, scripts):
+    check = scripts['check']
+    print("\n🔍 Node.js check")
+
+    def fresh_session():
+        check.close_sessions()
+        check.credential_cache.invalidate(INSTANCE_NAME, 'us-east-1')
+
+    runner.measure('check_nodejs.sequential',
+                   lambda: check.check_nodejs_installation(INSTANCE_NAME) or True, setup=fresh_session)
+    runner.measure('check_nodejs.batch',
+                   lambda: check.run_batched_probes(INSTANCE_NAME)['success'], setup=fresh_session)
+    check.close_sessions()
+
+
+def compare(results, baseline, threshold, min_delta):
+    """Print current medians against a baseline and return the regressions.
+
+    A benchmark regressed when it is both threshold (relative) and
+    min_delta seconds slower, so jitter in millisecond timings is ignored.
+    """
+    regressions = []
+    names = [name for name in results if name in baseline]
+    if not names:
+        print("\n⚠️ No benchmarks in common with the baseline")
+        return regressions
+    width = max(len(name) for name in names)
+    print("\n" + "=" * (width + 44))
+    print(f"{'BENCHMARK':<{width}}  {'BASELINE':>9}  {'CURRENT':>9}  {'CHANGE':>8}")
+    print("-" * (width + 44))
+    for name in names:
+        before, after = baseline[name]['median'], results[name]['median']
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > threshold and after - before > min_delta:
+            flag = '  ⚠️ regression'
+            regressions.append(name)
+        elif change < -threshold and before - after > min_delta:
+            flag = '  ✅ faster'
+        print(f"{name:<{width}}  {before:>8.3f}s  {after:>8.3f}s  {change:>+7.1%}{flag}")
+    print("-" * (width + 44))
+    return regressions
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', '-C', REPO_ROOT, 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the deployment scripts offline")
+    parser.add_argument('--yes', action='store_true',
+                        help="confirm the target may be written to (/var/www, /opt/bitnami)")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f"comma-separated synthetic tree sizes (default: {DEFAULT_SIZES})")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per benchmark (default: 3)")
+    parser.add_argument('--only', default=','.join(GROUPS),
+                        help=f"comma-separated groups to run: {', '.join(GROUPS)}")
+    parser.add_argument('--output', default='benchmark-results.json',
+                        help="where to write the JSON results (default: benchmark-results.json)")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="compare against an earlier results file and exit 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative slowdown counted as a regression (default: 0.10)")
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help="smallest slowdown in seconds counted as a regression (default: 0.05)")
+    parser.add_argument('--ssh-target', metavar='USER@HOST[:PORT]',
+                        help="use an existing SSH host (e.g. a container) instead of a local sshd")
+    parser.add_argument('--ssh-key', help="private key for --ssh-target")
+    parser.add_argument('--ssh-cert', help="certificate for --ssh-key, trusted by --ssh-target")
+    parser.add_argument('--verbose', action='store_true', help="show the scripts' own output")
+    args = parser.parse_args()
+    if args.ssh_target and not (args.ssh_key and args.ssh_cert):
+        parser.error("--ssh-target needs --ssh-key and --ssh-cert")
+    return args
+
+
+def main():
+    args = parse_args()
+    if not args.yes:
+        print("These benchmarks deploy to the target host, writing to /var/www and /opt/bitnami.")
+        print("Run them in a disposable container or VM and pass --yes to continue.")
+        sys.exit(1)
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    groups = [group for group in args.only.split(',') if group]
+
+    sshd = None
+    try:
+        if args.ssh_target:
+            access_details = target_access_details(args.ssh_target, args.ssh_key, args.ssh_cert)
+        else:
+            sshd = LocalSSHD()
+            sshd.start()
+            access_details = sshd.access_details()
+        lightsail = FakeLightsail(access_details)
+        # The scripts bind get_client at import time, so patch it before loading them
+        aws.get_client = lambda service='lightsail', region='us-east-1': lightsail
+        scripts = {
+            'qbr': load_script('deploy-qbr-to-lightsail.py'),
+            'deploy': load_script('deploy-with-run-command.py'),
+            'check': load_script('check-nodejs-installation.py'),
+        }
+
+        runner = Runner(args.repeat, args.verbose)
+        with tempfile.TemporaryDirectory(prefix='lightsail-benchmark-trees-') as work_dir:
+            for files in sizes:
+                if set(groups) & {'package', 'files', 'deploy'}:
+                    benchmark_size(runner, lightsail, scripts, files, groups, work_dir)
+            if 'check' in groups:
+                benchmark_check(runner, scripts)
+    except BenchmarkError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        if sshd:
+            sshd.stop()
+
+    report = {
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'target': args.ssh_target or 'local-sshd', 'sizes': sizes, 'repeat': args.repeat,
+        },
+        'results': runner.results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📝 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(runner.results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
+        print("✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
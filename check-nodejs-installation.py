@@ -7,115 +7,270 @@ Use AWS Lightsail API to safely check Node.js installation status
 without managing SSH keys manually.
 """
 
-import boto3
-import subprocess
-import tempfile
-import os
-
-def create_ssh_files(ssh_details):
-    """Create temporary SSH key files"""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.pem', delete=False) as key_file:
-        key_file.write(ssh_details['privateKey'])
-        key_path = key_file.name
-    
-    cert_path = key_path + '-cert.pub'
-    cert_parts = ssh_details['certKey'].split(' ', 2)
-    formatted_cert = f'{cert_parts[0]} {cert_parts[1]}\n' if len(cert_parts) >= 2 else ssh_details['certKey'] + '\n'
-    
-    with open(cert_path, 'w') as cert_file:
-        cert_file.write(formatted_cert)
-    
-    os.chmod(key_path, 0o600)
-    os.chmod(cert_path, 0o600)
-    
-    return key_path, cert_path
+import atexit
+import sys
+import json
+import uuid
+import argparse
+
+from lightsail_tools.aws import get_client
+from lightsail_tools.credentials import default_cache as credential_cache
+from lightsail_tools.diagnostics import DEFAULT_SERVICES, print_snapshot, print_summary, run_probe, summarize
+from lightsail_tools.fleet import find_instances_by_tag
+from lightsail_tools.logs import DEFAULT_LOGS, DEFAULT_STATE_PATH, LogPositions, follow
+from lightsail_tools.ssh import OutputStream, SSHSession, run_async, run_on_sessions
+from lightsail_tools.tracing import add_trace_arguments, export_on_exit, traced
+
+DEFAULT_INSTANCE = 'my-app-instance'
+
+# (probe id, section heading, command)
+PROBES = [
+    ('cloud_init_log', 'Checking user_data script execution logs', "sudo tail -50 /var/log/cloud-init-output.log"),
+    ('user_data_marker', 'Checking if user_data completion marker exists', "ls -la /var/log/user-data-complete.marker"),
+    ('which_node', 'Checking Node.js installation', "which node"),
+    ('node_version', 'Checking Node.js installation', "node --version"),
+    ('which_npm', 'Checking Node.js installation', "which npm"),
+    ('npm_version', 'Checking Node.js installation', "npm --version"),
+    ('usr_bin_node', 'Checking Node.js installation', "ls -la /usr/bin/node*"),
+    ('usr_bin_npm', 'Checking Node.js installation', "ls -la /usr/bin/npm*"),
+    ('snap_bin_node', 'Checking Node.js installation', "ls -la /snap/bin/node*"),
+    ('snap_bin_npm', 'Checking Node.js installation', "ls -la /snap/bin/npm*"),
+    ('path', 'Checking Node.js installation', "echo $PATH"),
+    ('snap_packages', 'Checking snap packages', "snap list | grep node"),
+    ('apt_packages', 'Checking apt packages', "dpkg -l | grep node"),
+    ('nodesource_repo', 'Checking if NodeSource repository was added', "ls -la /etc/apt/sources.list.d/ | grep node"),
+    ('cloud_init_node', 'Checking system logs for Node.js installation attempts', "sudo grep -i node /var/log/cloud-init-output.log | tail -20"),
+]
+
+_sessions = {}
+
+def get_session(instance_name, region='us-east-1'):
+    """Return the shared SSH session for an instance, opening it on first use"""
+    key = (region, instance_name)
+    if key not in _sessions:
+        _sessions[key] = SSHSession(get_client('lightsail', region), instance_name, region, credential_cache)
+    return _sessions[key]
+
+def close_sessions():
+    """Close every shared SSH session"""
+    while _sessions:
+        _, session = _sessions.popitem()
+        session.close()
 
-def run_command_on_instance(instance_name, command, timeout=60):
-    """Execute command on Lightsail instance using AWS API"""
+atexit.register(close_sessions)
+
+def run_command_on_instance(instance_name, command, timeout=60, quiet=False, stream=False, region='us-east-1'):
+    """Execute command on Lightsail instance using AWS API.
+
+    With stream set, output is printed line by line as it arrives.
+    """
+    output = OutputStream(prefix="   ") if stream and not quiet else None
     try:
-        print(f"🔧 [{instance_name}] {command}")
-        
-        lightsail = boto3.client('lightsail', region_name='us-east-1')
-        ssh_response = lightsail.get_instance_access_details(instanceName=instance_name)
-        ssh_details = ssh_response['accessDetails']
+        if not quiet:
+            print(f"🔧 [{instance_name}] {command}")
         
-        key_path, cert_path = create_ssh_files(ssh_details)
+        result = get_session(instance_name, region).run(command, timeout=timeout, output=output)
         
-        try:
-            ssh_cmd = [
-                'ssh', '-i', key_path, '-o', f'CertificateFile={cert_path}',
-                '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
-                '-o', 'ConnectTimeout=15', '-o', 'IdentitiesOnly=yes',
-                f'{ssh_details["username"]}@{ssh_details["ipAddress"]}', command
-            ]
-            
-            result = subprocess.run(ssh_cmd, capture_output=True, text=True, timeout=timeout)
-            
-            if result.returncode == 0:
-                print(f"   ✅ Success")
-                if result.stdout.strip():
-                    for line in result.stdout.strip().split('\n'):
-                        print(f"   {line}")
-                return True, result.stdout.strip()
-            else:
-                print(f"   ❌ Failed (exit code: {result.returncode})")
-                if result.stderr.strip():
-                    for line in result.stderr.strip().split('\n'):
-                        print(f"   ERROR: {line}")
-                return False, result.stderr.strip()
-            
-        finally:
-            try:
-                os.unlink(key_path)
-                os.unlink(cert_path)
-            except:
-                pass
+        if result.returncode == 0:
+            if quiet:
+                return True, result.stdout
+            print(f"   ✅ Success")
+            if result.stdout.strip() and not output:
+                for line in result.stdout.strip().split('\n'):
+                    print(f"   {line}")
+            return True, result.stdout.strip()
+        else:
+            print(f"   ❌ Failed (exit code: {result.returncode})")
+            if result.stderr.strip() and not output:
+                for line in result.stderr.strip().split('\n'):
+                    print(f"   ERROR: {line}")
+            return False, result.stderr.strip()
             
     except Exception as e:
         print(f"   ❌ Error: {str(e)}")
         return False, str(e)
 
-def check_nodejs_installation():
+def build_probe_script(probes, marker):
+    """Build one remote script that runs every probe between delimiters"""
+    lines = []
+    for probe_id, _, command in probes:
+        lines.append(f"echo '{marker} BEGIN {probe_id}'")
+        lines.append(f"( {command} ) 2>&1")
+        # Start the marker on a new line even when the output did not end with one
+        lines.append(f"printf '\\n%s %s\\n' \"{marker} END {probe_id}\" $?")
+    lines.append("exit 0")
+    return "\n".join(lines) + "\n"
+
+def parse_probe_output(output, probes, marker):
+    """Split batched output back into per-probe results"""
+    results = {probe_id: {'id': probe_id, 'section': section, 'command': command,
+                          'exit_code': None, 'output': ''}
+               for probe_id, section, command in probes}
+    current, buffer = None, []
+    for line in output.splitlines():
+        if line.startswith(f"{marker} BEGIN "):
+            current, buffer = line.split(' ', 2)[2], []
+        elif line.startswith(f"{marker} END ") and current:
+            _, _, probe_id, exit_code = line.split(' ', 3)
+            results[probe_id]['exit_code'] = int(exit_code)
+            results[probe_id]['output'] = "\n".join(buffer).strip()
+            current = None
+        elif current:
+            buffer.append(line)
+    return [results[probe_id] for probe_id, _, _ in probes]
+
+@traced('check.batch')
+def run_batched_probes(instance_name, probes=PROBES, timeout=120, region='us-east-1'):
+    """Run all probes in one round trip and return a structured report"""
+    marker = f"@@PROBE-{uuid.uuid4().hex}"
+    script = build_probe_script(probes, marker)
+    success, output = run_command_on_instance(instance_name, script, timeout=timeout, quiet=True, region=region)
+    report = {'instance': instance_name, 'success': success, 'probes': []}
+    if not success:
+        report['error'] = output
+        return report
+    report['probes'] = parse_probe_output(output, probes, marker)
+    return report
+
+def print_probe_report(report):
+    """Print a batched report in the same layout as the sequential check"""
+    if not report['success']:
+        print(f"❌ Could not run probes on {report['instance']}: {report.get('error', '')}")
+        return
+    section = None
+    for probe in report['probes']:
+        if probe['section'] != section:
+            section = probe['section']
+            print(f"\n🔍 {section}:")
+        status = "✅" if probe['exit_code'] == 0 else f"❌ (exit code: {probe['exit_code']})"
+        print(f"🔧 {probe['command']}  {status}")
+        for line in probe['output'].split('\n'):
+            if line:
+                print(f"   {line}")
+
+@traced('check.sequential')
+def check_nodejs_installation(instance_name=DEFAULT_INSTANCE, stream=False, region='us-east-1'):
     """Check Node.js installation status on the Lightsail instance"""
-    instance_name = 'my-app-instance'
-    
     print("🔍 Checking Node.js Installation Status")
     print("=" * 50)
     
-    # Check user_data script execution
-    print("\n📋 Checking user_data script execution logs:")
-    success, output = run_command_on_instance(instance_name, "sudo tail -50 /var/log/cloud-init-output.log")
-    
-    print("\n📋 Checking if user_data completion marker exists:")
-    success, output = run_command_on_instance(instance_name, "ls -la /var/log/user-data-complete.marker")
-    
-    print("\n🔍 Checking Node.js installation:")
-    commands = [
-        "which node",
-        "node --version",
-        "which npm", 
-        "npm --version",
-        "ls -la /usr/bin/node*",
-        "ls -la /usr/bin/npm*",
-        "ls -la /snap/bin/node*",
-        "ls -la /snap/bin/npm*",
-        "echo $PATH"
-    ]
-    
-    for cmd in commands:
-        success, output = run_command_on_instance(instance_name, cmd)
-    
-    print("\n🔍 Checking snap packages:")
-    success, output = run_command_on_instance(instance_name, "snap list | grep node")
-    
-    print("\n🔍 Checking apt packages:")
-    success, output = run_command_on_instance(instance_name, "dpkg -l | grep node")
-    
-    print("\n🔍 Checking if NodeSource repository was added:")
-    success, output = run_command_on_instance(instance_name, "ls -la /etc/apt/sources.list.d/ | grep node")
-    
-    print("\n🔍 Checking system logs for Node.js installation attempts:")
-    success, output = run_command_on_instance(instance_name, "sudo grep -i node /var/log/cloud-init-output.log | tail -20")
+    section = None
+    for probe_id, heading, command in PROBES:
+        if heading != section:
+            section = heading
+            print(f"\n🔍 {heading}:")
+        success, output = run_command_on_instance(instance_name, command, stream=stream, region=region)
+
+    stats = credential_cache.stats()
+    print(f"\n🔑 Access details: {stats['misses']} API call(s), {stats['hits']} cache hit(s)")
+
+@traced('check.agent')
+def collect_snapshots(instance_names, region='us-east-1', services=DEFAULT_SERVICES, tail=20,
+                      max_concurrency=10):
+    """Run the diagnostic probe on every instance concurrently; returns {instance: snapshot}"""
+    engines = [get_session(name, region).engine for name in instance_names]
+
+    async def check_one(session):
+        return await run_probe(session, services, tail)
+
+    reports = run_async(run_on_sessions(engines, check_one, max_concurrency))
+    return {name: report if isinstance(report, dict) else {'success': False, 'error': str(report)}
+            for name, report in zip(instance_names, reports)}
+
+@traced('check.logs')
+def fetch_logs(instance_names, logs=DEFAULT_LOGS, region='us-east-1', grep='', ignore_case=False, tail=20,
+               follow_interval=None, state_path=DEFAULT_STATE_PATH, reset=False, max_concurrency=10):
+    """Print what each log gained since the last run, once or every follow_interval seconds.
+
+    Returns the instances that could not be read.
+    """
+    positions = LogPositions(state_path)
+    sessions = {name: get_session(name, region) for name in instance_names}
+    if reset:
+        for session in sessions.values():
+            positions.forget(session.host)
+    return follow(sessions, positions, logs, grep, ignore_case, tail,
+                  interval=follow_interval or 0, rounds=None if follow_interval else 1,
+                  max_concurrency=max_concurrency)
+
+def target_instances(args):
+    """Instances named by --instances or --tag, else the positional instance"""
+    if args.instances:
+        return [name.strip() for name in args.instances.split(',') if name.strip()]
+    if args.tag:
+        key, _, value = args.tag.partition('=')
+        return find_instances_by_tag(get_client('lightsail', args.region), key, value or None)
+    return [args.instance_name]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check Node.js installation on a Lightsail instance")
+    parser.add_argument('instance_name', nargs='?', default=DEFAULT_INSTANCE)
+    parser.add_argument('--batch', action='store_true',
+                        help="run every probe in a single SSH round trip")
+    parser.add_argument('--json', action='store_true',
+                        help="print the batched report (or agent snapshots) as JSON (implies --batch)")
+    parser.add_argument('--stream', action='store_true',
+                        help="print each command's output as it arrives")
+    parser.add_argument('--region', default='us-east-1')
+    agent = parser.add_argument_group('diagnostic agent')
+    agent.add_argument('--agent', action='store_true',
+                       help="collect one structured snapshot per host with the cached diagnostic probe")
+    agent.add_argument('--instances',
+                       help="comma-separated instances to check (implies --agent unless --logs is given)")
+    agent.add_argument('--tag',
+                       help="check every instance with this tag, Key or Key=Value (implies --agent unless --logs is given)")
+    agent.add_argument('--services', default=','.join(DEFAULT_SERVICES),
+                       help="systemd services to report on, comma-separated")
+    agent.add_argument('--tail', type=int, default=20, help="log lines to include per log")
+    agent.add_argument('--max-concurrency', type=int, default=10)
+    logs = parser.add_argument_group('log follow')
+    logs.add_argument('--logs', nargs='?', const=','.join(DEFAULT_LOGS), metavar='LOGS',
+                      help="print only what these logs gained since the last run; comma-separated file paths "
+                           "or unit:<systemd unit> (default: cloud-init output and the app's journal)")
+    logs.add_argument('--follow', action='store_true', help="keep printing new log lines (implies --logs)")
+    logs.add_argument('--interval', type=float, default=5.0, help="seconds between fetches with --follow")
+    logs.add_argument('--grep', help="only lines matching this regular expression, filtered on the instance")
+    logs.add_argument('--ignore-case', action='store_true')
+    logs.add_argument('--reset', action='store_true',
+                      help="forget where the logs were last read and start again from the last --tail lines")
+    logs.add_argument('--log-state', default=DEFAULT_STATE_PATH, help="where log positions are kept")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    export_on_exit(args)
+
+    if args.logs or args.follow:
+        log_names = [log.strip() for log in (args.logs or ','.join(DEFAULT_LOGS)).split(',') if log.strip()]
+        failed = fetch_logs(target_instances(args), log_names, args.region, args.grep, args.ignore_case,
+                            args.tail, args.interval if args.follow else None, args.log_state, args.reset,
+                            args.max_concurrency)
+        sys.exit(0 if not failed else 1)
+
+    if args.agent or args.instances or args.tag:
+        instance_names = target_instances(args)
+        services = [s.strip() for s in args.services.split(',') if s.strip()]
+        reports = collect_snapshots(instance_names, args.region, services, args.tail, args.max_concurrency)
+        summary = summarize(reports)
+        if args.json:
+            print(json.dumps({'instances': reports, 'summary': summary}, indent=2))
+        else:
+            for instance_name, report in reports.items():
+                print_snapshot(instance_name, report)
+            if len(reports) > 1:
+                print_summary(summary)
+        sys.exit(0 if not summary['failed'] else 1)
+
+    if not (args.batch or args.json):
+        check_nodejs_installation(args.instance_name, stream=args.stream, region=args.region)
+        return
+
+    report = run_batched_probes(args.instance_name, region=args.region)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("🔍 Checking Node.js Installation Status")
+        print("=" * 50)
+        print_probe_report(report)
+    sys.exit(0 if report['success'] else 1)
 
 if __name__ == "__main__":
-    check_nodejs_installation()
+    main()
@@ -4,41 +4,56 @@ Deploy QBR Application to AWS Lightsail Instance
 This script handles the complete deployment of the QBR app to a Lightsail instance.
 """
 
-import boto3
 import json
 import time
 import base64
 import os
 import sys
-import tarfile
 import tempfile
+import argparse
+import shlex
 from pathlib import Path
 
-class LightsailQBRDeployer:
-    def __init__(self, instance_name='lightsail-qbr', region='us-east-1'):
-        self.instance_name = instance_name
-        self.region = region
-        self.client = boto3.client('lightsail', region_name=region)
-        
-    def check_instance_exists(self):
-        """Check if the Lightsail instance exists"""
-        try:
-            response = self.client.get_instance(instanceName=self.instance_name)
-            print(f"✓ Instance '{self.instance_name}' exists")
-            print(f"  State: {response['instance']['state']['name']}")
-            return True
-        except self.client.exceptions.NotFoundException:
-            print(f"✗ Instance '{self.instance_name}' not found")
-            return False
-        except Exception as e:
-            print(f"Error checking instance: {e}")
-            return False
-    
-    def create_instance(self):
-        """Create a new Lightsail instance with LAMP stack"""
-        print(f"Creating Lightsail instance '{self.instance_name}'...")
-        
-        user_data = '''#!/bin/bash
+from lightsail_tools.artifacts import ArtifactCache, link_or_copy, removed_on_failure
+from lightsail_tools.aws import get_client
+from lightsail_tools.checkpoints import StepProgress, checkpointed_script, run_command
+from lightsail_tools.fleet import print_fleet_summary
+from lightsail_tools.loadprobe import LoadProbe, fetch_results, print_results
+from lightsail_tools.migrations import (
+    applied_query, changed_migrations, load_migrations, migration_commands,
+    parse_applied, pending_migrations,
+)
+from lightsail_tools.packaging import EXTENSIONS as PACKAGE_EXTENSIONS, iter_files, write_package
+from lightsail_tools.plan import Plan, source_sizes, write_plans
+from lightsail_tools.provisioning import create_instances, get_snapshot, golden_snapshot_name, provision
+from lightsail_tools.readiness import wait_until_ready
+from lightsail_tools.retry import API_RETRY, FATAL, classify, classify_ssh_result
+from lightsail_tools.ssh import SSHSession
+from lightsail_tools.state import InstanceState, ports_fingerprint
+from lightsail_tools.sync import (
+    MANIFEST_NAME, build_manifest, diff_manifests, dump_manifest,
+    load_manifest, parse_manifest, save_manifest,
+)
+from lightsail_tools.tracing import add_trace_arguments, current_span, export_on_exit, traced
+
+APP_ROOT = '/opt/bitnami/apache/htdocs/qbr-app'
+MIGRATIONS_DIR = 'migrations'
+MYSQL = 'mysql -u qbr_user -pqbr_password_2025 lightsail_qbr'
+# Databases created before migrations were versioned already hold this schema
+BASELINE_MIGRATION = '0001_initial_schema'
+BASELINE_TABLE = 'users'
+BLUEPRINT_ID = 'lamp_8_bitnami'
+BUNDLE_ID = 'nano_3_0'
+PUBLIC_PORTS = (22, 80, 443)
+INSTANCE_TAGS = [
+    {'key': 'Project', 'value': 'QBR-Application'},
+    {'key': 'Environment', 'value': 'Production'},
+]
+# Golden snapshots are named <prefix>-golden-<fingerprint of blueprint, bundle and user data>
+SNAPSHOT_PREFIX = 'qbr'
+
+# First-boot setup, baked into the golden snapshot when provisioning with one
+USER_DATA = '''#!/bin/bash
 # Update system
 apt-get update -y
 
@@ -79,26 +94,81 @@ EOL
 
 echo "Lightsail QBR instance setup completed!"
 '''
+
+# Requested by --load-probe through Apache on the instance
+LOAD_PROBE_URL = 'http://localhost'
+LOAD_PROBE_PATHS = ('/qbr-app/index.php', '/qbr-app/login.php')
+# Relative to the SSH user's home; each probe is compared with the one before
+LOAD_PROBE_RESULTS = '.cache/lightsail-tools/qbr-load-probe.json'
+
+# Runs of deploy-script.sh per deploy; later runs resume after a dropped connection
+RESUME_ATTEMPTS = 3
+
+# Local state kept between runs (skipped by packaging as a hidden directory)
+CACHE_DIR = '.deploy-cache'
+
+class LightsailQBRDeployer:
+    def __init__(self, instance_name='lightsail-qbr', region='us-east-1'):
+        self.instance_name = instance_name
+        self.region = region
+        self.pending_manifest = None
+        self.session = None
+        self._instance_state = None
         
+    @property
+    def client(self):
+        """The shared Lightsail client, created on first use"""
+        return get_client('lightsail', self.region)
+    
+    @property
+    def instance_state(self):
+        """One get_instance per run, shared by every step that needs it"""
+        if self._instance_state is None:
+            self._instance_state = InstanceState(self.client, self.instance_name)
+        return self._instance_state
+    
+    @traced('qbr.check_instance')
+    def check_instance_exists(self):
+        """Check if the Lightsail instance exists"""
         try:
-            response = self.client.create_instances(
-                instanceNames=[self.instance_name],
-                availabilityZone=f'{self.region}a',
-                blueprintId='lamp_8_bitnami',
-                bundleId='nano_3_0',
-                userData=user_data,
-                tags=[
-                    {
-                        'key': 'Project',
-                        'value': 'QBR-Application'
-                    },
-                    {
-                        'key': 'Environment',
-                        'value': 'Production'
-                    }
-                ]
+            instance = self.instance_state.get()
+            if instance is None:
+                print(f"✗ Instance '{self.instance_name}' not found")
+                return False
+            print(f"✓ Instance '{self.instance_name}' exists")
+            print(f"  State: {instance['state']['name']}")
+            return True
+        except Exception as e:
+            print(f"Error checking instance: {e}")
+            return False
+    
+    def golden_snapshot(self):
+        """Name of the golden snapshot if it is available in this region, else None"""
+        name = golden_snapshot_name(SNAPSHOT_PREFIX, BLUEPRINT_ID, BUNDLE_ID, USER_DATA)
+        try:
+            snapshot = get_snapshot(self.client, name)
+        except Exception as e:
+            print(f"Warning: Could not look up golden snapshot: {e}")
+            return None
+        return name if snapshot and snapshot['state'] == 'available' else None
+    
+    @traced('qbr.create_instance')
+    def create_instance(self, use_snapshot=True):
+        """Create a new Lightsail instance with LAMP stack"""
+        print(f"Creating Lightsail instance '{self.instance_name}'...")
+        
+        # Boot already configured when a golden snapshot is available here
+        snapshot_name = self.golden_snapshot() if use_snapshot else None
+        if snapshot_name:
+            print(f"  From golden snapshot {snapshot_name}")
+        
+        try:
+            response = create_instances(
+                self.client, self.region, [self.instance_name], BUNDLE_ID, INSTANCE_TAGS,
+                blueprint_id=BLUEPRINT_ID, user_data=USER_DATA, snapshot_name=snapshot_name,
             )
             
+            self.instance_state.clear()
             print(f"✓ Instance creation initiated")
             print(f"  Operation ID: {response['operations'][0]['id']}")
             
@@ -108,128 +178,360 @@ echo "Lightsail QBR instance setup completed!"
             print(f"✗ Error creating instance: {e}")
             return False
     
+    @traced('qbr.wait_ready')
     def wait_for_instance_ready(self, timeout=1800):  # 30 minutes
-        """Wait for instance to be running and ready"""
+        """Wait for instance to be running and ready.
+
+        Returns as soon as Lightsail reports the instance running, SSH is
+        reachable, user data has finished and Apache answers over HTTP.
+        """
         print(f"Waiting for instance '{self.instance_name}' to be ready...")
         
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            try:
-                response = self.client.get_instance(instanceName=self.instance_name)
-                state = response['instance']['state']['name']
-                
-                if state == 'running':
-                    print(f"✓ Instance is running")
-                    # Additional wait for services to initialize
-                    print("Waiting for services to initialize...")
-                    time.sleep(120)  # Wait 2 minutes for services
-                    return True
-                elif state in ['pending', 'starting']:
-                    print(f"  Instance state: {state} (waiting...)")
-                    time.sleep(30)
-                else:
-                    print(f"✗ Unexpected instance state: {state}")
-                    return False
-                    
-            except Exception as e:
-                print(f"Error checking instance state: {e}")
-                time.sleep(30)
+        report = wait_until_ready(
+            self.client, self.instance_name, self.region, timeout=timeout,
+            health_url='http://{ip}/',
+        )
+        report.print_summary()
+        if report.instance is not None:
+            self.instance_state.update(report.instance)
         
-        print(f"✗ Timeout waiting for instance to be ready")
+        if report.ready:
+            print(f"✓ Instance is ready")
+            return True
+        print(f"✗ Instance did not become ready ({report.failed_phase})")
         return False
     
+    def desired_ports(self):
+        return [(port, port, 'tcp') for port in PUBLIC_PORTS]
+    
+    def ports_configured(self):
+        """Whether exactly PUBLIC_PORTS are open over TCP; None if it cannot be told"""
+        try:
+            current = self.instance_state.ports()
+        except Exception as e:
+            print(f"Warning: Could not read instance ports: {e}")
+            return None
+        return ports_fingerprint(current) == ports_fingerprint(self.desired_ports())
+    
+    @traced('qbr.ports')
     def configure_instance_ports(self):
-        """Configure firewall ports for the instance"""
+        """Configure firewall ports for the instance, unless they already match"""
+        if self.ports_configured():
+            print(f"✓ Instance ports already configured ({', '.join(map(str, PUBLIC_PORTS))})")
+            return True
         try:
-            self.client.put_instance_public_ports(
+            API_RETRY.call(lambda: self.client.put_instance_public_ports(
                 instanceName=self.instance_name,
                 portInfos=[
-                    {
-                        'fromPort': 22,
-                        'toPort': 22,
-                        'protocol': 'tcp'
-                    },
-                    {
-                        'fromPort': 80,
-                        'toPort': 80,
-                        'protocol': 'tcp'
-                    },
-                    {
-                        'fromPort': 443,
-                        'toPort': 443,
-                        'protocol': 'tcp'
-                    }
+                    {'fromPort': f, 'toPort': t, 'protocol': p} for f, t, p in self.desired_ports()
                 ]
-            )
-            print("✓ Configured instance ports (22, 80, 443)")
+            ))
+            self.instance_state.record_ports(self.desired_ports())
+            print(f"✓ Configured instance ports ({', '.join(map(str, PUBLIC_PORTS))})")
             return True
         except Exception as e:
             print(f"Warning: Could not configure ports: {e}")
             return False
     
-    def create_deployment_package(self):
-        """Create a deployment package of the QBR application"""
+    @traced('qbr.package')
+    def create_deployment_package(self, compression='gzip', level=6, threads=None, use_cache=True):
+        """Create a deployment package of the QBR application.
+
+        Files are streamed into the archive one at a time and compressed on
+        several threads, so memory use does not grow with the tree. When
+        the inputs match a previous build, the cached archive is reused.
+        """
         print("Creating deployment package...")
         
-        # Create temporary tar file
-        package_path = 'qbr-deployment.tar.gz'
+        suffix = PACKAGE_EXTENSIONS[compression]
+        package_path = 'qbr-deployment' + suffix
         
-        with tarfile.open(package_path, 'w:gz') as tar:
-            # Add all application files
-            for root, dirs, files in os.walk('.'):
-                # Skip .git, .github, and other non-essential directories
-                dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__']
-                
-                for file in files:
-                    if not file.startswith('.') and not file.endswith(('.tar.gz', '.pyc')):
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, '.')
-                        tar.add(file_path, arcname=arcname)
+        # Skip .git, .github, other hidden entries and earlier packages
+        paths = list(iter_files('.', exclude_suffixes=('.pyc',) + tuple(PACKAGE_EXTENSIONS.values())))
         
-        print(f"✓ Created deployment package: {package_path}")
-        return package_path
-    
-    def deploy_application_files(self):
-        """Deploy application files to the Lightsail instance"""
-        print("Deploying QBR application files...")
+        cache = ArtifactCache(os.path.join(CACHE_DIR, 'artifacts')) if use_cache else None
+        if cache:
+            key = cache.fingerprint('.', paths, {'compression': compression, 'level': level})
+            cached_path = cache.get(key, suffix)
+            if cached_path:
+                link_or_copy(cached_path, package_path)
+                print(f"✓ Reused cached deployment package: {package_path} ({key[:12]})")
+                return package_path
+            build_path = cache.temp_path(suffix)
+        else:
+            build_path = package_path
+            # May be a hard link into the cache; never write through it
+            if os.path.exists(build_path):
+                os.unlink(build_path)
         
-        # Create deployment commands
-        commands = [
-            # Create directory structure
-            "sudo mkdir -p /opt/bitnami/apache/htdocs/qbr-app/{admin,assets/css,assets/js,config,includes}",
-            "sudo chown -R bitnami:daemon /opt/bitnami/apache/htdocs/qbr-app",
-        ]
+        with removed_on_failure(build_path), open(build_path, 'wb') as package_file:
+            write_package('.', package_file, paths, compression=compression, level=level, threads=threads)
+        
+        if cache:
+            link_or_copy(cache.put(key, suffix, build_path), package_path)
         
-        # Read and deploy each file
-        app_files = {}
+        print(f"✓ Created deployment package: {package_path} ({os.path.getsize(package_path)} bytes)")
+        return package_path
+    
+    def open_session(self):
+        """Open the pooled SSH session used for manifests, uploads and commands"""
+        if self.session is None:
+            self.session = SSHSession(self.client, self.instance_name, self.region)
+        self.session.open()
+        return self.session
+    
+    def close_session(self):
+        """Close the pooled SSH session"""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+    
+    def read_remote_manifest(self):
+        """Return the manifest of the deployed files, None if there is none;
+        raises RuntimeError if the instance cannot be asked"""
+        try:
+            result = self.open_session().run(f"cat {APP_ROOT}/{MANIFEST_NAME} 2>/dev/null || true", timeout=60)
+        except Exception as e:
+            raise RuntimeError(f"remote manifest could not be read: {e}")
+        if result.returncode != 0:
+            raise RuntimeError(f"remote manifest could not be read: {result.stderr.strip() or result.returncode}")
+        return parse_manifest(result.stdout)
+    
+    def fetch_remote_manifest(self, use_cache=False):
+        """Return the manifest of the deployed files, or None for a full deploy.
+
+        The instance is asked first. If it cannot be reached, the files are
+        all deployed again, or with use_cache set the manifest saved by the
+        last successful deploy from this machine is used instead.
+        """
+        try:
+            return self.read_remote_manifest()
+        except RuntimeError as e:
+            print(f"Warning: {e}")
+        if not use_cache:
+            return None
+        cached = load_manifest(self.manifest_cache_path)
+        if cached is not None:
+            print("Warning: Using the manifest cached by the last deploy from this machine; "
+                  "files changed on the instance since then will not be redeployed")
+        return cached
+    
+    def app_manifest(self):
+        """Hash every deployable file in the checkout"""
+        app_paths = []
         for root, dirs, files in os.walk('.'):
-            # Skip hidden directories and files
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            # Skip hidden directories and files; migrations are applied, not served
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d != MIGRATIONS_DIR]
             
             for file in files:
                 if file.endswith(('.php', '.sql', '.css', '.js', '.html', '.md')):
-                    file_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(file_path, '.')
-                    
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            app_files[rel_path] = content
-                    except Exception as e:
-                        print(f"Warning: Could not read {file_path}: {e}")
+                    app_paths.append(os.path.relpath(os.path.join(root, file), '.'))
+        return build_manifest('.', app_paths)
+    
+    @property
+    def manifest_cache_path(self):
+        return os.path.join(CACHE_DIR, f"{self.instance_name}-{self.region}-manifest.json")
+    
+    def bundle_price(self):
+        """Monthly USD price of BUNDLE_ID, or None if it cannot be looked up"""
+        try:
+            response = API_RETRY.call(lambda: self.client.get_bundles(includeInactive=False))
+        except Exception as e:
+            print(f"Warning: Could not look up bundle price: {e}")
+            return None
+        for bundle in response.get('bundles', []):
+            if bundle.get('bundleId') == BUNDLE_ID:
+                return bundle.get('price')
+        return None
+    
+    @traced('qbr.plan')
+    def plan_deployment(self, full=False):
+        """Compare the instance, its ports, files and database with this checkout.
+
+        Raises if any of them cannot be read; only an instance Lightsail
+        reports as not found is planned as a new one.
+        """
+        plan = Plan(self.instance_name)
+        exists = self.instance_state.get() is not None
+        if exists:
+            plan.keep('instance', "exists")
+        else:
+            price = self.bundle_price()
+            cost = f", ${price:.2f}/month" if price is not None else ""
+            plan.change('instance', f"create {BUNDLE_ID} {BLUEPRINT_ID} instance{cost}", remote_steps=0)
         
-        print(f"✓ Prepared {len(app_files)} application files")
+        if exists and self.ports_configured():
+            plan.keep('ports', f"{', '.join(map(str, PUBLIC_PORTS))} open")
+        else:
+            plan.change('ports', f"open {', '.join(map(str, PUBLIC_PORTS))}", remote_steps=0)
         
-        # For each file, create a command to write it to the instance
-        for rel_path, content in app_files.items():
-            target_path = f"/opt/bitnami/apache/htdocs/qbr-app/{rel_path}"
-            
-            # Escape content for shell
-            escaped_content = content.replace("'", "'\"'\"'").replace('\n', '\\n')
+        local_manifest = self.app_manifest()
+        remote_manifest = self.read_remote_manifest() if exists and not full else None
+        added, changed, deleted = diff_manifests(local_manifest, remote_manifest)
+        if remote_manifest is None:
+            plan.change('files', f"full deploy of {len(added)} files", source_sizes('.', added), remote_steps=2)
+        elif added or changed or deleted:
+            plan.change('files', f"{len(added)} added, {len(changed)} changed, {len(deleted)} deleted",
+                        source_sizes('.', added + changed), remote_steps=2)
+        else:
+            plan.keep('files', f"{len(local_manifest)} files up to date")
+        
+        pending = self.pending_database_migrations(remote=exists, strict=True)
+        if pending:
+            plan.change('migrations', f"apply {', '.join(m.version for m in pending)}")
+        else:
+            plan.keep('migrations')
+        
+        if plan.changes('files') or plan.changes('migrations'):
+            plan.change('apache', "restart apache")
+        else:
+            plan.keep('apache', "running")
+        return plan
+    
+    @traced('qbr.files')
+    def deploy_application_files(self, full=False, bulk=True, cached_manifest=False):
+        """Deploy application files to the Lightsail instance.
+
+        With bulk set, changed files are uploaded as one archive over SSH and
+        the returned commands only unpack it; otherwise every file is
+        embedded in the commands as a heredoc. cached_manifest allows the
+        local manifest cache to stand in for an unreachable instance's.
+        """
+        print("Deploying QBR application files...")
+        
+        # Hash every deployable file and compare with what is on the instance
+        local_manifest = self.app_manifest()
+        remote_manifest = None if full else self.fetch_remote_manifest(use_cache=cached_manifest)
+        added, changed, deleted = diff_manifests(local_manifest, remote_manifest)
+        if remote_manifest is None:
+            print(f"✓ Full deploy of {len(added)} application files")
+        else:
+            print(f"✓ Delta deploy: {len(added)} added, {len(changed)} changed, "
+                  f"{len(deleted)} deleted, {len(local_manifest) - len(added) - len(changed)} unchanged")
+        
+        if remote_manifest is not None and not (added or changed or deleted):
+            commands = []
+        elif bulk:
+            commands = self.bulk_file_commands(added + changed, deleted, local_manifest)
+            if commands is None:
+                return None
+        else:
+            commands = self.per_file_commands(added + changed, deleted, local_manifest)
+        self.pending_manifest = local_manifest
+        
+        # Only migrations the instance has not applied yet
+        db_commands = self.database_migration_commands()
+        if db_commands is None:
+            return None
+        commands.extend(db_commands)
+        if commands:
+            commands.append("sudo /opt/bitnami/ctlscript.sh restart apache")
+        
+        print(f"✓ Prepared {len(commands)} deployment commands")
+        return commands
+    
+    def fetch_applied_migrations(self):
+        """Return {version: checksum} of migrations applied on the instance, or
+        None if the instance cannot be reached; raises RuntimeError if mysql fails"""
+        try:
+            result = self.open_session().run(applied_query(MYSQL), timeout=60)
+        except Exception as e:
+            print(f"Warning: Could not read applied migrations: {e}")
+            return None
+        if result.returncode != 0:
+            raise RuntimeError(f"mysql could not read applied migrations: "
+                               f"{result.stderr.strip() or f'exit code {result.returncode}'}")
+        return parse_applied(result.stdout)
+    
+    def pending_database_migrations(self, remote=True, strict=False):
+        """Migrations the instance has not applied; all of them if it cannot be
+        reached, or with strict set a RuntimeError. A mysql failure on the
+        instance always raises RuntimeError."""
+        migrations = load_migrations(MIGRATIONS_DIR)
+        applied = self.fetch_applied_migrations() if remote else None
+        if applied is None:
+            if remote and strict:
+                raise RuntimeError("applied migrations could not be read")
+            return migrations
+        for migration in changed_migrations(migrations, applied):
+            print(f"Warning: Migration {migration.version} changed after it was applied; "
+                  f"add a new migration instead")
+        return pending_migrations(migrations, applied)
+    
+    @traced('qbr.migrations')
+    def database_migration_commands(self):
+        """Return commands applying pending migrations; empty when there are none.
+
+        If the instance cannot be asked, every migration is included and the
+        commands skip the ones already recorded when they run.
+        """
+        try:
+            pending = self.pending_database_migrations()
+        except Exception as e:
+            print(f"✗ Error loading migrations: {e}")
+            return None
+        if not pending:
+            print("✓ Database is up to date, skipping migrations")
+            return []
+        print(f"✓ {len(pending)} pending migrations: {', '.join(m.version for m in pending)}")
+        return migration_commands(pending, MYSQL, baseline=BASELINE_MIGRATION, baseline_table=BASELINE_TABLE)
+    
+    @traced('qbr.upload')
+    def bulk_file_commands(self, paths, deleted, manifest):
+        """Upload paths as one archive and return the commands that apply it"""
+        remote_archive = '/tmp/qbr-app-update.tar.gz'
+        extra = {MANIFEST_NAME: dump_manifest(manifest)}
+        
+        def write(stdin):
+            write_package('.', stdin, paths=paths, extra=extra)
+        
+        try:
+            result = self.open_session().stream(f"cat > {remote_archive}", write, timeout=600)
+        except Exception as e:
+            print(f"✗ Error uploading application files: {e}")
+            return None
+        if result.returncode != 0:
+            print(f"✗ Failed to upload application files: {result.stderr.strip()}")
+            return None
+        print(f"✓ Uploaded {len(paths)} application files in one archive")
+        
+        commands = [
+            f"sudo mkdir -p {APP_ROOT}",
+            f"sudo tar -xzf {remote_archive} -C {APP_ROOT} --no-same-owner",
+            f"rm -f {remote_archive}",
+        ]
+        if deleted:
+            quoted = ' '.join(shlex.quote(p) for p in deleted)
+            commands.append(f"cd {APP_ROOT} && sudo rm -f -- {quoted}")
+        # One recursive pass: directories 755, files 644, owned by bitnami:daemon
+        commands.append(f"sudo chown -R bitnami:daemon {APP_ROOT} && sudo chmod -R u=rwX,go=rX {APP_ROOT}")
+        return commands
+    
+    def per_file_commands(self, paths, deleted, manifest):
+        """Return commands that write every file through its own heredoc"""
+        commands = [
+            # Create directory structure
+            f"sudo mkdir -p {APP_ROOT}/{{admin,assets/css,assets/js,config,includes}}",
+            f"sudo chown -R bitnami:daemon {APP_ROOT}",
+        ]
+        
+        # Read only the files that have to be transferred, one at a time
+        prepared = 0
+        for rel_path in paths:
+            file_path = os.path.join('.', rel_path)
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except Exception as e:
+                print(f"Warning: Could not read {file_path}: {e}")
+                manifest.pop(rel_path, None)
+                continue
+            prepared += 1
+            target_path = f"{APP_ROOT}/{rel_path}"
             
             # Create directory if needed
             dir_path = os.path.dirname(target_path)
-            if dir_path != "/opt/bitnami/apache/htdocs/qbr-app":
+            if dir_path != APP_ROOT:
                 commands.append(f"sudo mkdir -p '{dir_path}'")
             
             # Write file content
@@ -237,48 +539,100 @@ echo "Lightsail QBR instance setup completed!"
             commands.append(f"sudo chown bitnami:daemon '{target_path}'")
             commands.append(f"sudo chmod 644 '{target_path}'")
         
-        # Database setup commands
-        db_commands = [
-            "mysql -u qbr_user -pqbr_password_2025 lightsail_qbr < /opt/bitnami/apache/htdocs/qbr-app/setup-database.sql",
-            "sudo /opt/bitnami/ctlscript.sh restart apache",
-        ]
+        print(f"✓ Prepared {prepared} application files")
         
-        commands.extend(db_commands)
+        for rel_path in deleted:
+            commands.append(f"sudo rm -f '{APP_ROOT}/{rel_path}'")
         
-        print(f"✓ Prepared {len(commands)} deployment commands")
+        # Record what is now deployed
+        manifest_json = dump_manifest(manifest).decode()
+        commands.append(f"sudo tee '{APP_ROOT}/{MANIFEST_NAME}' > /dev/null << 'EOF'\n{manifest_json}\nEOF")
         return commands
     
-    def execute_deployment_commands(self, commands):
-        """Execute deployment commands on the instance"""
+    @traced('qbr.execute')
+    def execute_deployment_commands(self, commands, remote=True):
+        """Execute deployment commands on the instance.
+
+        The commands are always written to deploy-script.sh as a
+        checkpointed script (see lightsail_tools.checkpoints); with remote
+        set it is also sent over the pooled SSH session and run there. If the
+        connection drops, the session is reopened and the same script run
+        again, resuming at the step that was interrupted.
+        """
         print("Executing deployment commands...")
         
-        # For now, we'll create a deployment script that can be run manually
-        # In a production environment, you would use SSH or AWS Systems Manager
-        
-        script_content = "#!/bin/bash\nset -e\n\n"
-        script_content += "echo 'Starting QBR application deployment...'\n\n"
-        
-        for i, cmd in enumerate(commands):
-            script_content += f"echo 'Step {i+1}/{len(commands)}: Executing command...'\n"
-            script_content += f"{cmd}\n"
-            script_content += "echo 'Step completed successfully'\n\n"
-        
-        script_content += "echo 'QBR application deployment completed successfully!'\n"
+        script_content = checkpointed_script(commands, title='QBR application deployment')
         
         # Save deployment script
         with open('deploy-script.sh', 'w') as f:
             f.write(script_content)
         
         print("✓ Created deployment script: deploy-script.sh")
-        print("  Note: In production, this would be executed automatically via SSH/SSM")
+        
+        if remote and not commands:
+            print("✓ Instance is up to date, nothing to run")
+        elif remote:
+            # Show the script's progress as it runs rather than once it exits
+            with StepProgress(prefix="  ", max_lines=50) as progress:
+                for attempt in range(1, RESUME_ATTEMPTS + 1):
+                    try:
+                        result = self.open_session().stream(
+                            run_command(), lambda stdin: stdin.write(script_content.encode()), output=progress,
+                        )
+                        dropped = classify_ssh_result(result) is not None
+                        error = result.stderr.strip()
+                    except Exception as e:
+                        result, dropped, error = None, classify(e) != FATAL, str(e)
+                    if not dropped or attempt == RESUME_ATTEMPTS:
+                        break
+                    print(f"Warning: Connection lost ({error.splitlines()[-1] if error else 'no output'}); "
+                          f"resuming deployment ({attempt}/{RESUME_ATTEMPTS - 1})...")
+                    self.close_session()
+                current_span().set(attempts=attempt, step_ms=progress.timings,
+                                   resumed_steps=len(progress.skipped - set(progress.timings)))
+                progress.print_summary()
+            if result is None:
+                print(f"✗ Error running deployment script: {error}")
+                return False
+            if result.returncode != 0:
+                step = f" at step {progress.failed}/{progress.total}" if progress.failed else ""
+                print(f"✗ Deployment script failed{step} (exit code: {result.returncode}); "
+                      f"run the deployment again to resume from there")
+                return False
+            print("✓ Deployment script completed on the instance")
+        else:
+            print("  Note: Run deploy-script.sh on the instance to complete the deployment; "
+                  "if it stops, running it again resumes at the failed step")
+        
+        # Only once the instance has these files; a script left to run by hand may never run
+        if remote and self.pending_manifest is not None:
+            save_manifest(self.manifest_cache_path, self.pending_manifest)
+        self.pending_manifest = None
         
         return True
     
+    @traced('qbr.load_probe')
+    def check_load(self, load_probe):
+        """Probe the deployed app under load; returns regressions against the previous deploy"""
+        session = self.open_session()
+        baseline = fetch_results(session, LOAD_PROBE_RESULTS)
+        try:
+            results = load_probe.run(session, LOAD_PROBE_RESULTS)
+        except Exception as e:
+            print(f"Warning: Load probe failed: {e}")
+            return []
+        regressions = load_probe.compare(results, baseline)
+        print_results(results, baseline, regressions)
+        return regressions
+    
+    @traced('qbr.info')
     def get_instance_info(self):
         """Get instance information and access details"""
         try:
-            response = self.client.get_instance(instanceName=self.instance_name)
-            instance = response['instance']
+            instance = self.instance_state.get()
+            if instance is None:
+                print(f"Error getting instance information: '{self.instance_name}' not found")
+                return False
             
             print("\n" + "="*50)
             print("QBR APPLICATION DEPLOYMENT SUMMARY")
@@ -311,17 +665,104 @@ echo "Lightsail QBR instance setup completed!"
             print(f"Error getting instance information: {e}")
             return False
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Deploy the QBR application to Lightsail")
+    parser.add_argument('--instance-name', default='lightsail-qbr')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--full', action='store_true',
+                        help="redeploy every file instead of only changed ones")
+    parser.add_argument('--package', action='store_true',
+                        help="also build a qbr-deployment archive of the whole checkout; deploys do not "
+                             "need it, they upload only the changed files")
+    parser.add_argument('--compression', choices=sorted(PACKAGE_EXTENSIONS), default='gzip',
+                        help="--package compression (default: gzip)")
+    parser.add_argument('--compression-level', type=int, default=6)
+    parser.add_argument('--compression-threads', type=int,
+                        help="compression threads (default: one per CPU)")
+    parser.add_argument('--no-package-cache', action='store_true',
+                        help="always rebuild the --package archive")
+    parser.add_argument('--script-only', action='store_true',
+                        help="only write a self-contained deploy-script.sh to run by hand")
+    parser.add_argument('--cached-manifest', action='store_true',
+                        help="if the instance cannot be reached, diff against the manifest saved by "
+                             "the last successful deploy from this machine instead of deploying every file")
+    parser.add_argument('--plan', action='store_true',
+                        help="only show what would change; exits 0 if nothing would, 2 if something would")
+    parser.add_argument('--plan-json', metavar='PATH', help="with --plan, also write the plan as JSON")
+    load = parser.add_argument_group('load probe')
+    load.add_argument('--load-probe', action='store_true',
+                      help="after deploying, measure latency and throughput under a request burst "
+                           "and compare with the previous deploy; exits 1 if it regressed")
+    load.add_argument('--load-paths', default=','.join(LOAD_PROBE_PATHS),
+                      help="comma-separated paths to request (default: %(default)s)")
+    load.add_argument('--load-requests', type=int, default=100, help="requests per path")
+    load.add_argument('--load-concurrency', type=int, default=10)
+    load.add_argument('--regression-threshold', type=float, default=0.2,
+                      help="relative latency increase or throughput drop that counts as a regression (0-1)")
+    provisioning = parser.add_argument_group('provisioning')
+    provisioning.add_argument('--provision', metavar='NAMES',
+                              help="only create these comma-separated instances in every --regions region "
+                                   "and wait until they are ready")
+    provisioning.add_argument('--regions', help="comma-separated regions for --provision (default: --region)")
+    provisioning.add_argument('--source-region',
+                              help="region the golden snapshot is built in (default: first of --regions)")
+    provisioning.add_argument('--no-snapshot', action='store_true',
+                              help="boot the blueprint and run user data instead of using the golden snapshot")
+    provisioning.add_argument('--max-concurrency', type=int, default=10,
+                              help="instances waited on at once per region")
+    add_trace_arguments(parser)
+    return parser.parse_args()
+
+def provision_instances(args):
+    """Create instances in several regions at once, from the golden snapshot by default"""
+    names = [name.strip() for name in args.provision.split(',') if name.strip()]
+    regions = [region.strip() for region in (args.regions or args.region).split(',') if region.strip()]
+    if not names or not regions:
+        print("✗ Nothing to provision")
+        return False
+    print(f"Provisioning {len(names)} instance(s) in {len(regions)} region(s)"
+          f"{'' if args.no_snapshot else ' from the golden snapshot'}")
+    started = time.time()
+    results = provision(
+        {region: names for region in regions}, BLUEPRINT_ID, BUNDLE_ID, USER_DATA, INSTANCE_TAGS,
+        snapshot_prefix=None if args.no_snapshot else SNAPSHOT_PREFIX,
+        source_region=args.source_region, health_url='http://{ip}/',
+        max_concurrency=args.max_concurrency,
+    )
+    print_fleet_summary(results)
+    print(f"Provisioned in {time.time() - started:.1f}s")
+    return all(r.succeeded for r in results)
+
 def main():
     """Main deployment function"""
+    args = parse_args()
+    export_on_exit(args)
+    
     print("AWS Lightsail QBR Application Deployer")
     print("="*40)
     
-    deployer = LightsailQBRDeployer()
+    if args.provision:
+        sys.exit(0 if provision_instances(args) else 1)
+    
+    deployer = LightsailQBRDeployer(args.instance_name, args.region)
+    
+    if args.plan:
+        try:
+            plan = deployer.plan_deployment(full=args.full)
+        except Exception as e:
+            print(f"✗ Could not plan deployment: {e}")
+            sys.exit(1)
+        finally:
+            deployer.close_session()
+        plan.print_summary()
+        if args.plan_json:
+            write_plans(args.plan_json, [plan])
+        sys.exit(2 if plan.changed else 0)
     
     # Check if instance exists
     if not deployer.check_instance_exists():
         print("\nCreating new Lightsail instance...")
-        if not deployer.create_instance():
+        if not deployer.create_instance(use_snapshot=not args.no_snapshot):
             print("Failed to create instance")
             sys.exit(1)
         
@@ -333,22 +774,49 @@ def main():
     # Configure ports
     deployer.configure_instance_ports()
     
-    # Create deployment package
-    package_path = deployer.create_deployment_package()
+    # Bulk deploys stream their own archive of the changed files; a full
+    # package is only built when asked for
+    package_path = None
+    if args.package:
+        package_path = deployer.create_deployment_package(
+            args.compression, args.compression_level, args.compression_threads,
+            use_cache=not args.no_package_cache,
+        )
     
-    # Deploy application
-    commands = deployer.deploy_application_files()
-    deployer.execute_deployment_commands(commands)
+    # Deploy application (only changed files unless --full is given)
+    remote = not args.script_only
+    try:
+        commands = deployer.deploy_application_files(full=args.full, bulk=remote,
+                                                     cached_manifest=args.cached_manifest)
+        if commands is None or not deployer.execute_deployment_commands(commands, remote=remote):
+            print("Deployment failed")
+            sys.exit(1)
+        regressions = []
+        if args.load_probe and remote:
+            regressions = deployer.check_load(LoadProbe(
+                LOAD_PROBE_URL, [path.strip() for path in args.load_paths.split(',') if path.strip()],
+                args.load_requests, args.load_concurrency, args.regression_threshold,
+            ))
+    finally:
+        deployer.close_session()
     
     # Show final status
     deployer.get_instance_info()
     
-    print(f"\n📦 Deployment package created: {package_path}")
+    print()
+    if package_path:
+        print(f"📦 Deployment package created: {package_path}")
     print("📜 Deployment script created: deploy-script.sh")
-    print("\nTo complete deployment, run the deployment script on the instance:")
-    print("1. SSH into the instance")
-    print("2. Upload and run deploy-script.sh")
-    print("3. Access the application via the URLs shown above")
+    if args.script_only:
+        print("\nTo complete deployment, run the deployment script on the instance:")
+        print("1. SSH into the instance")
+        print("2. Upload and run deploy-script.sh")
+        print("3. Access the application via the URLs shown above")
+    
+    # The files are live either way; fail the run so CI sees the regression
+    if regressions:
+        print("\n✗ Deployed with a performance regression against the previous deploy")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -6,169 +6,111 @@ AWS Lightsail Deployment using Run Commands
 Deploy application to Lightsail instance using AWS run commands instead of SSH keys.
 """
 
-import boto3
-import subprocess
-import tempfile
 import os
 import time
 import sys
 import json
 import base64
+import argparse
+import tempfile
 
-class LightsailDeployer:
-    def __init__(self, instance_name, region='us-east-1'):
-        self.lightsail = boto3.client('lightsail', region_name=region)
-        self.instance_name = instance_name
-        self.region = region
-    
-    def run_command(self, command, timeout=300):
-        """Execute command on Lightsail instance using get_instance_access_details"""
-        try:
-            print(f"🔧 Running: {command[:100]}{'...' if len(command) > 100 else ''}")
-            
-            # Get SSH access details
-            ssh_response = self.lightsail.get_instance_access_details(instanceName=self.instance_name)
-            ssh_details = ssh_response['accessDetails']
-            
-            # Create temporary SSH key files
-            key_path, cert_path = self.create_ssh_files(ssh_details)
-            
-            try:
-                ssh_cmd = [
-                    'ssh', '-i', key_path, '-o', f'CertificateFile={cert_path}',
-                    '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
-                    '-o', 'ConnectTimeout=15', '-o', 'IdentitiesOnly=yes',
-                    f'{ssh_details["username"]}@{ssh_details["ipAddress"]}', command
-                ]
-                
-                result = subprocess.run(ssh_cmd, capture_output=True, text=True, timeout=timeout)
-                
-                if result.returncode == 0:
-                    print(f"   ✅ Success")
-                    if result.stdout.strip():
-                        # Limit output for readability
-                        lines = result.stdout.strip().split('\n')
-                        for line in lines[:20]:  # Show first 20 lines
-                            print(f"   {line}")
-                        if len(lines) > 20:
-                            print(f"   ... ({len(lines) - 20} more lines)")
-                    return True, result.stdout.strip()
-                else:
-                    print(f"   ❌ Failed (exit code: {result.returncode})")
-                    if result.stderr.strip():
-                        print(f"   Error: {result.stderr.strip()}")
-                    return False, result.stderr.strip()
-                
-            finally:
-                # Clean up temporary files
-                try:
-                    os.unlink(key_path)
-                    os.unlink(cert_path)
-                except:
-                    pass
-                
-        except Exception as e:
-            print(f"   ❌ Error: {str(e)}")
-            return False, str(e)
+from lightsail_tools.aws import get_client
+from lightsail_tools.fleet import find_instances_by_tag, print_fleet_summary, run_fleet
+from lightsail_tools.loadprobe import (
+    DEFAULT_PATHS as LOAD_PROBE_PATHS, RESULTS_NAME, LoadProbe, fetch_results, print_results,
+)
+from lightsail_tools.packaging import iter_files, write_package
+from lightsail_tools.plan import Plan, source_sizes, write_plans
+from lightsail_tools.readiness import poll
+from lightsail_tools.ssh import OutputStream, SSHSession, create_ssh_files
+from lightsail_tools.state import fingerprint
+from lightsail_tools.sync import (
+    MANIFEST_NAME, build_delta_archive, build_manifest, diff_manifests,
+    dump_manifest, manifest_from_archive, parse_manifest,
+)
+from lightsail_tools.tracing import add_trace_arguments, export_on_exit, span, traced
 
-    def create_ssh_files(self, ssh_details):
-        """Create temporary SSH key files"""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.pem', delete=False) as key_file:
-            key_file.write(ssh_details['privateKey'])
-            key_path = key_file.name
-        
-        cert_path = key_path + '-cert.pub'
-        cert_parts = ssh_details['certKey'].split(' ', 2)
-        formatted_cert = f'{cert_parts[0]} {cert_parts[1]}\n' if len(cert_parts) >= 2 else ssh_details['certKey'] + '\n'
-        
-        with open(cert_path, 'w') as cert_file:
-            cert_file.write(formatted_cert)
-        
-        os.chmod(key_path, 0o600)
-        os.chmod(cert_path, 0o600)
-        
-        return key_path, cert_path
+APP_DIR = '/var/www/lightsail-demo-app'
+RELEASES_DIR = f'{APP_DIR}/releases'
+CURRENT_DIR = f'{APP_DIR}/current'
+SHARED_DIR = f'{APP_DIR}/shared'
+KEEP_RELEASES = 5
+# node_modules trees keyed by lockfile hash and Node version
+DEPENDENCY_CACHE_DIR = f'{SHARED_DIR}/node_modules-cache'
+KEEP_DEPENDENCY_SETS = 3
+ARCHIVE_PREFIX = 'app/'
+# Not shipped when deploying from a directory; dependencies are installed remotely
+SOURCE_EXCLUDE_DIRS = ('__pycache__', 'node_modules')
+HEALTH_CHECK_COMMAND = "curl -fsS -o /dev/null --max-time 5 http://localhost:3000/health"
+SERVICE_FILE = '/etc/systemd/system/lightsail-demo-app.service'
 
-    def copy_file_to_instance(self, local_path, remote_path):
-        """Copy file to instance using SCP"""
-        try:
-            print(f"📤 Copying {local_path} to {remote_path}")
-            
-            ssh_response = self.lightsail.get_instance_access_details(instanceName=self.instance_name)
-            ssh_details = ssh_response['accessDetails']
-            
-            key_path, cert_path = self.create_ssh_files(ssh_details)
-            
-            try:
-                scp_cmd = [
-                    'scp', '-i', key_path, '-o', f'CertificateFile={cert_path}',
-                    '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
-                    '-o', 'ConnectTimeout=15', '-o', 'IdentitiesOnly=yes',
-                    local_path, f'{ssh_details["username"]}@{ssh_details["ipAddress"]}:{remote_path}'
-                ]
-                
-                result = subprocess.run(scp_cmd, capture_output=True, text=True, timeout=300)
-                
-                if result.returncode == 0:
-                    print(f"   ✅ File copied successfully")
-                    return True
-                else:
-                    print(f"   ❌ Failed to copy file (exit code: {result.returncode})")
-                    if result.stderr.strip():
-                        print(f"   Error: {result.stderr.strip()}")
-                    return False
-                
-            finally:
-                try:
-                    os.unlink(key_path)
-                    os.unlink(cert_path)
-                except:
-                    pass
-                
-        except Exception as e:
-            print(f"   ❌ Error copying file: {str(e)}")
-            return False
+NODE_PATH_SCRIPT = '''NODE_PATH=$(which node || echo "")
+if [ -z "$NODE_PATH" ]; then
+    if [ -f "/usr/bin/node" ]; then
+        NODE_PATH="/usr/bin/node"
+    elif [ -f "/snap/bin/node" ]; then
+        NODE_PATH="/snap/bin/node"
+    fi
+fi
+'''
 
-    def deploy_application(self, app_archive_path, env_vars=None):
-        """Deploy application to Lightsail instance"""
-        print("🚀 Starting application deployment...")
-        
-        # Copy application archive to instance
-        if not self.copy_file_to_instance(app_archive_path, '/tmp/app.tar.gz'):
-            return False
-        
-        # Stop existing application
-        print("🛑 Stopping existing application...")
-        self.run_command("sudo systemctl stop lightsail-demo-app || true")
-        
-        # Extract and deploy application
-        deployment_script = f'''
-set -e
+# Rendered with the instance's node path; its fingerprint is compared with the
+# unit's sha256sum on the instance so it is only rewritten when it differs
+SERVICE_UNIT = f'''[Unit]
+Description=Lightsail Demo App Node.js Application
+After=network.target
+
+[Service]
+Type=simple
+User=www-data
+Group=www-data
+WorkingDirectory={CURRENT_DIR}
+ExecStart={{node_path}} server.js
+Restart=always
+RestartSec=10
+EnvironmentFile=-{SHARED_DIR}/.env
 
-# Extract application
-cd /tmp
-tar -xzf app.tar.gz
+# Logging
+StandardOutput=syslog
+StandardError=syslog
+SyslogIdentifier=lightsail-demo-app
 
-# Ensure directory structure exists
-echo "Creating /var/www directory..."
-sudo mkdir -p /var/www
-sudo chown root:root /var/www
-sudo chmod 755 /var/www
+[Install]
+WantedBy=multi-user.target
+'''
 
-# Backup current version if it exists
-if [ -d "/var/www/lightsail-demo-app" ]; then
-    echo "Backing up existing application..."
-    sudo cp -r /var/www/lightsail-demo-app /var/www/lightsail-demo-app.backup.$(date +%Y%m%d_%H%M%S)
-fi
+# Everything a plan compares against, read in one round trip
+STATE_MANIFEST_MARKER = '--- manifest ---'
+REMOTE_STATE_SCRIPT = f'''{NODE_PATH_SCRIPT}
+echo "node=$NODE_PATH"
+echo "unit=$(sha256sum {SERVICE_FILE} 2>/dev/null | cut -d' ' -f1)"
+echo "env=$(sudo sha256sum {SHARED_DIR}/.env 2>/dev/null | cut -d' ' -f1)"
+echo "enabled=$(systemctl is-enabled lightsail-demo-app 2>/dev/null)"
+echo "active=$(systemctl is-active lightsail-demo-app 2>/dev/null)"
+echo "{STATE_MANIFEST_MARKER}"
+cat {CURRENT_DIR}/{MANIFEST_NAME} 2>/dev/null || cat {APP_DIR}/{MANIFEST_NAME} 2>/dev/null || true
+'''
 
-# Deploy new version
-echo "Deploying new version..."
-sudo rm -rf /var/www/lightsail-demo-app
-sudo mv /tmp/app /var/www/lightsail-demo-app
-sudo chown -R www-data:www-data /var/www/lightsail-demo-app
+# Moves an app deployed in place by older versions of this script into
+# releases/legacy so it can be switched away from (and back to) atomically
+PREPARE_LAYOUT_SCRIPT = f'''
+sudo mkdir -p /var/www
+if [ -d {APP_DIR} ] && [ ! -L {CURRENT_DIR} ] && [ ! -d {RELEASES_DIR} ]; then
+    echo "Migrating existing application into release layout..."
+    sudo mv {APP_DIR} {APP_DIR}.legacy
+    sudo mkdir -p {RELEASES_DIR}
+    sudo mv {APP_DIR}.legacy {RELEASES_DIR}/legacy
+    sudo ln -sfn releases/legacy {CURRENT_DIR}
+fi
+sudo mkdir -p {RELEASES_DIR} {SHARED_DIR}
+if [ -f {CURRENT_DIR}/.env ] && [ ! -f {SHARED_DIR}/.env ]; then
+    sudo cp -a {CURRENT_DIR}/.env {SHARED_DIR}/.env
+fi
+'''
 
-# Install dependencies
-cd /var/www/lightsail-demo-app
+# Runs in the staged release; RELEASE_DIR is set by the caller
+INSTALL_DEPENDENCIES_SCRIPT = f'''# Install dependencies
+cd "$RELEASE_DIR"
 
 # Find Node.js and npm paths
 NODE_PATH=$(which node || echo "")
@@ -199,104 +141,767 @@ fi
 echo "Using Node.js at: $NODE_PATH"
 echo "Using npm at: $NPM_PATH"
 
-# Fix npm cache permissions and install dependencies
+# Fix npm cache permissions
 sudo mkdir -p /var/www/.npm
 sudo chown -R www-data:www-data /var/www/.npm
 sudo chmod -R 755 /var/www/.npm
 
-# Install dependencies
-sudo -u www-data env PATH="/usr/bin:/usr/local/bin:/bin:/sbin:/snap/bin" HOME="/var/www" "$NPM_PATH" ci --production --cache /var/www/.npm
+# Reuse node_modules built for the same lockfile and Node version; npm ci
+# only runs when either changes. Cache entries are never modified in place,
+# so releases can hard-link them.
+LOCK_FILE=package-lock.json
+[ -f "$LOCK_FILE" ] || LOCK_FILE=package.json
+DEPS_KEY="$(sha256sum "$LOCK_FILE" | cut -c1-16)-$("$NODE_PATH" --version)"
+DEPS_CACHE="{DEPENDENCY_CACHE_DIR}/$DEPS_KEY"
+
+if [ -d "$DEPS_CACHE/node_modules" ]; then
+    echo "Reusing cached dependencies ($DEPS_KEY)"
+    sudo rm -rf node_modules
+    sudo cp -al "$DEPS_CACHE/node_modules" node_modules
+    sudo touch "$DEPS_CACHE"
+else
+    echo "Installing dependencies ($DEPS_KEY)"
+    sudo rm -rf node_modules
+    sudo -u www-data env PATH="/usr/bin:/usr/local/bin:/bin:/sbin:/snap/bin" HOME="/var/www" "$NPM_PATH" ci --production --cache /var/www/.npm
+    if [ -d node_modules ]; then
+        sudo mkdir -p "$DEPS_CACHE"
+        sudo rm -rf "$DEPS_CACHE/node_modules.tmp"
+        sudo cp -al node_modules "$DEPS_CACHE/node_modules.tmp"
+        sudo mv -T "$DEPS_CACHE/node_modules.tmp" "$DEPS_CACHE/node_modules"
+    fi
+fi
+
+# Keep the most recently used dependency sets
+cd {DEPENDENCY_CACHE_DIR} && ls -1t | tail -n +{KEEP_DEPENDENCY_SETS + 1} | while IFS= read -r key; do
+    sudo rm -rf -- "$key"
+done
+cd "$RELEASE_DIR"
 '''
-        
-        success, output = self.run_command(deployment_script, timeout=600)
+
+def service_unit(node_path):
+    return SERVICE_UNIT.format(node_path=node_path)
+
+def env_file(env_vars):
+    return "".join(f"{k}={v}\n" for k, v in env_vars.items())
+
+class LightsailDeployer:
+    def __init__(self, instance_name, region='us-east-1', lightsail=None, stream_output=False, log_dir=None):
+        self._lightsail = lightsail
+        self.instance_name = instance_name
+        self.region = region
+        self.session = None
+        # Print remote output line by line as it arrives, and/or tee it to log_dir/<instance>.log
+        self.stream_output = stream_output
+        self.log_dir = log_dir
+        # What the load probe found worse than the previous release, if it ran
+        self.regressions = []
+    
+    @property
+    def lightsail(self):
+        """The Lightsail client, created on first use"""
+        if self._lightsail is None:
+            self._lightsail = get_client('lightsail', self.region)
+        return self._lightsail
+
+    def open_session(self):
+        """Open the shared SSH session used by run_command and copy_file_to_instance"""
+        if self.session is None:
+            self.session = SSHSession(self.lightsail, self.instance_name, self.region)
+        self.session.open()
+        return self.session
+
+    def close_session(self):
+        """Close the shared SSH session"""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def output_stream(self):
+        """OutputStream for one command, or None to capture output instead"""
+        if not (self.stream_output or self.log_dir):
+            return None
+        log_path = os.path.join(self.log_dir, f"{self.instance_name}.log") if self.log_dir else None
+        return OutputStream(prefix=f"   [{self.instance_name}] ", log_path=log_path, echo=self.stream_output)
+
+    def run_command(self, command, timeout=300):
+        """Execute command on Lightsail instance over the shared SSH session"""
+        output = self.output_stream()
+        try:
+            print(f"🔧 Running: {command[:100]}{'...' if len(command) > 100 else ''}")
+            
+            result = self.open_session().run(command, timeout=timeout, output=output)
+            streamed = output is not None and output.echo
+            
+            if result.returncode == 0:
+                print(f"   ✅ Success")
+                if result.stdout.strip() and not streamed:
+                    # Limit output for readability
+                    lines = result.stdout.strip().split('\n')
+                    for line in lines[:20]:  # Show first 20 lines
+                        print(f"   {line}")
+                    if len(lines) > 20:
+                        print(f"   ... ({len(lines) - 20} more lines)")
+                return True, result.stdout.strip()
+            else:
+                print(f"   ❌ Failed (exit code: {result.returncode})")
+                if result.stderr.strip() and not streamed:
+                    print(f"   Error: {result.stderr.strip()}")
+                return False, result.stderr.strip()
+                
+        except Exception as e:
+            print(f"   ❌ Error: {str(e)}")
+            return False, str(e)
+        finally:
+            if output:
+                output.close()
+
+    def create_ssh_files(self, ssh_details):
+        """Create temporary SSH key files"""
+        return create_ssh_files(ssh_details)
+
+    def copy_file_to_instance(self, local_path, remote_path):
+        """Copy file to instance using SCP over the shared SSH session"""
+        try:
+            print(f"📤 Copying {local_path} to {remote_path}")
+            
+            result = self.open_session().copy(local_path, remote_path, timeout=300)
+            
+            if result.returncode == 0:
+                print(f"   ✅ File copied successfully")
+                return True
+            else:
+                print(f"   ❌ Failed to copy file (exit code: {result.returncode})")
+                if result.stderr.strip():
+                    print(f"   Error: {result.stderr.strip()}")
+                return False
+                
+        except Exception as e:
+            print(f"   ❌ Error copying file: {str(e)}")
+            return False
+
+    def upload_package(self, app_dir, remote_path, paths=None, extra=None):
+        """Stream a package of app_dir straight into a remote file, with no local temp file"""
+        try:
+            print(f"📤 Streaming {app_dir} to {remote_path}")
+            
+            def write(stdin):
+                write_package(app_dir, stdin, paths=paths, prefix=ARCHIVE_PREFIX, extra=extra)
+            
+            result = self.open_session().stream(f"cat > {remote_path}", write, timeout=600)
+            
+            if result.returncode == 0:
+                print(f"   ✅ Package uploaded successfully")
+                return True
+            else:
+                print(f"   ❌ Failed to upload package (exit code: {result.returncode})")
+                if result.stderr.strip():
+                    print(f"   Error: {result.stderr.strip()}")
+                return False
+                
+        except Exception as e:
+            print(f"   ❌ Error uploading package: {str(e)}")
+            return False
+
+    def source_manifest(self, app_source):
+        """Hash the files of an app directory or of an archive's app/ tree"""
+        if os.path.isdir(app_source):
+            return build_manifest(app_source, iter_files(app_source, exclude_dirs=SOURCE_EXCLUDE_DIRS))
+        return manifest_from_archive(app_source, ARCHIVE_PREFIX)
+
+    def fetch_remote_state(self):
+        """Return the instance's node path, unit and env hashes, service state and
+        live manifest (None when there is none), or None if it cannot be read"""
+        try:
+            result = self.open_session().run(REMOTE_STATE_SCRIPT, timeout=60)
+        except Exception as e:
+            print(f"   ⚠️ Could not read remote state: {e}")
+            return None
+        if result.returncode != 0:
+            print(f"   ⚠️ Could not read remote state: {result.stderr.strip()}")
+            return None
+        header, _, manifest_text = result.stdout.partition(STATE_MANIFEST_MARKER + "\n")
+        state = {}
+        for line in header.splitlines():
+            key, sep, value = line.partition('=')
+            if sep:
+                state[key] = value.strip()
+        state['manifest'] = parse_manifest(manifest_text)
+        return state
+
+    def plan_deployment(self, app_source, env_vars=None, full=False, strict=False):
+        """Compare the desired release, env file and service with the instance.
+
+        Returns (plan, app_manifest, remote_manifest); remote_manifest is
+        None when the whole app has to be uploaded. If the remote state
+        cannot be read the plan assumes nothing is in place, or with strict
+        set raises RuntimeError instead.
+        """
+        app_manifest = self.source_manifest(app_source)
+        state = self.fetch_remote_state()
+        if state is None:
+            if strict:
+                raise RuntimeError("remote state could not be read")
+            state = {}
+        remote_manifest = None if full else state.get('manifest')
+        plan = Plan(self.instance_name)
+
+        added, changed, deleted = diff_manifests(app_manifest, remote_manifest)
+        if remote_manifest is None:
+            size = (source_sizes(app_source, app_manifest) if os.path.isdir(app_source)
+                    else os.path.getsize(app_source))
+            plan.change('files', f"full deploy of {len(app_manifest)} files", size, remote_steps=2)
+        elif added or changed or deleted:
+            size = source_sizes(app_source, added + changed, ARCHIVE_PREFIX)
+            plan.change('files', f"{len(added)} added, {len(changed)} changed, {len(deleted)} deleted",
+                        size, remote_steps=2)
+        else:
+            plan.keep('files', f"{len(app_manifest)} files up to date")
+
+        if not plan.changes('files'):
+            plan.keep('dependencies')
+        elif self.dependencies_changed(app_manifest, remote_manifest):
+            plan.change('dependencies', "install node_modules (cached per lockfile)")
+        else:
+            plan.keep('dependencies', "hard-linked from the live release")
+
+        if not env_vars:
+            plan.keep('env', "no environment variables given")
+        elif fingerprint(env_file(env_vars)) != state.get('env'):
+            plan.change('env', f"write {SHARED_DIR}/.env ({len(env_vars)} variables)")
+        else:
+            plan.keep('env')
+
+        if fingerprint(service_unit(state.get('node', ''))) != state.get('unit'):
+            plan.change('service', f"write {SERVICE_FILE} and daemon-reload", remote_steps=2)
+        else:
+            plan.keep('service')
+        if state.get('enabled') != 'enabled':
+            plan.change('enable', "systemctl enable lightsail-demo-app")
+        else:
+            plan.keep('enable')
+
+        if plan.changes('files'):
+            plan.change('restart', "switch to the new release and restart", remote_steps=2)
+        elif plan.changes('env') or plan.changes('service') or state.get('active') != 'active':
+            plan.change('restart', "restart lightsail-demo-app")
+        else:
+            plan.keep('restart', "running")
+        if plan.changes('restart'):
+            plan.change('nginx', "reload nginx")
+            plan.change('health', "wait for /health", remote_steps=2)
+        else:
+            plan.keep('nginx')
+            plan.keep('health')
+        if plan.changes('files'):
+            plan.change('prune', "delete old releases")
+        return plan, app_manifest, remote_manifest
+
+    def plan(self, app_source, env_vars=None, full=False):
+        """Print what deploy_application would do without changing anything; None on error"""
+        try:
+            with span('deploy.plan', instance=self.instance_name):
+                plan, _, _ = self.plan_deployment(app_source, env_vars, full, strict=True)
+            plan.print_summary()
+            return plan
+        except Exception as e:
+            print(f"❌ Could not plan deployment: {e}")
+            return None
+        finally:
+            self.close_session()
+
+    def full_deployment_script(self, app_source, app_manifest, release_dir):
+        """Upload the whole app and return the script that stages it as a new release"""
+        print(f"📦 Full deploy of {len(app_manifest)} files")
+        if os.path.isdir(app_source):
+            uploaded = self.upload_package(app_source, '/tmp/app.tar.gz', paths=sorted(app_manifest))
+        else:
+            uploaded = self.copy_file_to_instance(app_source, '/tmp/app.tar.gz')
+        if not uploaded:
+            return None
+        return f'''
+set -e
+{PREPARE_LAYOUT_SCRIPT}
+# Stage new release
+RELEASE_DIR={release_dir}
+if [ "$(readlink -f {CURRENT_DIR})" = "$RELEASE_DIR" ]; then
+    echo "ERROR: $RELEASE_DIR is the live release"
+    exit 1
+fi
+echo "Staging release $RELEASE_DIR..."
+sudo rm -rf "$RELEASE_DIR"
+sudo mkdir -p "$RELEASE_DIR"
+sudo tar -xzf /tmp/app.tar.gz -C "$RELEASE_DIR" --strip-components=1 --no-same-owner
+rm -f /tmp/app.tar.gz
+sudo tee "$RELEASE_DIR/{MANIFEST_NAME}" > /dev/null << 'MANIFESTEOF'
+{dump_manifest(app_manifest).decode()}
+MANIFESTEOF
+sudo chown -R www-data:www-data "$RELEASE_DIR"
+'''
+
+    def delta_deployment_script(self, app_source, app_manifest, remote_manifest, release_dir):
+        """Upload only changed files and return the script that stages them as a new release.
+
+        Unchanged files, node_modules included, are hard-linked from the live
+        release. Returns '' when nothing changed and False when the upload
+        failed.
+        """
+        added, changed, deleted = diff_manifests(app_manifest, remote_manifest)
+        print(f"📦 Delta deploy: {len(added)} added, {len(changed)} changed, {len(deleted)} deleted")
+        if not (added or changed or deleted):
+            print("   ✅ Application files are up to date")
+            return ''
+
+        if os.path.isdir(app_source):
+            manifest_entry = {ARCHIVE_PREFIX + MANIFEST_NAME: dump_manifest(app_manifest)}
+            if not self.upload_package(app_source, '/tmp/app-delta.tar.gz', paths=added + changed,
+                                       extra=manifest_entry):
+                return False
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                delta_path = os.path.join(tmp_dir, 'app-delta.tar.gz')
+                build_delta_archive(app_source, ARCHIVE_PREFIX, added + changed, app_manifest, delta_path)
+                print(f"   Delta archive: {os.path.getsize(delta_path)} bytes")
+                if not self.copy_file_to_instance(delta_path, '/tmp/app-delta.tar.gz'):
+                    return False
+
+        deleted_list = "\n".join(deleted)
+        return f'''
+set -e
+{PREPARE_LAYOUT_SCRIPT}
+# Stage new release, hard-linking unchanged files from the live one
+RELEASE_DIR={release_dir}
+if [ "$(readlink -f {CURRENT_DIR})" = "$RELEASE_DIR" ]; then
+    echo "ERROR: $RELEASE_DIR is the live release"
+    exit 1
+fi
+echo "Staging release $RELEASE_DIR..."
+sudo rm -rf "$RELEASE_DIR"
+sudo mkdir -p "$RELEASE_DIR"
+sudo cp -al {CURRENT_DIR}/. "$RELEASE_DIR"/
+
+# Apply changed files, replacing rather than writing through the shared links
+rm -rf /tmp/app-delta
+mkdir -p /tmp/app-delta
+tar -xzf /tmp/app-delta.tar.gz -C /tmp/app-delta
+sudo cp -a --remove-destination /tmp/app-delta/app/. "$RELEASE_DIR"/
+rm -rf /tmp/app-delta /tmp/app-delta.tar.gz
+
+# Remove deleted files
+cd "$RELEASE_DIR"
+while IFS= read -r path; do
+    if [ -n "$path" ]; then sudo rm -f -- "$path"; fi
+done << 'DELETEDEOF'
+{deleted_list}
+DELETEDEOF
+sudo chown -R www-data:www-data "$RELEASE_DIR"
+'''
+
+    def dependencies_changed(self, app_manifest, remote_manifest):
+        """Whether package.json or package-lock.json differ from the live release"""
+        if remote_manifest is None:
+            return True
+        added, changed, deleted = diff_manifests(app_manifest, remote_manifest)
+        return any(os.path.basename(p) in ('package.json', 'package-lock.json')
+                   for p in added + changed + deleted)
+
+    def install_dependencies(self, release_dir):
+        """Install node_modules into a staged release, from the cache when possible"""
+        success, _ = self.run_command(f"set -e\nRELEASE_DIR={release_dir}\n{INSTALL_DEPENDENCIES_SCRIPT}",
+                                      timeout=600)
+        return success
+
+    @traced('deploy.switch')
+    def switch_release(self, release_dir):
+        """Point the current symlink at release_dir in one atomic rename and restart"""
+        print(f"🔀 Switching to release {os.path.basename(release_dir)}...")
+        success, _ = self.run_command(
+            f"cd {APP_DIR} && sudo ln -sfn {os.path.relpath(release_dir, APP_DIR)} current.new "
+            f"&& sudo mv -Tf current.new current"
+        )
         if not success:
-            print("❌ Failed to deploy application")
             return False
+        success, _ = self.run_command("sudo systemctl restart lightsail-demo-app")
+        return success
+
+    def live_release(self):
+        """Id of the release the current symlink points at, or None"""
+        success, output = self.run_command(
+            f'if [ -L {CURRENT_DIR} ]; then basename "$(readlink -f {CURRENT_DIR})"; fi'
+        )
+        return output if success and output else None
+
+    @traced('deploy.prune')
+    def prune_releases(self, keep=KEEP_RELEASES):
+        """Delete all but the newest releases, never the live one.
+
+        Release ids are UTC timestamps, so they are ordered by id rather
+        than by mtime, which a rollback does not change.
+        """
+        self.run_command(f'''
+cd {RELEASES_DIR} || exit 0
+CURRENT=$(basename "$(readlink -f {CURRENT_DIR})")
+ls -1 | sort -r | grep -vx "$CURRENT" | tail -n +{keep} | while IFS= read -r release; do
+    echo "Pruning release $release"
+    sudo rm -rf -- "$release"
+done
+''')
+
+    @traced('deploy.rollback')
+    def rollback(self, release_id=None):
+        """Switch back to release_id, or to the newest release older than the live one.
+
+        A deploy passes the release that was live before it switched, since
+        the newest older release may be one that was already rolled back.
+        """
+        try:
+            if release_id is None:
+                success, output = self.run_command(f'''
+cd {RELEASES_DIR}
+CURRENT=$(basename "$(readlink -f {CURRENT_DIR})")
+ls -1 | sort | awk -v current="$CURRENT" '($0 "") < (current "") {{ previous = $0 }} END {{ print previous }}'
+''')
+                release_id = output.strip() if success else ''
+            if not release_id:
+                print("❌ No earlier release to roll back to")
+                return False
+            print(f"⏪ Rolling back to release {release_id}")
+            if not self.switch_release(f"{RELEASES_DIR}/{release_id}"):
+                return False
+            return self.wait_for_health()
+        finally:
+            self.close_session()
+
+    def check_load(self, load_probe, baseline, release_dir, can_rollback=True, previous_release=None):
+        """Probe the live release under load and compare it with baseline.
+
+        Returns False only if it regressed and was rolled back to
+        previous_release; a probe that cannot run is reported and otherwise
+        ignored.
+        """
+        try:
+            results = load_probe.run(self.open_session(), f"{release_dir}/{RESULTS_NAME}")
+        except Exception as e:
+            print(f"   ⚠️ Load probe failed: {e}")
+            return True
+        self.regressions = load_probe.compare(results, baseline)
+        print_results(results, baseline, self.regressions)
+        if self.regressions and load_probe.rollback and can_rollback:
+            print("❌ New release regressed under load, rolling back")
+            self.rollback(previous_release)
+            return False
+        return True
+
+    @traced('deploy.health')
+    def wait_for_health(self, timeout=60):
+        """Poll the app's /health endpoint on the instance until it answers"""
+        print("🩺 Waiting for application health check...")
+        started = time.time()
+        healthy = poll(
+            lambda: self.open_session().run(HEALTH_CHECK_COMMAND, timeout=15).returncode == 0,
+            timeout, initial_delay=0.5, max_delay=5,
+        )
+        if healthy:
+            print(f"   ✅ Healthy after {time.time() - started:.1f}s")
+        else:
+            print(f"   ⚠️ No healthy response after {timeout}s")
+        return bool(healthy)
+
+    def deploy_application(self, app_archive_path, env_vars=None, full=False,
+                           keep_releases=KEEP_RELEASES, rollback_on_failure=False, load_probe=None):
+        """Deploy application to Lightsail instance.
+
+        app_archive_path is either a tar.gz with an app/ directory or the
+        app directory itself, which is then packaged on the fly and
+        streamed to the instance. Only files whose content hash differs
+        from the deployed manifest are uploaded unless full is set or the
+        instance has no manifest yet.
+
+        Each deploy is staged under releases/<id> while the old version
+        keeps serving, then made live by swapping the current symlink.
+        Steps the plan finds already up to date (env file, service unit,
+        restart) are skipped, so a repeated deploy changes nothing.
+
+        With a LoadProbe, the release is put under a burst of requests once
+        it is healthy and compared with the previous release's results;
+        regressions end up in self.regressions.
+        """
+        try:
+            with span('deploy', instance=self.instance_name) as current:
+                success = self._deploy_application(app_archive_path, env_vars, full,
+                                                   keep_releases, rollback_on_failure, load_probe)
+                current.set(ok=success, regressed=bool(self.regressions))
+                return success
+        finally:
+            self.close_session()
+
+    def _deploy_application(self, app_archive_path, env_vars=None, full=False,
+                            keep_releases=KEEP_RELEASES, rollback_on_failure=False, load_probe=None):
+        print("🚀 Starting application deployment...")
+        
+        release_dir = f"{RELEASES_DIR}/{time.strftime('%Y%m%d%H%M%S', time.gmtime())}"
+        with span('deploy.plan'):
+            plan, app_manifest, remote_manifest = self.plan_deployment(app_archive_path, env_vars, full)
+        plan.print_summary()
+        if not plan.changed:
+            print("✅ Instance already matches this deploy, nothing to do")
+            return True
+        
+        deployment_script = ''
+        if plan.changes('files'):
+            with span('deploy.upload', mode='full' if remote_manifest is None else 'delta'):
+                if remote_manifest is None:
+                    deployment_script = self.full_deployment_script(app_archive_path, app_manifest, release_dir)
+                else:
+                    deployment_script = self.delta_deployment_script(app_archive_path, app_manifest,
+                                                                     remote_manifest, release_dir)
+            if not deployment_script:
+                return False
+            
+            # Stage the new release while the old one keeps serving
+            with span('deploy.stage'):
+                success, output = self.run_command(deployment_script, timeout=600)
+            if not success:
+                print("❌ Failed to stage new release")
+                return False
+            if plan.changes('dependencies'):
+                with span('deploy.npm_install'):
+                    success = self.install_dependencies(release_dir)
+                if not success:
+                    print("❌ Failed to install dependencies")
+                    return False
         
         # Create environment file
-        if env_vars:
+        if plan.changes('env'):
             print("📝 Creating environment file...")
-            env_content = "\\n".join([f"{k}={v}" for k, v in env_vars.items()])
             env_script = f'''
-sudo tee /var/www/lightsail-demo-app/.env > /dev/null << 'ENVEOF'
-{env_content}
-ENVEOF
+sudo mkdir -p {SHARED_DIR}
+sudo tee {SHARED_DIR}/.env > /dev/null << 'ENVEOF'
+{env_file(env_vars)}ENVEOF
 '''
-            self.run_command(env_script)
+            with span('deploy.env'):
+                self.run_command(env_script)
         
         # Update systemd service
-        print("⚙️ Updating systemd service...")
-        service_script = '''
-# Get Node.js path
-NODE_PATH=$(which node || echo "")
-if [ -z "$NODE_PATH" ]; then
-    if [ -f "/usr/bin/node" ]; then
-        NODE_PATH="/usr/bin/node"
-    elif [ -f "/snap/bin/node" ]; then
-        NODE_PATH="/snap/bin/node"
-    fi
-fi
-
-sudo tee /etc/systemd/system/lightsail-demo-app.service > /dev/null << SERVICEEOF
-[Unit]
-Description=Lightsail Demo App Node.js Application
-After=network.target
-
-[Service]
-Type=simple
-User=www-data
-Group=www-data
-WorkingDirectory=/var/www/lightsail-demo-app
-ExecStart=$NODE_PATH server.js
-Restart=always
-RestartSec=10
-EnvironmentFile=/var/www/lightsail-demo-app/.env
-
-# Logging
-StandardOutput=syslog
-StandardError=syslog
-SyslogIdentifier=lightsail-demo-app
-
-[Install]
-WantedBy=multi-user.target
-SERVICEEOF
+        if plan.changes('service'):
+            print("⚙️ Updating systemd service...")
+            service_script = f'''
+{NODE_PATH_SCRIPT}
+sudo tee {SERVICE_FILE} > /dev/null << SERVICEEOF
+{service_unit('$NODE_PATH')}SERVICEEOF
 '''
+            with span('deploy.service'):
+                self.run_command(service_script)
+                self.run_command("sudo systemctl daemon-reload")
+        if plan.changes('enable'):
+            self.run_command("sudo systemctl enable lightsail-demo-app")
         
-        self.run_command(service_script)
-        
-        # Start application
-        print("🚀 Starting application...")
-        self.run_command("sudo systemctl daemon-reload")
-        self.run_command("sudo systemctl enable lightsail-demo-app")
-        self.run_command("sudo systemctl start lightsail-demo-app")
-        self.run_command("sudo systemctl restart nginx")
+        # Make the new release live
+        if plan.changes('restart'):
+            # Results of the release that is live until the switch
+            baseline = fetch_results(self.open_session(), f"{CURRENT_DIR}/{RESULTS_NAME}") if load_probe else None
+            print("🚀 Starting application...")
+            previous_release = None
+            if deployment_script:
+                # Roll back to what was live, not to whatever release is next newest
+                previous_release = self.live_release()
+                if not self.switch_release(release_dir):
+                    print("❌ Failed to switch to the new release")
+                    return False
+            else:
+                with span('deploy.restart'):
+                    self.run_command("sudo systemctl restart lightsail-demo-app")
+            with span('deploy.nginx'):
+                self.run_command("sudo systemctl reload nginx || sudo systemctl restart nginx")
+            
+            # Wait for the app to answer its health check, then show status
+            healthy = self.wait_for_health()
+            success, output = self.run_command("sudo systemctl status lightsail-demo-app --no-pager")
+            
+            if not healthy and rollback_on_failure and deployment_script:
+                print("❌ New release is unhealthy, rolling back")
+                self.rollback(previous_release)
+                return False
+            if healthy and load_probe:
+                if not self.check_load(load_probe, baseline, release_dir if deployment_script else CURRENT_DIR,
+                                       can_rollback=bool(deployment_script), previous_release=previous_release):
+                    return False
         
-        # Wait and check status
-        time.sleep(5)
-        success, output = self.run_command("sudo systemctl status lightsail-demo-app --no-pager")
+        if plan.changes('prune'):
+            self.prune_releases(keep_releases)
         
-        print("✅ Application deployment completed!")
+        if self.regressions:
+            print("⚠️ Application deployment completed with a performance regression")
+        else:
+            print("✅ Application deployment completed!")
         return True
 
-def main():
-    if len(sys.argv) < 3:
-        print("Usage: python3 deploy-with-run-command.py <instance_name> <app_archive_path> [env_vars_json]")
+def parse_args():
+    parser = argparse.ArgumentParser(
+        usage="python3 deploy-with-run-command.py <instance_name> <app_archive_or_dir> [env_vars_json]\n"
+              "       python3 deploy-with-run-command.py (--instances a,b,c | --tag Key=Value) "
+              "<app_archive_or_dir> [env_vars_json]\n"
+              "       python3 deploy-with-run-command.py --rollback [--release RELEASE_ID] <instance_name>"
+    )
+    parser.add_argument('args', nargs='*')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--full', action='store_true',
+                        help="upload the whole archive instead of only changed files")
+    parser.add_argument('--keep-releases', type=int, default=KEEP_RELEASES,
+                        help=f"releases to keep on the instance (default: {KEEP_RELEASES})")
+    parser.add_argument('--rollback-on-failure', action='store_true',
+                        help="switch back to the previous release if the new one is unhealthy")
+    parser.add_argument('--rollback', action='store_true',
+                        help="make an earlier release live again instead of deploying")
+    parser.add_argument('--release', metavar='RELEASE_ID',
+                        help="with --rollback, the release to switch to (default: the one before the live one)")
+    parser.add_argument('--instances', help="comma-separated instance names to deploy to")
+    parser.add_argument('--tag', help="deploy to every instance with this tag (Key or Key=Value)")
+    parser.add_argument('--max-concurrency', type=int, default=10)
+    parser.add_argument('--max-unavailable', type=int,
+                        help="most instances allowed to be mid-deploy at once")
+    parser.add_argument('--batch-size', type=int,
+                        help="finish each batch of this many instances before starting the next")
+    parser.add_argument('--max-failure-rate', type=float, default=1.0,
+                        help="stop starting new deploys once this fraction has failed (0-1)")
+    parser.add_argument('--stream', action='store_true',
+                        help="print remote output line by line as it arrives, prefixed per host")
+    parser.add_argument('--log-dir', help="also append each host's remote output to LOG_DIR/<instance>.log")
+    parser.add_argument('--plan', action='store_true',
+                        help="only show what would change; exits 0 if nothing would, 2 if something would")
+    parser.add_argument('--plan-json', metavar='PATH', help="with --plan, also write the plan(s) as JSON")
+    load = parser.add_argument_group('load probe')
+    load.add_argument('--load-probe', action='store_true',
+                      help="after a healthy deploy, measure latency and throughput under a request burst "
+                           "and compare with the previous release")
+    load.add_argument('--load-paths', default=','.join(LOAD_PROBE_PATHS),
+                      help="comma-separated paths to request (default: %(default)s)")
+    load.add_argument('--load-requests', type=int, default=100, help="requests per path")
+    load.add_argument('--load-concurrency', type=int, default=10)
+    load.add_argument('--regression-threshold', type=float, default=0.2,
+                      help="relative latency increase or throughput drop that counts as a regression (0-1)")
+    load.add_argument('--rollback-on-regression', action='store_true',
+                      help="switch back to the previous release if the new one regressed")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+
+    fleet = bool(args.instances or args.tag)
+    positional = args.args
+    if args.release and not args.rollback:
+        parser.error("--release only applies to --rollback")
+    if args.rollback:
+        if fleet or len(positional) != 1:
+            parser.print_usage()
+            sys.exit(1)
+        args.instance_name = positional[0]
+        return args
+    expected = (1, 2) if fleet else (2, 3)
+    if not expected[0] <= len(positional) <= expected[1]:
+        parser.print_usage()
         sys.exit(1)
-    
-    instance_name = sys.argv[1]
-    app_archive_path = sys.argv[2]
-    env_vars = {}
-    
-    if len(sys.argv) > 3:
+    if not fleet:
+        args.instance_name = positional.pop(0)
+    args.app_archive_path = positional.pop(0)
+    args.env_vars = {}
+    if positional:
         try:
-            env_vars = json.loads(sys.argv[3])
+            args.env_vars = json.loads(positional[0])
         except json.JSONDecodeError:
             print("Error: Invalid JSON for environment variables")
             sys.exit(1)
+    return args
+
+def load_probe(args):
+    """LoadProbe configured from the command line, or None without --load-probe"""
+    if not args.load_probe:
+        return None
+    return LoadProbe(
+        paths=[path.strip() for path in args.load_paths.split(',') if path.strip()],
+        requests=args.load_requests, concurrency=args.load_concurrency,
+        threshold=args.regression_threshold, rollback=args.rollback_on_regression,
+    )
+
+def deploy(deployer, args):
+    """Run deploy_application, or plan with --plan, with the options given on the command line"""
+    if args.plan:
+        return deployer.plan(args.app_archive_path, args.env_vars, args.full)
+    return deployer.deploy_application(
+        args.app_archive_path, args.env_vars, args.full,
+        keep_releases=args.keep_releases, rollback_on_failure=args.rollback_on_failure,
+        load_probe=load_probe(args),
+    )
+
+def deploy_fleet(args):
+    """Deploy one archive to many instances in parallel"""
+    lightsail = get_client('lightsail', args.region)
+    if args.instances:
+        instance_names = [name.strip() for name in args.instances.split(',') if name.strip()]
+    else:
+        key, _, value = args.tag.partition('=')
+        instance_names = find_instances_by_tag(lightsail, key, value or None)
+    if not instance_names:
+        print("❌ No instances to deploy to")
+        return False
+
+    print(f"🚀 Deploying to {len(instance_names)} instance(s)")
+
+    plans = []
+
+    def deploy_one(instance_name):
+        deployer = LightsailDeployer(instance_name, args.region, lightsail=lightsail,
+                                     stream_output=args.stream, log_dir=args.log_dir)
+        result = deploy(deployer, args)
+        if args.plan:
+            plans.append(result)
+        return result
+
+    with span('fleet', instances=len(instance_names)):
+        results = run_fleet(
+            instance_names, deploy_one,
+            max_concurrency=args.max_concurrency,
+            max_unavailable=args.max_unavailable,
+            batch_size=args.batch_size,
+            max_failure_rate=args.max_failure_rate,
+        )
+    print_fleet_summary(results)
+    if args.plan:
+        return plans if all(r.succeeded for r in results) else None
+    return all(r.succeeded for r in results)
+
+def finish_plan(plans, args):
+    """Exit 1 if planning failed, 2 if any plan has changes, else 0"""
+    if plans is None:
+        print("❌ Planning failed!")
+        sys.exit(1)
+    if args.plan_json:
+        write_plans(args.plan_json, plans)
+    changed = any(plan.changed for plan in plans)
+    print("\n📋 Changes pending" if changed else "\n📋 Everything is up to date")
+    sys.exit(2 if changed else 0)
+
+def main():
+    args = parse_args()
+    export_on_exit(args)
+    
+    if args.rollback:
+        deployer = LightsailDeployer(args.instance_name, args.region,
+                                     stream_output=args.stream, log_dir=args.log_dir)
+        success = deployer.rollback(args.release)
+        print("🎉 Rollback successful!" if success else "❌ Rollback failed!")
+        sys.exit(0 if success else 1)
+    
+    if args.instances or args.tag:
+        success = deploy_fleet(args)
+    else:
+        deployer = LightsailDeployer(args.instance_name, args.region,
+                                     stream_output=args.stream, log_dir=args.log_dir)
+        success = deploy(deployer, args)
+        if args.plan:
+            success = [success] if success else None
     
-    deployer = LightsailDeployer(instance_name)
+    if args.plan:
+        finish_plan(success, args)
     
-    if deployer.deploy_application(app_archive_path, env_vars):
+    if success:
         print("🎉 Deployment successful!")
         sys.exit(0)
     else:
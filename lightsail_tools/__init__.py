@@ -0,0 +1,5 @@
+"""
+Lightsail Deployment Tools
+==========================
+Helpers shared by the Lightsail deployment and diagnostic scripts.
+"""
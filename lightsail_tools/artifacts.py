@@ -0,0 +1,137 @@
+"""
+Build Artifact Cache
+====================
+Content-addressed cache of deployment packages keyed by a fingerprint of
+their inputs, so a no-op redeploy or CI retry reuses the previous archive
+instead of rebuilding it.
+
+Files are fingerprinted by mtime and size first; a file is only re-hashed
+when either changed since the last run. Old artifacts are evicted least
+recently used first once the entry or size cap is exceeded.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from lightsail_tools.sync import hash_file
+from lightsail_tools.tracing import traced
+
+DEFAULT_MAX_ENTRIES = 10
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+
+class ArtifactCache:
+    """Cache of built archives under cache_dir"""
+
+    def __init__(self, cache_dir, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.stat_index_path = os.path.join(cache_dir, 'stat-index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _read_json(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_json(self, path, data):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    @traced('package.fingerprint')
+    def fingerprint(self, root, paths, params=None):
+        """Return a key covering every input file and the build parameters"""
+        stat_index = self._read_json(self.stat_index_path)
+        new_index = {}
+        digest = hashlib.sha256(json.dumps(params or {}, sort_keys=True).encode())
+        rehashed = 0
+        for rel_path in sorted(paths):
+            st = os.stat(os.path.join(root, rel_path))
+            stamp = [st.st_mtime_ns, st.st_size]
+            cached = stat_index.get(rel_path)
+            if cached and cached[:2] == stamp:
+                content_hash = cached[2]
+            else:
+                content_hash = hash_file(os.path.join(root, rel_path))
+                rehashed += 1
+            new_index[rel_path] = stamp + [content_hash]
+            digest.update(f"{rel_path}\0{content_hash}\n".encode())
+        if rehashed or len(new_index) != len(stat_index):
+            self._write_json(self.stat_index_path, new_index)
+        return digest.hexdigest()
+
+    def _artifact_path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def get(self, key, suffix):
+        """Return the cached artifact path for key, or None"""
+        path = self._artifact_path(key, suffix)
+        if not os.path.exists(path):
+            return None
+        index = self._read_json(self.index_path)
+        index[key + suffix] = time.time()
+        self._write_json(self.index_path, index)
+        return path
+
+    def put(self, key, suffix, built_path):
+        """Move a freshly built artifact into the cache and return its path"""
+        path = self._artifact_path(key, suffix)
+        os.replace(built_path, path)
+        index = self._read_json(self.index_path)
+        index[key + suffix] = time.time()
+        self._write_json(self.index_path, index)
+        self.evict()
+        return path
+
+    def temp_path(self, suffix):
+        """A path inside the cache directory to build a new artifact into"""
+        return os.path.join(self.cache_dir, f'.build-{os.getpid()}{suffix}')
+
+    def evict(self):
+        """Drop least recently used artifacts beyond the entry and size caps"""
+        index = self._read_json(self.index_path)
+        entries = []
+        for name, last_used in index.items():
+            path = os.path.join(self.cache_dir, name)
+            if os.path.exists(path):
+                entries.append((last_used, name, os.path.getsize(path)))
+        entries.sort(reverse=True)
+
+        kept, total = {}, 0
+        for last_used, name, size in entries:
+            if len(kept) < self.max_entries and total + size <= self.max_bytes:
+                kept[name] = last_used
+                total += size
+            else:
+                os.unlink(os.path.join(self.cache_dir, name))
+        self._write_json(self.index_path, kept)
+
+
+@contextlib.contextmanager
+def removed_on_failure(path):
+    """Delete path if the block raises, so a failed build leaves no partial file"""
+    try:
+        yield path
+    except BaseException:
+        if os.path.exists(path):
+            os.unlink(path)
+        raise
+
+
+def link_or_copy(source, target):
+    """Place source at target, hard-linking when possible"""
+    if os.path.exists(target):
+        os.unlink(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
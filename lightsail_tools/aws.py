@@ -0,0 +1,58 @@
+"""
+Shared AWS Clients
+==================
+One boto3 session and client per service and region, created on first use
+and shared by every thread. boto3 is only imported when a client is first
+requested, so code paths that never call AWS (packaging, --help) start
+without paying for it, and repeated calls reuse pooled HTTP connections.
+"""
+
+import threading
+
+from lightsail_tools.tracing import instrument_client
+
+# Enough pooled connections for the largest default fleet concurrency
+MAX_POOL_CONNECTIONS = 50
+RETRIES = {'max_attempts': 8, 'mode': 'standard'}
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+
+
+def _session(region):
+    # boto3 sessions are not thread-safe, so they are only used under _lock
+    if region not in _sessions:
+        import boto3
+        _sessions[region] = boto3.session.Session(region_name=region)
+    return _sessions[region]
+
+
+def get_client(service='lightsail', region='us-east-1'):
+    """Return the shared client for service in region, creating it on first use.
+
+    Clients are thread-safe and configured with a larger connection pool
+    and standard-mode retries with backoff.
+    """
+    key = (service, region)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        if key not in _clients:
+            from botocore.config import Config
+            config = Config(
+                max_pool_connections=MAX_POOL_CONNECTIONS, retries=dict(RETRIES),
+                connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+            )
+            _clients[key] = instrument_client(_session(region).client(service, config=config))
+        return _clients[key]
+
+
+def clear_clients():
+    """Forget every cached session and client"""
+    with _lock:
+        _clients.clear()
+        _sessions.clear()
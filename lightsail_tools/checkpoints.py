@@ -0,0 +1,144 @@
+"""
+Checkpointed Remote Scripts
+===========================
+Turn a list of shell commands into a bash script that records every step
+it completes in a checkpoint file on the instance. Running the same script
+again, after a dropped connection or by hand, skips the finished steps and
+resumes at the one that failed. The checkpoint file is named after a hash
+of the whole script, so a different deploy always starts from step one; it
+is removed once the script completes.
+
+Every step prints a marker line with its number, status and duration in
+milliseconds; StepProgress turns those into progress lines and timings
+while the script's output is streamed back.
+
+Each step runs in its own subshell. set -e ignores a failure on the left
+of && or ||, but the subshell still exits with the status of the step's
+last command, so "cd dir && rm file" fails its step when cd does; and
+since a resumed run skips earlier steps, no step may rely on a cd or
+variable left behind by another one anyway.
+"""
+
+import re
+
+from lightsail_tools.ssh import OutputStream
+from lightsail_tools.state import fingerprint
+
+CHECKPOINT_DIR = '.cache/lightsail-tools/checkpoints'
+# Checkpoints of deploys that were never resumed are removed after this many days
+CHECKPOINT_MAX_AGE_DAYS = 7
+# Seconds to wait for an earlier run of the same script to let go of it
+LOCK_TIMEOUT = 120
+MARKER = '##step'
+MARKER_PATTERN = re.compile(rf'^{MARKER} (\d+)/(\d+) (start|skip|done|failed) (\d+)')
+
+
+def script_id(commands):
+    return fingerprint(list(commands))[:16]
+
+
+def checkpointed_script(commands, title='deployment'):
+    """Return a bash script running commands once each, resumable across runs"""
+    total = len(commands)
+    checkpoint = f'"$HOME/{CHECKPOINT_DIR}/{script_id(commands)}"'
+    lines = [
+        "#!/bin/bash",
+        "set -e",
+        "",
+        f"mkdir -p \"$HOME/{CHECKPOINT_DIR}\"",
+        f"find \"$HOME/{CHECKPOINT_DIR}\" -type f -mtime +{CHECKPOINT_MAX_AGE_DAYS} -delete",
+        f"CHECKPOINT={checkpoint}",
+        "# One run at a time; steps get fd 9 closed so daemons they start do not hold the lock",
+        "if command -v flock >/dev/null; then",
+        "    exec 9>\"$CHECKPOINT.lock\"",
+        f"    flock -w {LOCK_TIMEOUT} 9 || {{ echo 'Another run of this script is still active'; exit 1; }}",
+        "fi",
+        "touch \"$CHECKPOINT\"",
+        "now_ms() { date +%s%3N; }",
+        "STEP=",
+        f"trap 'status=$?; if [ $status -ne 0 ] && [ -n \"$STEP\" ]; then "
+        f"echo \"{MARKER} $STEP failed $(( $(now_ms) - STEP_STARTED ))\"; fi' EXIT",
+        "",
+        f"echo 'Starting {title}...'",
+        "",
+    ]
+    for i, command in enumerate(commands, 1):
+        step_id = fingerprint([i, command])[:12]
+        lines += [
+            f"if grep -qx {step_id} \"$CHECKPOINT\"; then",
+            f"    echo '{MARKER} {i}/{total} skip 0'",
+            "else",
+            f"    STEP={i}/{total}; STEP_STARTED=$(now_ms)",
+            f"    echo '{MARKER} {i}/{total} start 0'",
+            "(",
+            command,
+            ") 9>&-",
+            f"    echo {step_id} >> \"$CHECKPOINT\"",
+            f"    echo \"{MARKER} {i}/{total} done $(( $(now_ms) - STEP_STARTED ))\"",
+            "    STEP=",
+            "fi",
+            "",
+        ]
+    lines += [
+        "rm -f \"$CHECKPOINT\" \"$CHECKPOINT.lock\"",
+        f"echo '{title[:1].upper()}{title[1:]} completed successfully!'",
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def run_command():
+    """Remote command that saves the script on stdin and then runs it.
+
+    The whole script is on the instance before any step starts, so a
+    dropped upload never runs half a script and no step can read the rest
+    of the script as its own input.
+    """
+    return ('script=$(mktemp) && cat > "$script" && { bash "$script" < /dev/null; status=$?; '
+            'rm -f "$script"; exit $status; }')
+
+
+class StepProgress(OutputStream):
+    """OutputStream that turns step markers into progress lines and timings.
+
+    timings maps step number to milliseconds for every step that ran in
+    this stream (across retries); skipped holds the steps a run found
+    already completed.
+    """
+
+    def __init__(self, prefix='', max_lines=200, log_path=None, echo=True):
+        super().__init__(prefix, max_lines, log_path, echo)
+        self.timings = {}
+        self.skipped = set()
+        self.failed = None
+        self.total = 0
+
+    def feed(self, line, stream='stdout'):
+        match = MARKER_PATTERN.match(line.strip())
+        if not match:
+            return super().feed(line, stream)
+        step, total, status, elapsed = int(match.group(1)), int(match.group(2)), match.group(3), int(match.group(4))
+        self.total = total
+        if status == 'start':
+            super().feed(f"Step {step}/{total}...", stream)
+        elif status == 'skip':
+            self.skipped.add(step)
+        elif status == 'done':
+            self.timings[step] = elapsed
+            if self.failed == step:
+                self.failed = None
+            super().feed(f"✓ Step {step}/{total} ({elapsed / 1000:.2f}s)", stream)
+        else:
+            self.timings[step] = elapsed
+            self.failed = step
+            super().feed(f"✗ Step {step}/{total} failed after {elapsed / 1000:.2f}s", stream)
+
+    def print_summary(self, slowest=3):
+        """One line of totals plus the slowest steps"""
+        ran = sum(self.timings.values()) / 1000
+        line = f"⏱  {len(self.timings)} steps run in {ran:.2f}s"
+        resumed = self.skipped - set(self.timings)
+        if resumed:
+            line += f", {len(resumed)} already completed by an earlier run"
+        print(line)
+        for step, elapsed in sorted(self.timings.items(), key=lambda item: -item[1])[:slowest]:
+            print(f"   step {step}/{self.total}: {elapsed / 1000:.2f}s")
@@ -0,0 +1,117 @@
+"""
+Lightsail Access Detail Cache
+=============================
+Cache the key and certificate returned by get_instance_access_details so a
+deploy or diagnostic run makes one API call per instance instead of one per
+remote command.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from lightsail_tools.retry import API_RETRY
+from lightsail_tools.tracing import span
+
+# Refresh this many seconds before the certificate expires
+REFRESH_MARGIN = 300
+# Used when the response carries no expiresAt
+DEFAULT_TTL = 900
+
+
+class CredentialCache:
+    """In-memory (and optionally on-disk) cache of instance access details.
+
+    Entries are keyed by instance name and region and are dropped shortly
+    before the certificate expires. Set cache_dir (or the
+    LIGHTSAIL_CREDENTIAL_CACHE_DIR environment variable) to share entries
+    between processes; files are written with 0600 permissions.
+    """
+
+    def __init__(self, cache_dir=None, refresh_margin=REFRESH_MARGIN):
+        self.cache_dir = cache_dir or os.environ.get('LIGHTSAIL_CREDENTIAL_CACHE_DIR')
+        self.refresh_margin = refresh_margin
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, lightsail, instance_name, region):
+        """Return access details, calling the API only when needed"""
+        key = (instance_name, region)
+        with span('credentials', instance=instance_name) as current:
+            with self.lock:
+                entry = self.entries.get(key) or self._load(key)
+                if entry and self._is_fresh(entry):
+                    self.entries[key] = entry
+                    self.hits += 1
+                    current.set(cached=True)
+                    return entry['accessDetails']
+                self.misses += 1
+            current.set(cached=False)
+
+            response = API_RETRY.call(lambda: lightsail.get_instance_access_details(instanceName=instance_name))
+            details = response['accessDetails']
+            entry = {'accessDetails': details, 'expiresAt': self._expiry(details)}
+
+            with self.lock:
+                self.entries[key] = entry
+                self._store(key, entry)
+            return details
+
+    def invalidate(self, instance_name, region):
+        """Drop a cached entry, e.g. after an authentication failure"""
+        key = (instance_name, region)
+        with self.lock:
+            self.entries.pop(key, None)
+            path = self._path(key)
+            if path and os.path.exists(path):
+                os.unlink(path)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+    def _is_fresh(self, entry):
+        return entry['expiresAt'] - self.refresh_margin > time.time()
+
+    def _expiry(self, details):
+        expires_at = details.get('expiresAt')
+        if isinstance(expires_at, datetime):
+            return expires_at.timestamp()
+        if isinstance(expires_at, (int, float)):
+            return float(expires_at)
+        return time.time() + DEFAULT_TTL
+
+    def _path(self, key):
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha256('/'.join(key).encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f'{digest}.json')
+
+    def _load(self, key):
+        path = self._path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key, entry):
+        path = self._path(key)
+        if not path:
+            return
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        details = {k: v for k, v in entry['accessDetails'].items() if k != 'expiresAt'}
+        fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'accessDetails': details, 'expiresAt': entry['expiresAt']}, f, default=str)
+        os.replace(path + '.tmp', path)
+
+
+# Shared by every script in the same process
+default_cache = CredentialCache()
@@ -0,0 +1,193 @@
+"""
+Remote Diagnostics
+==================
+Run lightsail_tools/remote_probe.py on an instance and get back one
+structured snapshot of the host. Host-side scripts such as the probe are
+uploaded to ~/.cache/lightsail-tools/<name>-<hash>.py the first time a
+host needs them (or after they change) and run from there afterwards, so
+a check is normally a single SSH round trip.
+
+run_cached and run_probe take an AsyncSSHSession (an SSHSession's
+engine), so a fleet is checked from one event loop with run_on_sessions.
+"""
+
+import hashlib
+import json
+import os
+import shlex
+
+PROBE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'remote_probe.py')
+REMOTE_DIR = '.cache/lightsail-tools'
+# Exit code meaning "this version of the script is not on the host yet"
+MISSING_EXIT = 97
+DEFAULT_SERVICES = ('lightsail-demo-app', 'nginx', 'apache2', 'mysql')
+DISK_WARN_PERCENT = 90
+
+_sources = {}
+
+
+def cached_source(path):
+    """Return (script bytes, remote path named after their hash) for a host-side script"""
+    if path not in _sources:
+        with open(path, 'rb') as f:
+            source = f.read()
+        stem = os.path.splitext(os.path.basename(path))[0].replace('remote_', '')
+        _sources[path] = source, f"{REMOTE_DIR}/{stem}-{hashlib.sha256(source).hexdigest()[:16]}.py"
+    return _sources[path]
+
+
+def cached_command(remote_path, args):
+    """Run a cached script (as root when sudo allows), or exit MISSING_EXIT"""
+    args = ' '.join(shlex.quote(a) for a in args)
+    return (f"if [ ! -f {remote_path} ]; then exit {MISSING_EXIT}; fi; "
+            f"if sudo -n true 2>/dev/null; then SUDO='sudo -n'; else SUDO=''; fi; "
+            f"$SUDO python3 {remote_path} {args}")
+
+
+def upload_command(remote_path):
+    """Replace any older version of the script with the one on stdin"""
+    name = os.path.basename(remote_path)
+    stem = name.rsplit('-', 1)[0]
+    return (f"mkdir -p {REMOTE_DIR} && cat > {remote_path}.$$ && mv {remote_path}.$$ {remote_path} && "
+            f"find {REMOTE_DIR} -name '{stem}-*.py' ! -name {name} -delete")
+
+
+async def run_cached(session, path, args, timeout=120):
+    """Run the host-side script at path with args over session.
+
+    The script is uploaded first only when the host does not have this
+    version yet. Returns (CompletedProcess, whether it was uploaded);
+    raises RuntimeError if the upload fails.
+    """
+    source, remote_path = cached_source(path)
+    command = cached_command(remote_path, args)
+    result = await session.run(command, timeout)
+    if result.returncode != MISSING_EXIT:
+        return result, False
+    upload = await session.run(upload_command(remote_path), timeout, input=source)
+    if upload.returncode != 0:
+        raise RuntimeError(f"could not upload {os.path.basename(path)}: {upload.stderr.strip()}")
+    return await session.run(command, timeout), True
+
+
+async def run_probe(session, services=DEFAULT_SERVICES, tail=20, grep='node', timeout=120):
+    """Collect a snapshot over session and return it as a dict.
+
+    The result always has 'success'; on failure it has 'error' instead of
+    the probe's sections. 'uploaded' says whether the probe had to be sent.
+    """
+    args = ('--services', ','.join(services), '--tail', str(tail), '--grep', grep)
+    try:
+        result, uploaded = await run_cached(session, PROBE_PATH, args, timeout)
+    except Exception as e:
+        return {'success': False, 'uploaded': False, 'error': str(e)}
+    if result.returncode != 0:
+        return {'success': False, 'uploaded': uploaded,
+                'error': (result.stderr or result.stdout).strip() or f"exit code {result.returncode}"}
+    try:
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return {'success': False, 'uploaded': uploaded, 'error': f"unreadable probe output: {result.stdout[:200]}"}
+    report.update(success=True, uploaded=uploaded)
+    return report
+
+
+def _runtime_label(report, name):
+    runtime = (report.get('runtimes') or {}).get(name)
+    if not runtime:
+        return 'missing'
+    return f"{runtime.get('version') or '?'} ({runtime.get('source')})"
+
+
+def _megabytes(value):
+    return f"{value // 2**20} MB" if value is not None else '?'
+
+
+def _packages_label(entries):
+    """'name version, ...' for {name: version}, names for a list, '-' if empty"""
+    if isinstance(entries, dict):
+        entries = [f"{name} {version}" if version else name for name, version in sorted(entries.items())]
+    return ', '.join(entries or []) or '-'
+
+
+def _problems(report):
+    """Short descriptions of anything that looks wrong in one snapshot"""
+    problems = []
+    for service, state in (report.get('services') or {}).items():
+        if state.get('enabled') == 'enabled' and state.get('active') != 'active':
+            problems.append(f"{service} {state.get('active')}")
+    for disk in report.get('disk') or []:
+        if disk.get('percent') is not None and disk['percent'] >= DISK_WARN_PERCENT:
+            problems.append(f"{disk['path']} {disk['percent']:.0f}% full")
+    cloud_init = report.get('cloud_init') or {}
+    if cloud_init.get('status') and cloud_init['status'] not in ('done', 'disabled'):
+        problems.append(f"cloud-init {cloud_init['status']}")
+    problems.extend(f"{section}: {error}" for section, error in (report.get('errors') or {}).items())
+    return problems
+
+
+def summarize(reports, runtimes=('node', 'npm')):
+    """Aggregate {instance: snapshot} into counts per runtime version and a list of problems"""
+    summary = {'instances': len(reports), 'failed': [], 'runtimes': {}, 'problems': {}}
+    for instance, report in sorted(reports.items()):
+        if not report.get('success'):
+            summary['failed'].append(instance)
+            continue
+        for name in runtimes:
+            versions = summary['runtimes'].setdefault(name, {})
+            label = _runtime_label(report, name)
+            versions[label] = versions.get(label, 0) + 1
+        problems = _problems(report)
+        if problems:
+            summary['problems'][instance] = problems
+    return summary
+
+
+def print_snapshot(instance, report):
+    """Print one host's snapshot in the checker's layout"""
+    if not report.get('success'):
+        print(f"❌ {instance}: {report.get('error')}")
+        return
+    print(f"\n🖥️  {instance} ({report['host']['hostname']}, kernel {report['host']['kernel']}"
+          f"{', probe uploaded' if report.get('uploaded') else ''})")
+    print("🔍 Runtimes:")
+    for name, runtime in (report.get('runtimes') or {}).items():
+        label = f"{_runtime_label(report, name)}  {runtime.get('path') or ''}" if runtime else '❌ not installed'
+        print(f"   {name:<8} {label}")
+    packages = report.get('packages') or {}
+    print(f"🔍 Packages: apt {_packages_label(packages.get('apt'))}, "
+          f"snap {_packages_label(packages.get('snap'))}, "
+          f"repositories {_packages_label(packages.get('repositories'))}")
+    if report.get('services'):
+        print("🔍 Services:")
+        for service, state in report['services'].items():
+            icon = "✅" if state.get('active') == 'active' else "❌"
+            print(f"   {icon} {service:<20} {state.get('active')} ({state.get('enabled')})")
+    memory = report.get('memory') or {}
+    if memory.get('total'):
+        load = ' '.join(f'{x:.2f}' for x in report['host'].get('load') or [])
+        print(f"🔍 Memory: {_megabytes(memory.get('available'))} available of "
+              f"{_megabytes(memory['total'])}, load {load}")
+    for disk in report.get('disk') or []:
+        percent = f"{disk['percent']}%" if disk.get('percent') is not None else '?'
+        print(f"🔍 Disk {disk['path']}: {percent} used, {_megabytes(disk.get('free'))} free")
+    cloud_init = report.get('cloud_init') or {}
+    print(f"🔍 cloud-init: {cloud_init.get('status')}, user_data marker "
+          f"{'present' if cloud_init.get('user_data_marker') else 'missing'}")
+    for line in cloud_init.get('matches') or []:
+        print(f"   {line}")
+    for problem in _problems(report):
+        print(f"⚠️  {problem}")
+
+
+def print_summary(summary):
+    """Print the fleet-wide aggregate from summarize()"""
+    print("\n" + "=" * 60)
+    print(f"{summary['instances'] - len(summary['failed'])}/{summary['instances']} instances reported")
+    for name, versions in summary['runtimes'].items():
+        counts = ', '.join(f"{label} × {n}" for label, n in sorted(versions.items()))
+        print(f"   {name}: {counts}")
+    for instance, problems in summary['problems'].items():
+        print(f"⚠️  {instance}: {'; '.join(problems)}")
+    if summary['failed']:
+        print(f"❌ No report from: {', '.join(summary['failed'])}")
@@ -0,0 +1,119 @@
+"""
+Fleet Deployment Scheduler
+==========================
+Run a per-instance deploy function across many Lightsail instances on a
+bounded worker pool with rolling batches and a failure-rate stop.
+"""
+
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from lightsail_tools.retry import API_RETRY
+from lightsail_tools.tracing import span
+
+
+class FleetResult:
+    """Outcome of deploying to one instance"""
+
+    def __init__(self, instance_name, status='skipped', duration=0.0, error=None):
+        self.instance_name = instance_name
+        self.status = status
+        self.duration = duration
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.status == 'success'
+
+
+def find_instances_by_tag(lightsail, key, value=None):
+    """Return names of instances carrying the given tag (and value)"""
+    names = []
+    kwargs = {}
+    while True:
+        response = API_RETRY.call(lambda: lightsail.get_instances(**kwargs))
+        for instance in response.get('instances', []):
+            for tag in instance.get('tags', []):
+                if tag['key'] == key and (value is None or tag.get('value') == value):
+                    names.append(instance['name'])
+                    break
+        if not response.get('nextPageToken'):
+            return names
+        kwargs['pageToken'] = response['nextPageToken']
+
+
+def _run_one(instance_name, deploy_fn):
+    started = time.time()
+    with span('fleet.instance', instance=instance_name) as current:
+        try:
+            ok = deploy_fn(instance_name)
+            status, error = ('success' if ok else 'failed'), None
+        except Exception as e:
+            status, error = 'failed', str(e)
+        current.set(status=status)
+    return FleetResult(instance_name, status, time.time() - started, error)
+
+
+def run_fleet(instance_names, deploy_fn, max_concurrency=10, max_unavailable=None,
+              batch_size=None, max_failure_rate=1.0, min_completed=1):
+    """Deploy to every instance and return a FleetResult per instance.
+
+    At most min(max_concurrency, max_unavailable) instances are being
+    deployed (and so possibly out of service) at once; a new one starts as
+    soon as a slot frees up. With batch_size set, each batch must finish
+    before the next one starts. Once at least min_completed deploys have
+    finished and the failure rate exceeds max_failure_rate, no new deploys
+    are started and the remaining instances are reported as skipped.
+    """
+    slots = max(1, min(max_concurrency, max_unavailable or max_concurrency))
+    batch_size = batch_size or len(instance_names) or 1
+    batches = [instance_names[i:i + batch_size] for i in range(0, len(instance_names), batch_size)]
+
+    results = {name: FleetResult(name) for name in instance_names}
+    completed = failed = 0
+    stopped = False
+
+    with ThreadPoolExecutor(max_workers=slots) as pool:
+        for batch_number, batch in enumerate(batches, 1):
+            if stopped:
+                break
+            if len(batches) > 1:
+                print(f"📦 Batch {batch_number}/{len(batches)}: {', '.join(batch)}")
+            pending = list(batch)
+            running = set()
+            while pending or running:
+                while pending and len(running) < slots and not stopped:
+                    # Run in a copy of this context so trace spans nest under the caller's
+                    context = contextvars.copy_context()
+                    running.add(pool.submit(context.run, _run_one, pending.pop(0), deploy_fn))
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    results[result.instance_name] = result
+                    completed += 1
+                    failed += 0 if result.succeeded else 1
+                if not stopped and completed >= min_completed and failed / completed > max_failure_rate:
+                    print(f"🛑 Failure rate {failed}/{completed} exceeds {max_failure_rate:.0%}, "
+                          "not starting further deploys")
+                    stopped = True
+
+    return [results[name] for name in instance_names]
+
+
+def print_fleet_summary(results):
+    """Print a per-instance summary table"""
+    width = max([len(r.instance_name) for r in results] + [8])
+    print("\n" + "=" * (width + 30))
+    print(f"{'INSTANCE':<{width}}  {'STATUS':<8}  {'DURATION':>9}")
+    print("-" * (width + 30))
+    for r in results:
+        line = f"{r.instance_name:<{width}}  {r.status:<8}  {r.duration:>8.1f}s"
+        if r.error:
+            line += f"  {r.error}"
+        print(line)
+    print("-" * (width + 30))
+    succeeded = sum(1 for r in results if r.succeeded)
+    print(f"{succeeded}/{len(results)} succeeded")
@@ -0,0 +1,128 @@
+"""
+Post-Deploy Load Probe
+======================
+After a deploy, send a short burst of concurrent requests to the app from
+the instance itself (lightsail_tools/remote_loadtest.py, cached on the
+host like the diagnostic probe) and compare latency percentiles, error
+rate and throughput with the results stored for the previous release
+(or, where there are no releases, the previous deploy).
+Measuring on the instance keeps network jitter between this machine and
+the region out of the numbers, so a slower release shows up as slower.
+"""
+
+import json
+import os
+import shlex
+
+from lightsail_tools.diagnostics import run_cached
+from lightsail_tools.ssh import run_async
+from lightsail_tools.tracing import span
+
+LOADTEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'remote_loadtest.py')
+RESULTS_NAME = '.load-probe.json'
+DEFAULT_PATHS = ('/', '/health', '/api/info')
+# Latency increases smaller than this are noise, whatever the percentage
+MIN_LATENCY_DELTA_MS = 5.0
+# Error rate may rise by this much (absolute) before it counts as a regression
+MAX_ERROR_RATE_DELTA = 0.01
+
+
+class LoadProbe:
+    """How hard to probe the app after a deploy and what counts as a regression.
+
+    threshold is the relative change that counts: p50/p95/p99 latency (or
+    a path's p95) up by more than it, or requests per second down by more
+    than it.
+    """
+
+    def __init__(self, base_url='http://localhost:3000', paths=DEFAULT_PATHS, requests=100,
+                 concurrency=10, threshold=0.2, rollback=False, timeout=300):
+        self.base_url = base_url
+        self.paths = tuple(paths)
+        self.requests = requests
+        self.concurrency = concurrency
+        self.threshold = threshold
+        self.rollback = rollback
+        self.timeout = timeout
+
+    def run(self, session, save_path=None):
+        """Run the burst on the instance; returns its results, saved to save_path if given"""
+        args = ['--base-url', self.base_url, '--paths', ','.join(self.paths),
+                '--requests', str(self.requests), '--concurrency', str(self.concurrency)]
+        if save_path:
+            args += ['--save', save_path]
+        with span('deploy.load_probe', requests=self.requests * len(self.paths),
+                  concurrency=self.concurrency) as current:
+            result, _ = run_async(run_cached(session.engine, LOADTEST_PATH, args, self.timeout))
+            if result.returncode != 0:
+                raise RuntimeError((result.stderr or result.stdout).strip() or f"exit code {result.returncode}")
+            results = json.loads(result.stdout.strip().splitlines()[-1])
+            current.set(p50=results['p50'], p95=results['p95'], p99=results['p99'],
+                        rps=results['rps'], error_rate=results['error_rate'])
+        return results
+
+    def compare(self, results, baseline):
+        """Describe every way results are worse than baseline; empty if none or not comparable"""
+        if not comparable(results, baseline):
+            return []
+        regressions = []
+        # Overall percentiles, plus p95 per path to point at the endpoint that got slower
+        summaries = [('', results, baseline, ('p50', 'p95', 'p99'))] + [
+            (f"{path} ", results['endpoints'][path], baseline['endpoints'][path], ('p95',))
+            for path in results.get('endpoints', {}) if path in baseline.get('endpoints', {})
+        ]
+        for label, now, before, keys in summaries:
+            for key in keys:
+                if now.get(key) is None or before.get(key) is None:
+                    continue
+                if now[key] > before[key] * (1 + self.threshold) and now[key] - before[key] > MIN_LATENCY_DELTA_MS:
+                    regressions.append(f"{label}{key} {before[key]:.1f}ms → {now[key]:.1f}ms")
+            if (now.get('error_rate') or 0) > (before.get('error_rate') or 0) + MAX_ERROR_RATE_DELTA:
+                regressions.append(f"{label}error rate {before.get('error_rate') or 0:.1%} → {now['error_rate']:.1%}")
+        if results.get('rps') and baseline.get('rps') and results['rps'] < baseline['rps'] * (1 - self.threshold):
+            regressions.append(f"throughput {baseline['rps']:.0f} → {results['rps']:.0f} req/s")
+        return regressions
+
+
+def fetch_results(session, path):
+    """Results saved at path on the instance, or None"""
+    try:
+        result = session.run(f"cat {shlex.quote(path)} 2>/dev/null || true", timeout=30)
+        return json.loads(result.stdout) if result.returncode == 0 and result.stdout.strip() else None
+    except Exception:
+        return None
+
+
+def comparable(results, baseline):
+    """Whether baseline was measured with the same burst as results"""
+    return bool(baseline) and all(baseline.get(key) == results.get(key)
+                                  for key in ('base_url', 'concurrency', 'requests'))
+
+
+def _change(now, before):
+    if not now or not before:
+        return ''
+    return f" ({(now - before) / before:+.0%})"
+
+
+def print_results(results, baseline=None, regressions=()):
+    """Print the burst results next to the baseline, then any regressions"""
+    before = baseline if comparable(results, baseline) else {}
+    print(f"📈 Load probe: {results['requests']} requests at concurrency {results['concurrency']} "
+          f"in {results['duration']:.1f}s")
+    print(f"   p50 {results['p50']}ms{_change(results['p50'], before.get('p50'))}, "
+          f"p95 {results['p95']}ms{_change(results['p95'], before.get('p95'))}, "
+          f"p99 {results['p99']}ms{_change(results['p99'], before.get('p99'))}")
+    print(f"   {results['rps']} req/s{_change(results['rps'], before.get('rps'))}, "
+          f"error rate {results['error_rate']:.1%}")
+    for path, endpoint in results.get('endpoints', {}).items():
+        p95 = f"{endpoint['p95']}ms" if endpoint['p95'] is not None else '-'
+        print(f"   {path:<12} p95 {p95}, {endpoint['errors']} errors")
+    if results.get('failures'):
+        print(f"   failures: {', '.join(f'{k} × {v}' for k, v in results['failures'].items())}")
+    if not baseline:
+        print("   No earlier results to compare with")
+    elif not before:
+        print("   Earlier results were measured with a different burst; not compared")
+    for regression in regressions:
+        print(f"   ⚠️ Regression: {regression}")
@@ -0,0 +1,166 @@
+"""
+Incremental Log Retrieval
+=========================
+Fetch only what was added to a log since the last fetch. Files are read
+from the byte offset where the previous fetch stopped (from the start
+again after rotation, finishing the rotated .1 file first), systemd units
+from the journald cursor of the last entry seen. A line longer than a
+whole fetch is returned truncated and the rest of it skipped. Filtering
+happens on the instance and the result is gzip-compressed before it
+crosses the connection, so following logs on a fleet costs bytes in
+proportion to what was logged, not to the size of the logs.
+
+The reading is done by lightsail_tools/remote_logs.py, cached on each
+host like the diagnostic probe; every host of a round is read from the
+one SSH event loop. Positions are kept per region, instance and log in a
+local JSON file.
+"""
+
+import base64
+import gzip
+import json
+import os
+import threading
+import time
+
+from lightsail_tools.diagnostics import run_cached
+from lightsail_tools.ssh import run_async, run_on_sessions
+from lightsail_tools.tracing import span
+
+LOGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'remote_logs.py')
+UNIT_PREFIX = 'unit:'
+DEFAULT_LOGS = ('/var/log/cloud-init-output.log', UNIT_PREFIX + 'lightsail-demo-app')
+DEFAULT_STATE_PATH = os.path.expanduser('~/.cache/lightsail-tools/log-positions.json')
+# Most bytes of one file (about 200 bytes per journal entry) returned per fetch
+MAX_BYTES = 8 * 1024 * 1024
+
+
+class LogPositions:
+    """Where each log was last read up to, per host, saved as JSON"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.positions = json.load(f)
+        except (OSError, ValueError):
+            self.positions = {}
+
+    def get(self, host):
+        with self.lock:
+            return dict(self.positions.get(host, {}))
+
+    def update(self, host, log, position):
+        with self.lock:
+            self.positions.setdefault(host, {})[log] = position
+
+    def forget(self, host=None):
+        """Drop the positions of host, or of every host"""
+        with self.lock:
+            if host is None:
+                self.positions.clear()
+            else:
+                self.positions.pop(host, None)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.positions, f, indent=1, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+
+
+async def fetch_new(session, positions, logs=DEFAULT_LOGS, grep='', ignore_case=False, lines=50,
+                    max_bytes=MAX_BYTES, timeout=120):
+    """Return {log: result} with the lines added to each log since the last fetch.
+
+    session is an AsyncSSHSession. A result has 'lines', 'rotated' (files
+    only) and 'more' (the fetch stopped at max_bytes), or 'error'.
+    Positions only advance for logs that were read. The first fetch of a
+    log returns its last lines entries.
+    """
+    host = session.host
+    known = positions.get(host)
+    request = {log: known.get(log, {}) for log in logs}
+    args = ['--request', json.dumps(request, separators=(',', ':')), '--lines', str(lines),
+            '--max-bytes', str(max_bytes)]
+    if grep:
+        args += ['--grep', grep]
+    if ignore_case:
+        args.append('--ignore-case')
+    with span('logs.fetch', instance=session.instance_name, logs=len(logs)) as current:
+        result, _ = await run_cached(session, LOGS_PATH, args, timeout)
+        if result.returncode != 0:
+            raise RuntimeError((result.stderr or result.stdout).strip() or f"exit code {result.returncode}")
+        encoded = result.stdout.strip().splitlines()[-1]
+        fetched = json.loads(gzip.decompress(base64.b64decode(encoded)))['logs']
+        current.add('bytes', len(encoded))
+        current.add('log_bytes', sum(r.get('read_bytes', 0) for r in fetched.values()))
+    for log, read in fetched.items():
+        if 'error' in read:
+            continue
+        if log.startswith(UNIT_PREFIX):
+            position = {'cursor': read.get('cursor')} if read.get('cursor') else {}
+        else:
+            position = {'offset': read['offset'], 'inode': read['inode']}
+            if read.get('skip'):
+                position['skip'] = True
+        positions.update(host, log, position)
+    return fetched
+
+
+def print_new(instance_name, fetched, width=0):
+    """Print fetched lines prefixed with their host and log"""
+    prefix = f"[{instance_name}]{' ' * (width - len(instance_name))}"
+    for log, read in fetched.items():
+        name = log[len(UNIT_PREFIX):] if log.startswith(UNIT_PREFIX) else os.path.basename(log)
+        if 'error' in read:
+            print(f"{prefix} ❌ {name}: {read['error']}")
+            continue
+        if read.get('rotated'):
+            print(f"{prefix} {name}: (log rotated)")
+        for line in read['lines']:
+            print(f"{prefix} {name}: {line}")
+        if read.get('more'):
+            print(f"{prefix} {name}: (more to fetch)")
+
+
+def follow(sessions, positions, logs=DEFAULT_LOGS, grep='', ignore_case=False, lines=50,
+           interval=5.0, rounds=None, max_concurrency=10):
+    """Print new log lines from every session every interval seconds.
+
+    sessions maps instance names to SSHSessions; each round reads at most
+    max_concurrency of them at a time, all from the shared SSH event loop.
+    Positions are saved after each round. Stops after rounds, or on Ctrl-C;
+    returns the instances whose last fetch failed.
+    """
+    width = max((len(name) for name in sessions), default=0)
+    failed = set()
+
+    async def fetch_one(session):
+        instance_name = session.instance_name
+        try:
+            fetched = await fetch_new(session, positions, logs, grep, ignore_case, lines)
+        except Exception as e:
+            print(f"[{instance_name}] ❌ {e}")
+            failed.add(instance_name)
+            return
+        failed.discard(instance_name)
+        print_new(instance_name, fetched, width)
+
+    engines = [session.engine for session in sessions.values()]
+    completed = 0
+    try:
+        while rounds is None or completed < rounds:
+            started = time.time()
+            run_async(run_on_sessions(engines, fetch_one, max_concurrency))
+            positions.save()
+            completed += 1
+            if rounds is None or completed < rounds:
+                time.sleep(max(0.0, interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        positions.save()
+    return sorted(failed)
@@ -0,0 +1,140 @@
+"""
+Database Migrations
+===================
+Numbered SQL files (migrations/0001_initial_schema.sql, 0002_...) applied
+once each. The instance records every applied migration, with a checksum
+of its file, in a version table; the deployer reads that table, works out
+the pending set locally and sends only those migrations, so a deploy with
+no new migrations does no database work at all.
+
+Each migration runs with its version row inside one transaction, and the
+generated commands re-check the table before applying anything, so a
+stale pending set (or a hand-run deploy-script.sh) never replays one.
+MySQL commits DDL statements implicitly, so only a migration's data
+changes are rolled back if it fails part-way.
+"""
+
+import hashlib
+import os
+import re
+import shlex
+
+VERSION_TABLE = 'schema_migrations'
+MIGRATION_PATTERN = re.compile(r'^(\d+)_[\w.-]+\.sql$')
+HEREDOC_MARKER = 'LIGHTSAIL_MIGRATION_EOF'
+# ER_NO_SUCH_TABLE: nothing has been applied yet
+NO_SUCH_TABLE = 1146
+
+
+class Migration:
+    """One migration file; version is the file name without .sql"""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = os.path.basename(path)[:-len('.sql')]
+        self.number = int(MIGRATION_PATTERN.match(os.path.basename(path)).group(1))
+        with open(path, 'rb') as f:
+            self.checksum = hashlib.sha256(f.read()).hexdigest()
+
+    @property
+    def sql(self):
+        with open(self.path, encoding='utf-8') as f:
+            return f.read()
+
+
+def load_migrations(directory):
+    """Return the migrations in directory, in the order they apply"""
+    if not os.path.isdir(directory):
+        return []
+    migrations = [
+        Migration(os.path.join(directory, name))
+        for name in os.listdir(directory) if MIGRATION_PATTERN.match(name)
+    ]
+    numbers = [m.number for m in migrations]
+    duplicates = sorted({n for n in numbers if numbers.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate migration numbers in {directory}: {duplicates}")
+    return sorted(migrations, key=lambda m: m.number)
+
+
+def applied_query(mysql):
+    """Shell command printing 'version<TAB>checksum' for every applied migration.
+
+    Prints nothing when the version table does not exist yet (MySQL error
+    1146); any other mysql failure, such as bad credentials or a stopped
+    server, exits non-zero with mysql's message on stderr.
+    """
+    query = f"SELECT version, checksum FROM {VERSION_TABLE} ORDER BY version"
+    return (
+        f"{{ errors=$({mysql} -N -B -e {shlex.quote(query)} 2>&1 >&3); status=$?; }} 3>&1; "
+        f'if [ $status -ne 0 ]; then case "$errors" in '
+        f'*"ERROR {NO_SUCH_TABLE}"*) status=0 ;; *) printf \'%s\\n\' "$errors" >&2 ;; esac; fi; '
+        f"(exit $status)"
+    )
+
+
+def parse_applied(output):
+    """Parse applied_query() output into {version: checksum}"""
+    applied = {}
+    for line in output.splitlines():
+        version, _, checksum = line.strip().partition('\t')
+        if version:
+            applied[version] = checksum
+    return applied
+
+
+def pending_migrations(migrations, applied):
+    """Migrations whose version is not in applied"""
+    return [m for m in migrations if m.version not in applied]
+
+
+def changed_migrations(migrations, applied):
+    """Applied migrations whose file no longer matches the recorded checksum"""
+    return [m for m in migrations if applied.get(m.version) not in (None, '', m.checksum)]
+
+
+def _sql_string(value):
+    return "'" + value.replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def migration_commands(migrations, mysql, baseline=None, baseline_table=None):
+    """Return shell commands applying migrations on the instance.
+
+    baseline names a migration that describes a schema created before
+    versioning: when the version table is empty but baseline_table already
+    exists, it is recorded as applied without being run.
+    """
+    if not migrations:
+        return []
+    create = (
+        f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+        "version VARCHAR(191) PRIMARY KEY, checksum CHAR(64) NOT NULL, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+    commands = [f"{mysql} -e {shlex.quote(create)}"]
+    for migration in migrations:
+        record = (
+            f"INSERT INTO {VERSION_TABLE} (version, checksum) "
+            f"VALUES ({_sql_string(migration.version)}, {_sql_string(migration.checksum)})"
+        )
+        sql = migration.sql.rstrip()
+        if not sql.endswith(';'):
+            sql += ';'
+        is_applied = f"SELECT 1 FROM {VERSION_TABLE} WHERE version = {_sql_string(migration.version)}"
+        if baseline and migration.version == baseline:
+            is_empty = f"SELECT 1 FROM {VERSION_TABLE} LIMIT 1"
+            has_table = f"SHOW TABLES LIKE {_sql_string(baseline_table)}"
+            commands.append(
+                f'if [ -z "$({mysql} -N -B -e {shlex.quote(is_empty)})" ] && '
+                f'[ -n "$({mysql} -N -B -e {shlex.quote(has_table)})" ]; then '
+                f"echo {shlex.quote(f'Recording existing schema as {migration.version}')}; "
+                f"{mysql} -e {shlex.quote(record)}; fi"
+            )
+        commands.append(
+            f'if [ -z "$({mysql} -N -B -e {shlex.quote(is_applied)})" ]; then\n'
+            f"echo {shlex.quote(f'Applying migration {migration.version}')}\n"
+            f"{mysql} <<'{HEREDOC_MARKER}'\n"
+            f"START TRANSACTION;\n{sql}\n{record};\nCOMMIT;\n"
+            f"{HEREDOC_MARKER}\nfi"
+        )
+    return commands
@@ -0,0 +1,146 @@
+"""
+Deployment Packaging
+====================
+Stream files into a tar archive with bounded memory and pluggable,
+multi-threaded compression. Archives can be written to a file or straight
+into a remote upload.
+"""
+
+import collections
+import os
+import tarfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from lightsail_tools.sync import add_bytes
+from lightsail_tools.tracing import span
+
+CHUNK_SIZE = 1024 * 1024
+EXTENSIONS = {'gzip': '.tar.gz', 'zstd': '.tar.zst', 'none': '.tar'}
+
+
+def iter_files(root, exclude_dirs=('__pycache__',), exclude_suffixes=()):
+    """Yield paths relative to root, skipping hidden files and directories"""
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d not in exclude_dirs)
+        for name in sorted(files):
+            if name.startswith('.') or name.endswith(tuple(exclude_suffixes)):
+                continue
+            yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def _gzip_block(block, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+
+class ParallelGzipWriter:
+    """Write-only file object producing a multi-member gzip stream.
+
+    Input is cut into fixed-size blocks that are compressed on a thread
+    pool (zlib releases the GIL) and written out in order. At most two
+    blocks per thread are held in memory. gzip, tar -z and Python's gzip
+    module all read multi-member streams transparently.
+    """
+
+    def __init__(self, fileobj, level=6, threads=None, chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.pool = ThreadPoolExecutor(self.threads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self._submit(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.pool.submit(_gzip_block, block, self.level))
+        while len(self.pending) > 2 * self.threads:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer or not self.pending:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+        self.pool.shutdown()
+        self.closed = True
+
+    def abort(self):
+        """Stop without writing buffered or pending blocks, so a failed
+        archive is left truncated rather than finished"""
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.buffer.clear()
+        self.pool.shutdown()
+        self.closed = True
+
+
+class _PassThroughWriter:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data):
+        return self.fileobj.write(data)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+def open_compressed(fileobj, compression='gzip', level=6, threads=None):
+    """Wrap fileobj in a compressing writer; closing it leaves fileobj open"""
+    if compression == 'gzip':
+        return ParallelGzipWriter(fileobj, level=level, threads=threads)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression needs the zstandard package (pip install zstandard)")
+        compressor = zstandard.ZstdCompressor(level=level, threads=-1 if threads is None else threads)
+        return compressor.stream_writer(fileobj, closefd=False)
+    if compression == 'none':
+        return _PassThroughWriter(fileobj)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def write_package(root, fileobj, paths=None, prefix='', extra=None,
+                  compression='gzip', level=6, threads=None):
+    """Stream files under root into a compressed tar written to fileobj.
+
+    paths may be any iterable (a generator keeps memory flat); by default
+    every non-hidden file under root is included. extra maps archive names
+    to bytes for generated members such as manifests.
+    """
+    with span('package.write', compression=compression) as current:
+        writer = open_compressed(fileobj, compression, level, threads)
+        files = 0
+        try:
+            with tarfile.open(fileobj=writer, mode='w|') as tar:
+                for rel_path in (iter_files(root) if paths is None else paths):
+                    tar.add(os.path.join(root, rel_path), arcname=prefix + rel_path, recursive=False)
+                    files += 1
+                for name, data in (extra or {}).items():
+                    add_bytes(tar, name, data)
+        except BaseException:
+            # Finishing the stream would make a partial archive look complete
+            if hasattr(writer, 'abort'):
+                writer.abort()
+            raise
+        else:
+            writer.close()
+        finally:
+            current.add('files', files)
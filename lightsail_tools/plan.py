@@ -0,0 +1,91 @@
+"""
+Deployment Plans
+================
+What a deploy would do, worked out by comparing the desired state (files,
+service unit, environment file, ports, migrations) with what the instance
+reports, before anything is changed. The deployers print a plan with
+--plan and use the same plan on a real run to skip unchanged steps.
+"""
+
+import json
+import os
+import tarfile
+
+CHANGE = 'change'
+KEEP = 'keep'
+
+
+class Plan:
+    """Ordered steps, each either a change or something already up to date"""
+
+    def __init__(self, target):
+        self.target = target
+        self.steps = []
+
+    def change(self, name, detail, transfer_bytes=0, remote_steps=1):
+        """Record a step that will run; remote_steps counts the commands it needs"""
+        self.steps.append({'step': name, 'action': CHANGE, 'detail': detail,
+                           'bytes': transfer_bytes, 'remote_steps': remote_steps})
+
+    def keep(self, name, detail='up to date'):
+        """Record a step that will be skipped"""
+        self.steps.append({'step': name, 'action': KEEP, 'detail': detail,
+                           'bytes': 0, 'remote_steps': 0})
+
+    def changes(self, name):
+        """Whether step name will run"""
+        return any(s['step'] == name and s['action'] == CHANGE for s in self.steps)
+
+    @property
+    def changed(self):
+        return any(s['action'] == CHANGE for s in self.steps)
+
+    @property
+    def transfer_bytes(self):
+        return sum(s['bytes'] for s in self.steps)
+
+    @property
+    def remote_steps(self):
+        return sum(s['remote_steps'] for s in self.steps)
+
+    def to_dict(self):
+        return {'target': self.target, 'changed': self.changed, 'transfer_bytes': self.transfer_bytes,
+                'remote_steps': self.remote_steps, 'steps': self.steps}
+
+    def print_summary(self):
+        print(f"\n📋 Plan for {self.target}")
+        width = max([len(s['step']) for s in self.steps] + [4])
+        for s in self.steps:
+            marker = '~' if s['action'] == CHANGE else '='
+            line = f"  {marker} {s['step']:<{width}}  {s['detail']}"
+            if s['bytes']:
+                line += f" ({format_bytes(s['bytes'])})"
+            print(line)
+        if self.changed:
+            print(f"  {sum(1 for s in self.steps if s['action'] == CHANGE)} to change, "
+                  f"{format_bytes(self.transfer_bytes)} to transfer, {self.remote_steps} remote steps")
+        else:
+            print("  No changes")
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def source_sizes(source, paths, prefix=''):
+    """Uncompressed bytes of paths in a directory or in a tar archive under prefix"""
+    if os.path.isdir(source):
+        return sum(os.path.getsize(os.path.join(source, p)) for p in paths)
+    wanted = {prefix + p for p in paths}
+    with tarfile.open(source, 'r:*') as tar:
+        return sum(m.size for m in tar if m.isfile() and m.name in wanted)
+
+
+def write_plans(path, plans):
+    """Write plans as a JSON list, for gating a deploy on the plan in CI"""
+    with open(path, 'w') as f:
+        json.dump([plan.to_dict() for plan in plans], f, indent=2)
@@ -0,0 +1,178 @@
+"""
+Golden Snapshot Provisioning
+============================
+Bake a blueprint's first-boot setup (package installs, database and web
+server configuration from user data) into an instance snapshot once, copy
+it to every region that needs it and create new instances from it, so
+fresh capacity boots already configured instead of running the setup
+again. The snapshot name carries a fingerprint of the blueprint, bundle
+and user data, so changing any of them bakes a new snapshot.
+
+Regions are provisioned concurrently: each copies the snapshot (if it
+does not have it yet), creates its instances in one call and waits for
+them on a bounded worker pool.
+"""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from lightsail_tools.aws import get_client
+from lightsail_tools.fleet import FleetResult, run_fleet
+from lightsail_tools.readiness import UnexpectedStateError, poll, wait_until_ready
+from lightsail_tools.retry import API_RETRY, API_THROTTLE_RETRY
+from lightsail_tools.state import fingerprint
+from lightsail_tools.tracing import span
+
+SNAPSHOT_TIMEOUT = 3600
+
+
+def golden_snapshot_name(prefix, blueprint_id, bundle_id, user_data):
+    """Snapshot name that changes whenever what gets baked in changes"""
+    return f"{prefix}-golden-{fingerprint([blueprint_id, bundle_id, user_data])[:12]}"
+
+
+def get_snapshot(lightsail, name):
+    """Return the instance snapshot called name, or None"""
+    try:
+        response = API_RETRY.call(lambda: lightsail.get_instance_snapshot(instanceSnapshotName=name))
+        return response['instanceSnapshot']
+    except lightsail.exceptions.NotFoundException:
+        return None
+
+
+def wait_for_snapshot(lightsail, name, timeout=SNAPSHOT_TIMEOUT):
+    """Poll until the snapshot is available; False if it failed or timed out"""
+    def check():
+        snapshot = get_snapshot(lightsail, name)
+        state = snapshot['state'] if snapshot else 'missing'
+        if state == 'available':
+            return True
+        if state != 'pending':
+            return UnexpectedStateError(state)
+        return False
+
+    result = poll(check, timeout, initial_delay=5, max_delay=30)
+    if isinstance(result, UnexpectedStateError):
+        print(f"✗ Snapshot {name} is {result}")
+        return False
+    return bool(result)
+
+
+def create_instances(lightsail, region, instance_names, bundle_id, tags=(),
+                     blueprint_id=None, user_data='', snapshot_name=None):
+    """Create instances from snapshot_name if given, otherwise from blueprint_id with user_data"""
+    common = dict(instanceNames=list(instance_names), availabilityZone=f'{region}a',
+                  bundleId=bundle_id, tags=list(tags))
+    if snapshot_name:
+        return API_THROTTLE_RETRY.call(lambda: lightsail.create_instances_from_snapshot(
+            instanceSnapshotName=snapshot_name, **common))
+    return API_THROTTLE_RETRY.call(lambda: lightsail.create_instances(
+        blueprintId=blueprint_id, userData=user_data, **common))
+
+
+def build_golden_snapshot(region, name, blueprint_id, bundle_id, user_data, tags=(),
+                          timeout=SNAPSHOT_TIMEOUT):
+    """Boot a builder instance, let its user data finish, snapshot it and delete it"""
+    lightsail = get_client('lightsail', region)
+    builder = f"{name}-builder"
+    print(f"🔨 Building golden snapshot {name} in {region}...")
+    with span('provision.snapshot.build', region=region, snapshot=name):
+        try:
+            try:
+                API_RETRY.call(lambda: lightsail.get_instance(instanceName=builder))
+                print(f"  Reusing builder instance {builder}")
+            except lightsail.exceptions.NotFoundException:
+                create_instances(lightsail, region, [builder], bundle_id, tags,
+                                 blueprint_id=blueprint_id, user_data=user_data)
+            report = wait_until_ready(lightsail, builder, region, timeout=timeout)
+            report.print_summary()
+            if not report.ready:
+                print(f"✗ Builder instance did not become ready ({report.failed_phase})")
+                return False
+            API_THROTTLE_RETRY.call(lambda: lightsail.create_instance_snapshot(
+                instanceSnapshotName=name, instanceName=builder, tags=list(tags)))
+            if not wait_for_snapshot(lightsail, name, timeout):
+                return False
+            print(f"✓ Golden snapshot {name} is available in {region}")
+            return True
+        except Exception as e:
+            print(f"✗ Error building golden snapshot: {e}")
+            return False
+        finally:
+            try:
+                API_RETRY.call(lambda: lightsail.delete_instance(instanceName=builder))
+            except lightsail.exceptions.NotFoundException:
+                pass
+            except Exception as e:
+                print(f"Warning: Could not delete builder instance {builder}: {e}")
+
+
+def ensure_snapshot(region, name, source_region, timeout=SNAPSHOT_TIMEOUT):
+    """Make snapshot name available in region, copying it from source_region if needed"""
+    lightsail = get_client('lightsail', region)
+    snapshot = get_snapshot(lightsail, name)
+    if snapshot is None:
+        if region == source_region:
+            return False
+        print(f"📋 Copying snapshot {name} from {source_region} to {region}...")
+        with span('provision.snapshot.copy', region=region, snapshot=name):
+            try:
+                API_THROTTLE_RETRY.call(lambda: lightsail.copy_snapshot(
+                    sourceSnapshotName=name, targetSnapshotName=name, sourceRegion=source_region))
+            except Exception as e:
+                print(f"✗ Error copying snapshot to {region}: {e}")
+                return False
+            return wait_for_snapshot(lightsail, name, timeout)
+    return snapshot['state'] == 'available' or wait_for_snapshot(lightsail, name, timeout)
+
+
+def provision(targets, blueprint_id, bundle_id, user_data, tags=(), snapshot_prefix=None,
+              source_region=None, timeout=1800, health_url=None, max_concurrency=10):
+    """Create the instances in targets ({region: [instance names]}) and wait for them.
+
+    With snapshot_prefix set, instances are created from the golden
+    snapshot, which is built in source_region (default: the first region)
+    on first use; otherwise they boot the blueprint and run user_data.
+    Returns a FleetResult per instance, named region/instance.
+    """
+    source_region = source_region or next(iter(targets))
+    snapshot_name = None
+    if snapshot_prefix:
+        snapshot_name = golden_snapshot_name(snapshot_prefix, blueprint_id, bundle_id, user_data)
+        ready = ensure_snapshot(source_region, snapshot_name, source_region) or \
+            build_golden_snapshot(source_region, snapshot_name, blueprint_id, bundle_id, user_data, tags)
+        if not ready:
+            return [FleetResult(f"{region}/{name}", 'failed', error='golden snapshot unavailable')
+                    for region, names in targets.items() for name in names]
+
+    def provision_region(region):
+        names = targets[region]
+        failed = [FleetResult(f"{region}/{name}", 'failed') for name in names]
+        lightsail = get_client('lightsail', region)
+        with span('provision.region', region=region, instances=len(names)):
+            try:
+                copy_needed = snapshot_name and region != source_region
+                if copy_needed and not ensure_snapshot(region, snapshot_name, source_region):
+                    for result in failed:
+                        result.error = 'golden snapshot unavailable'
+                    return failed
+                create_instances(lightsail, region, names, bundle_id, tags, blueprint_id=blueprint_id,
+                                 user_data=user_data, snapshot_name=snapshot_name)
+                print(f"✓ Creating {len(names)} instance(s) in {region}"
+                      f"{' from ' + snapshot_name if snapshot_name else ''}")
+            except Exception as e:
+                for result in failed:
+                    result.error = str(e)
+                return failed
+
+            def wait_ready(name):
+                return wait_until_ready(lightsail, name, region, timeout=timeout, health_url=health_url).ready
+
+            results = run_fleet(names, wait_ready, max_concurrency=max_concurrency)
+        for result in results:
+            result.instance_name = f"{region}/{result.instance_name}"
+        return results
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, provision_region, region) for region in targets]
+        return [result for future in futures for result in future.result()]
@@ -0,0 +1,185 @@
+"""
+Instance Readiness Checks
+=========================
+Decide when a Lightsail instance is actually usable by combining several
+signals instead of sleeping for a fixed time: Lightsail state, the SSH
+port, cloud-init completion and an HTTP health check. Every wait polls
+with exponential backoff and jitter and returns as soon as it succeeds.
+"""
+
+import random
+import socket
+import time
+import urllib.request
+
+from lightsail_tools.retry import FATAL, NO_RETRY, classify
+from lightsail_tools.ssh import SSHSession
+from lightsail_tools.tracing import count, span
+
+USER_DATA_MARKER = '/var/log/user-data-complete.marker'
+
+
+def poll(check, timeout, initial_delay=1.0, max_delay=30.0, factor=2.0):
+    """Call check() until it returns a truthy value or timeout expires.
+
+    Returns the truthy value, or None on timeout. Exceptions raised by
+    check() count as "not ready yet". Each retry is counted on the current
+    trace span.
+    """
+    deadline = time.time() + timeout
+    delay = initial_delay
+    while True:
+        try:
+            result = check()
+            if result:
+                return result
+        except Exception:
+            pass
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        count('retries')
+        # Full jitter keeps many pipelines from polling in lockstep
+        time.sleep(min(remaining, random.uniform(0, delay)))
+        delay = min(max_delay, delay * factor)
+
+
+def port_open(host, port, timeout=3):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def http_ok(url, timeout=5):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return 200 <= response.status < 400
+    except Exception:
+        return False
+
+
+class UnexpectedStateError(Exception):
+    """The instance reached a state it will not recover from on its own"""
+
+
+class ReadinessReport:
+    """Outcome and per-phase timings of a readiness wait"""
+
+    def __init__(self):
+        self.phases = []
+        self.ready = False
+        self.failed_phase = None
+        # get_instance's description once it reported the instance running
+        self.instance = None
+
+    def record(self, name, started, ok):
+        self.phases.append((name, time.time() - started, ok))
+        if not ok and self.failed_phase is None:
+            self.failed_phase = name
+        return ok
+
+    @property
+    def total(self):
+        return sum(duration for _, duration, _ in self.phases)
+
+    def print_summary(self):
+        for name, duration, ok in self.phases:
+            print(f"  {'✓' if ok else '✗'} {name:<12} {duration:6.1f}s")
+        print(f"  {'total':<14} {self.total:6.1f}s")
+
+
+def wait_for_running(lightsail, instance_name, timeout):
+    """Poll Lightsail until the instance is running and return it"""
+    def check():
+        try:
+            instance = lightsail.get_instance(instanceName=instance_name)['instance']
+        except Exception as e:
+            # Throttling and network errors just mean "poll again"
+            if classify(e) == FATAL:
+                return UnexpectedStateError(str(e))
+            raise
+        state = instance['state']['name']
+        if state == 'running':
+            return instance
+        if state not in ('pending', 'starting'):
+            return UnexpectedStateError(state)
+        print(f"  Instance state: {state} (waiting...)")
+        return None
+
+    result = poll(check, timeout, initial_delay=2, max_delay=20)
+    if isinstance(result, UnexpectedStateError):
+        print(f"✗ Unexpected instance state: {result}")
+        return None
+    return result
+
+
+def wait_for_cloud_init(lightsail, instance_name, region, timeout):
+    """Wait until the user data script has finished"""
+    command = (
+        f"test -f {USER_DATA_MARKER} && exit 0; "
+        "command -v cloud-init >/dev/null || exit 0; "
+        f"timeout {int(timeout)} sudo cloud-init status --wait >/dev/null"
+    )
+
+    def check():
+        # cloud-init status --wait blocks remotely, so this returns the
+        # moment user data finishes instead of on the next poll. poll() does
+        # the retrying, and a booting host must not trip the circuit breaker.
+        with SSHSession(lightsail, instance_name, region,
+                        connect_retry=NO_RETRY, command_retry=NO_RETRY) as session:
+            result = session.run(command, timeout=timeout + 30)
+        if result.returncode == 255:
+            return False
+        if result.returncode != 0:
+            print(f"  Warning: cloud-init finished with errors (exit code: {result.returncode})")
+        return True
+
+    return poll(check, timeout, initial_delay=2, max_delay=15)
+
+
+def wait_until_ready(lightsail, instance_name, region='us-east-1', timeout=1800,
+                     ssh_port=22, health_url=None, check_cloud_init=True):
+    """Wait for every readiness phase in turn and return a ReadinessReport.
+
+    health_url may contain {ip}, which is replaced with the public IP.
+    """
+    report = ReadinessReport()
+    deadline = time.time() + timeout
+
+    def remaining():
+        return max(1, deadline - time.time())
+
+    started = time.time()
+    with span('ready.running', instance=instance_name):
+        instance = wait_for_running(lightsail, instance_name, remaining())
+    if not report.record('running', started, instance is not None):
+        return report
+    report.instance = instance
+    public_ip = instance.get('publicIpAddress')
+
+    if public_ip and ssh_port:
+        started = time.time()
+        with span('ready.ssh-port', instance=instance_name):
+            ok = poll(lambda: port_open(public_ip, ssh_port), remaining(), initial_delay=1, max_delay=10)
+        if not report.record('ssh-port', started, bool(ok)):
+            return report
+
+    if check_cloud_init:
+        started = time.time()
+        with span('ready.cloud-init', instance=instance_name):
+            ok = wait_for_cloud_init(lightsail, instance_name, region, remaining())
+        if not report.record('cloud-init', started, bool(ok)):
+            return report
+
+    if health_url and public_ip:
+        url = health_url.format(ip=public_ip)
+        started = time.time()
+        with span('ready.http', instance=instance_name):
+            ok = poll(lambda: http_ok(url), remaining(), initial_delay=1, max_delay=10)
+        if not report.record('http', started, bool(ok)):
+            return report
+
+    report.ready = True
+    return report
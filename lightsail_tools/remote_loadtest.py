@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Remote Load Probe
+=================
+Runs on the instance, not locally. Sends a burst of concurrent GET
+requests to a few paths of the locally running app and prints latency
+percentiles, error rate and throughput as one compact JSON object,
+optionally saving it as well. Uploaded and cached like remote_probe.py by
+lightsail_tools.diagnostics; standard library only.
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(1, math.ceil(fraction * len(sorted_values))) - 1]
+
+
+def request(url, timeout):
+    """Return (latency in ms, error or None)"""
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            error = None if response.status < 400 else str(response.status)
+    except urllib.error.HTTPError as e:
+        error = str(e.code)
+    except Exception as e:
+        error = type(e).__name__
+    return (time.perf_counter() - started) * 1000, error
+
+
+def summarize(samples, duration):
+    """Latency percentiles, error rate and throughput of (latency, error) samples"""
+    latencies = sorted(latency for latency, error in samples if error is None)
+    errors = sum(1 for _, error in samples if error is not None)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else None,
+        'rps': round(len(samples) / duration, 1) if duration else None,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://localhost:3000')
+    parser.add_argument('--paths', default='/')
+    parser.add_argument('--requests', type=int, default=100, help="requests per path")
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=3, help="uncounted requests per path first")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--save', help="also write the results to this file")
+    args = parser.parse_args()
+    paths = [p for p in args.paths.split(',') if p]
+    urls = {path: args.base_url.rstrip('/') + path for path in paths}
+
+    for path in paths:
+        for _ in range(args.warmup):
+            request(urls[path], args.timeout)
+
+    # Interleave the paths so each sees the same load
+    schedule = [path for _ in range(args.requests) for path in paths]
+    samples = {path: [] for path in paths}
+    failures = {}
+    lock = threading.Lock()
+
+    def send(path):
+        latency, error = request(urls[path], args.timeout)
+        with lock:
+            samples[path].append((latency, error))
+            if error is not None:
+                failures[error] = failures.get(error, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        list(pool.map(send, schedule))
+    duration = time.perf_counter() - started
+
+    results = summarize([s for path in paths for s in samples[path]], duration)
+    results.update(
+        base_url=args.base_url, concurrency=args.concurrency, duration=round(duration, 3),
+        measured_at=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), failures=failures,
+        endpoints={path: summarize(samples[path], duration) for path in paths},
+    )
+    for summary in [results] + list(results['endpoints'].values()):
+        for key in ('p50', 'p95', 'p99'):
+            if summary[key] is not None:
+                summary[key] = round(summary[key], 2)
+    if args.save:
+        # Releases may share this file through hard links; write a new one
+        temp = f"{args.save}.{os.getpid()}"
+        with open(temp, 'w') as f:
+            json.dump(results, f)
+        os.replace(temp, args.save)
+    print(json.dumps(results, separators=(',', ':')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Remote Log Reader
+=================
+Runs on the instance, not locally. Reads what was added to each requested
+log since the position the caller passes in: a byte offset and inode for
+files, a journalctl cursor for systemd units. Only complete lines are
+returned, optionally filtered by a regular expression, and the result is
+printed as gzip-compressed, base64-encoded JSON. Uploaded and cached like
+remote_probe.py by lightsail_tools.diagnostics; standard library only.
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import re
+import subprocess
+
+UNIT_PREFIX = 'unit:'
+CURSOR_PREFIX = '-- cursor: '
+# Bytes read per requested line when a file is read for the first time
+FIRST_READ_LINE_BYTES = 1024
+# Bytes kept of a line longer than a whole read
+TRUNCATED_LINE_BYTES = 4096
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(max(0, end - start))
+
+
+def complete_lines(data, max_bytes, skip=False):
+    """Split data into complete lines; returns (lines, bytes consumed, skip).
+
+    With skip set, everything up to the first newline is the rest of a line
+    that was already reported truncated and is dropped. A full max_bytes
+    window without any newline is reported as one truncated line and
+    consumed, and skip is returned set so the rest of that line is dropped
+    on the next read.
+    """
+    consumed = 0
+    if skip:
+        newline = data.find(b'\n')
+        if newline < 0:
+            return [], len(data), True
+        consumed = newline + 1
+    cut = data.rfind(b'\n') + 1
+    if cut > consumed:
+        return data[consumed:cut].decode('utf-8', 'replace').splitlines(), cut, False
+    if consumed == 0 and max_bytes and len(data) >= max_bytes:
+        line = data[:TRUNCATED_LINE_BYTES].decode('utf-8', 'replace')
+        return [f"{line} [line longer than {max_bytes} bytes truncated]"], len(data), True
+    return [], consumed, False
+
+
+def read_file(path, position, lines, max_bytes):
+    """New complete lines of a file since position {offset, inode, skip}"""
+    st = os.stat(path)
+    offset, inode, skip = position.get('offset'), position.get('inode'), position.get('skip', False)
+    result = {'inode': st.st_ino, 'rotated': False, 'more': False, 'skip': False}
+    collected, read = [], 0
+    if offset is None:
+        # First read: the last lines only, then follow from the end
+        start = max(0, st.st_size - min(max_bytes, max(1, lines) * FIRST_READ_LINE_BYTES))
+        data = read_range(path, start, st.st_size)
+        if start:
+            data = data[data.find(b'\n') + 1:]
+        collected, cut, _ = complete_lines(data, 0)
+        collected = collected[-lines:] if lines else []
+        result.update(offset=st.st_size - (len(data) - cut), lines=collected, read_bytes=len(data))
+        return result
+    if inode != st.st_ino or st.st_size < offset:
+        # Rotated or truncated: finish the previous file if it was kept as .1
+        try:
+            old = os.stat(path + '.1')
+            if old.st_ino == inode and old.st_size > offset:
+                end = min(old.st_size, offset + max_bytes)
+                data = read_range(path + '.1', offset, end)
+                collected, cut, skip = complete_lines(data, max_bytes, skip)
+                read = len(data)
+                if end < old.st_size:
+                    # Drain the rest of the old file before moving on
+                    result.update(inode=inode, offset=offset + cut, lines=collected, read_bytes=read,
+                                  more=True, skip=skip)
+                    return result
+        except OSError:
+            pass
+        result['rotated'] = True
+        offset, skip = 0, False
+    end = min(st.st_size, offset + max(0, max_bytes - read))
+    data = read_range(path, offset, end)
+    # Only a window of the whole max_bytes can hold a line too long to return
+    new_lines, cut, skip = complete_lines(data, max_bytes if not read else 0, skip)
+    result.update(offset=offset + cut, lines=collected + new_lines, read_bytes=read + len(data),
+                  more=end < st.st_size, skip=skip)
+    return result
+
+
+def read_unit(unit, position, lines, max_lines):
+    """New journal entries of a systemd unit since position {cursor}"""
+    argv = ['journalctl', '-u', unit, '--no-pager', '-o', 'short-iso', '--show-cursor']
+    cursor = position.get('cursor')
+    if cursor:
+        argv += ['--after-cursor', cursor, '-n', str(max_lines)]
+    else:
+        argv += ['-n', str(lines)]
+    output = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, timeout=60)
+    if output.returncode != 0:
+        raise RuntimeError(output.stderr.strip() or f"journalctl exit code {output.returncode}")
+    entries = output.stdout.splitlines()
+    if entries and entries[-1].startswith(CURSOR_PREFIX):
+        cursor = entries.pop()[len(CURSOR_PREFIX):]
+    entries = [line for line in entries if not line.startswith('-- ')]
+    return {'cursor': cursor, 'lines': entries, 'read_bytes': len(output.stdout),
+            'more': bool(position.get('cursor')) and len(entries) >= max_lines}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--request', required=True,
+                        help="JSON {log: position}; a log is a file path or unit:<name>")
+    parser.add_argument('--grep', default='')
+    parser.add_argument('--ignore-case', action='store_true')
+    parser.add_argument('--lines', type=int, default=50)
+    parser.add_argument('--max-bytes', type=int, default=8 * 1024 * 1024)
+    args = parser.parse_args()
+    pattern = re.compile(args.grep, re.IGNORECASE if args.ignore_case else 0) if args.grep else None
+
+    logs = {}
+    for log, position in json.loads(args.request).items():
+        try:
+            if log.startswith(UNIT_PREFIX):
+                result = read_unit(log[len(UNIT_PREFIX):], position, args.lines, max(1, args.max_bytes // 200))
+            else:
+                result = read_file(log, position, args.lines, args.max_bytes)
+        except Exception as e:
+            logs[log] = {'error': str(e)}
+            continue
+        if pattern:
+            result['lines'] = [line for line in result['lines'] if pattern.search(line)]
+        logs[log] = result
+    payload = gzip.compress(json.dumps({'logs': logs}, separators=(',', ':')).encode(), 6)
+    print(base64.b64encode(payload).decode())
+
+
+if __name__ == '__main__':
+    main()
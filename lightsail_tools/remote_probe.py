@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Remote Diagnostic Probe
+=======================
+Runs on the instance, not locally. In one execution it collects runtime
+versions and where each runtime came from, package sources, service
+state, disk and memory figures and log tails, and prints them as one
+compact JSON object. Uploaded once per host and cached there under its
+content hash by lightsail_tools.diagnostics; standard library only, so it
+runs on any stock python3.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import time
+
+# name: (binary candidates, version arguments)
+RUNTIMES = {
+    'node': (['node', '/usr/local/bin/node', '/snap/bin/node'], ['--version']),
+    'npm': (['npm', '/usr/local/bin/npm', '/snap/bin/npm'], ['--version']),
+    'python3': (['python3'], ['--version']),
+    'php': (['php', '/opt/bitnami/php/bin/php'], ['-v']),
+    'mysql': (['mysql', '/opt/bitnami/mysql/bin/mysql', '/opt/bitnami/mariadb/bin/mysql'], ['--version']),
+    'nginx': (['nginx', '/usr/sbin/nginx', '/opt/bitnami/nginx/sbin/nginx'], ['-v']),
+    'apache': (['apache2', '/usr/sbin/apache2', '/opt/bitnami/apache/bin/httpd'], ['-v']),
+}
+CLOUD_INIT_LOG = '/var/log/cloud-init-output.log'
+USER_DATA_MARKER = '/var/log/user-data-complete.marker'
+TAIL_BYTES = 64 * 1024
+
+
+def run(argv, timeout=10):
+    """Return (exit code, combined output); 127 if the program is missing"""
+    try:
+        result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, timeout=timeout)
+        return result.returncode, result.stdout.strip()
+    except (OSError, subprocess.SubprocessError) as e:
+        return 127, str(e)
+
+
+def tail(path, lines):
+    """Last lines of a text file, reading at most TAIL_BYTES from its end"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - TAIL_BYTES))
+            text = f.read().decode('utf-8', 'replace')
+    except OSError:
+        return None
+    return text.splitlines()[-lines:] if lines else []
+
+
+def find_binary(candidates):
+    for candidate in candidates:
+        path = shutil.which(candidate) if os.sep not in candidate else candidate
+        if path and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def package_source(path):
+    """Where a binary came from: snap, bitnami, nvm, apt:<package> or manual"""
+    real = os.path.realpath(path)
+    if real.startswith('/snap/'):
+        return 'snap'
+    if real.startswith('/opt/bitnami/'):
+        return 'bitnami'
+    if '/.nvm/' in real:
+        return 'nvm'
+    code, output = run(['dpkg', '-S', real])
+    if code == 0 and ':' in output:
+        return 'apt:' + output.split(':', 1)[0]
+    return 'manual'
+
+
+def collect_runtimes():
+    runtimes = {}
+    for name, (candidates, version_args) in RUNTIMES.items():
+        path = find_binary(candidates)
+        if path is None:
+            runtimes[name] = None
+            continue
+        code, output = run([path] + version_args)
+        runtimes[name] = {
+            'path': path,
+            'version': output.splitlines()[0] if code == 0 and output else None,
+            'source': package_source(path),
+        }
+    return runtimes
+
+
+def collect_packages(patterns):
+    packages = {'apt': {}, 'snap': {}, 'repositories': []}
+    code, output = run(['dpkg-query', '-W', '-f=${Package} ${Version} ${db:Status-Abbrev}\n']
+                       + [p + '*' for p in patterns])
+    for line in output.splitlines() if code in (0, 1) else []:
+        fields = line.split()
+        if len(fields) >= 3 and fields[2].startswith('ii'):
+            packages['apt'][fields[0]] = fields[1]
+    code, output = run(['snap', 'list'])
+    for line in output.splitlines()[1:] if code == 0 else []:
+        fields = line.split()
+        if fields and any(p in fields[0] for p in patterns):
+            packages['snap'][fields[0]] = fields[1] if len(fields) > 1 else None
+    for path in sorted(glob.glob('/etc/apt/sources.list.d/*')):
+        name = os.path.basename(path)
+        if any(p in name for p in patterns):
+            packages['repositories'].append(name)
+    return packages
+
+
+def collect_services(services):
+    if not shutil.which('systemctl'):
+        return {}
+    state = {}
+    for service in services:
+        _, active = run(['systemctl', 'is-active', service])
+        _, enabled = run(['systemctl', 'is-enabled', service])
+        state[service] = {'active': active or None, 'enabled': enabled or None}
+    return state
+
+
+def collect_disk(paths):
+    disks, seen = [], set()
+    for path in paths:
+        try:
+            device = os.stat(path).st_dev
+            usage = shutil.disk_usage(path)
+        except OSError:
+            continue
+        if device in seen:
+            continue
+        seen.add(device)
+        disks.append({'path': path, 'total': usage.total, 'used': usage.used, 'free': usage.free,
+                      'percent': round(100.0 * usage.used / usage.total, 1) if usage.total else None})
+    return disks
+
+
+def collect_memory():
+    fields = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                fields[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return {key: fields.get(name) for key, name in (
+        ('total', 'MemTotal'), ('available', 'MemAvailable'),
+        ('swap_total', 'SwapTotal'), ('swap_free', 'SwapFree'),
+    )}
+
+
+def collect_cloud_init(lines, grep):
+    code, status = run(['cloud-init', 'status'])
+    log = tail(CLOUD_INIT_LOG, max(lines, 2000) if grep else lines) or []
+    matches = [line for line in log if grep and grep.lower() in line.lower()]
+    return {
+        'status': status.replace('status:', '').strip() if code != 127 else None,
+        'user_data_marker': os.path.exists(USER_DATA_MARKER),
+        'log_tail': log[-lines:] if lines else [],
+        'matches': matches[-lines:],
+    }
+
+
+def collect_logs(services, lines):
+    if not lines or not shutil.which('journalctl'):
+        return {}
+    logs = {}
+    for service in services:
+        code, output = run(['journalctl', '-u', service, '-n', str(lines), '--no-pager', '-o', 'short-iso'])
+        logs[service] = output.splitlines() if code == 0 else []
+    return logs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--services', default='')
+    parser.add_argument('--packages', default='node,npm')
+    parser.add_argument('--disk', default='/,/var,/tmp')
+    parser.add_argument('--tail', type=int, default=20)
+    parser.add_argument('--grep', default='node')
+    args = parser.parse_args()
+    services = [s for s in args.services.split(',') if s]
+
+    started = time.time()
+    report, errors = {}, {}
+    sections = [
+        ('runtimes', collect_runtimes),
+        ('packages', lambda: collect_packages([p for p in args.packages.split(',') if p])),
+        ('services', lambda: collect_services(services)),
+        ('disk', lambda: collect_disk([p for p in args.disk.split(',') if p])),
+        ('memory', collect_memory),
+        ('cloud_init', lambda: collect_cloud_init(args.tail, args.grep)),
+        ('logs', lambda: collect_logs(services, args.tail)),
+    ]
+    for name, collect in sections:
+        try:
+            report[name] = collect()
+        except Exception as e:
+            report[name] = None
+            errors[name] = str(e)
+    report['host'] = {
+        'hostname': socket.gethostname(), 'kernel': platform.release(),
+        'load': list(os.getloadavg()), 'path': os.environ.get('PATH', ''),
+    }
+    report['errors'] = errors
+    report['elapsed'] = round(time.time() - started, 3)
+    print(json.dumps(report, separators=(',', ':')))
+
+
+if __name__ == '__main__':
+    main()
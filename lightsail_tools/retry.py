@@ -0,0 +1,237 @@
+"""
+Retry Policy
+============
+One place that decides whether a failed Lightsail API call or SSH
+operation is worth retrying, how long to back off and when to give up.
+
+Errors are classified as throttling, transient (network blips, 5xx),
+booting (SSH refused or timing out while an instance starts) or fatal.
+Retries use exponential backoff with full jitter inside a per-operation
+deadline. A per-host circuit breaker makes operations against a host that
+keeps failing return at once instead of each waiting out its own timeouts.
+"""
+
+import asyncio
+import itertools
+import random
+import subprocess
+import threading
+import time
+
+from lightsail_tools.tracing import count
+
+THROTTLE = 'throttle'
+TRANSIENT = 'transient'
+BOOTING = 'booting'
+FATAL = 'fatal'
+
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException',
+    'RequestLimitExceeded', 'RequestThrottled', 'RequestThrottledException', 'SlowDown',
+}
+TRANSIENT_CODES = {
+    'InternalFailure', 'InternalError', 'InternalServerError', 'ServiceException',
+    'ServiceUnavailable', 'ServiceUnavailableException', 'RequestTimeout', 'RequestTimeoutException',
+}
+# botocore exceptions, matched by name so botocore need not be imported
+TRANSIENT_EXCEPTIONS = {
+    'EndpointConnectionError', 'ConnectTimeoutError', 'ReadTimeoutError',
+    'ConnectionClosedError', 'ProxyConnectionError',
+}
+# ssh/scp messages when the connection never got as far as running anything
+BOOTING_SSH_ERRORS = (
+    'Connection refused', 'No route to host', 'Connection timed out', 'Operation timed out',
+    'Network is unreachable', 'kex_exchange_identification',
+)
+TRANSIENT_SSH_ERRORS = (
+    'Connection reset', 'Connection closed', 'closed by remote host', 'Broken pipe',
+    'Permission denied',
+)
+
+
+class CircuitOpenError(Exception):
+    """The host failed too often recently; the operation was not attempted"""
+
+
+def _error_code(error):
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return (response.get('Error') or {}).get('Code')
+    return None
+
+
+def classify_ssh_output(text):
+    """Classify ssh/scp error output, or return None if it is not a connection error"""
+    if any(message in text for message in BOOTING_SSH_ERRORS):
+        return BOOTING
+    if any(message in text for message in TRANSIENT_SSH_ERRORS):
+        return TRANSIENT
+    return None
+
+
+def classify_ssh_result(result):
+    """Classify a failed ssh/scp CompletedProcess; None means it ran.
+
+    ssh exits 255 for its own errors; any other code is the remote command's.
+    """
+    if result.returncode != 255:
+        return None
+    return classify_ssh_output(result.stderr or '')
+
+
+def classify(error):
+    """Return THROTTLE, TRANSIENT, BOOTING or FATAL for an exception"""
+    if isinstance(error, CircuitOpenError):
+        return FATAL
+    code = _error_code(error)
+    if code:
+        if code in THROTTLE_CODES:
+            return THROTTLE
+        return TRANSIENT if code in TRANSIENT_CODES else FATAL
+    if {cls.__name__ for cls in type(error).__mro__} & TRANSIENT_EXCEPTIONS:
+        return TRANSIENT
+    if isinstance(error, (subprocess.TimeoutExpired, TimeoutError, ConnectionError)):
+        return TRANSIENT
+    return classify_ssh_output(str(error)) or FATAL
+
+
+class CircuitBreaker:
+    """Per-host failure tracking.
+
+    After failure_threshold operations in a row have given up on a host,
+    further operations fail immediately with CircuitOpenError. Once
+    reset_timeout has passed, one trial operation is let through; success
+    closes the circuit again.
+    """
+
+    def __init__(self, failure_threshold=2, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = {}
+        self.opened = {}
+        self.lock = threading.Lock()
+
+    def check(self, host):
+        """Raise CircuitOpenError unless an operation on host may proceed"""
+        with self.lock:
+            opened = self.opened.get(host)
+            if opened is None:
+                return
+            waited = time.time() - opened
+            if waited >= self.reset_timeout:
+                # Half-open: this caller is the trial, everyone else keeps failing fast
+                self.opened[host] = time.time()
+                return
+        raise CircuitOpenError(
+            f"{host} failed {self.failures.get(host, 0)} times in a row; "
+            f"not trying again for {self.reset_timeout - waited:.0f}s"
+        )
+
+    def record_success(self, host):
+        with self.lock:
+            self.failures.pop(host, None)
+            self.opened.pop(host, None)
+
+    def record_failure(self, host):
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.failure_threshold:
+                self.opened[host] = time.time()
+
+
+class RetryPolicy:
+    """Retry an operation on the error kinds in retry_on.
+
+    Delays grow exponentially from base_delay (throttle_delay for
+    throttling) up to max_delay with full jitter. No retry starts after
+    deadline seconds or beyond max_attempts. With a breaker, operations
+    that give up count against the host and open circuits are honoured.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=20.0, deadline=60.0,
+                 retry_on=(THROTTLE, TRANSIENT, BOOTING), throttle_delay=2.0, breaker=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_on = retry_on
+        self.throttle_delay = throttle_delay
+        self.breaker = breaker
+
+    def _next_delay(self, kind, attempt, deadline_at, host):
+        """Seconds to wait before the next attempt, or None to stop"""
+        if kind is None:
+            if self.breaker and host:
+                self.breaker.record_success(host)
+            return None
+        base = self.throttle_delay if kind == THROTTLE else self.base_delay
+        delay = random.uniform(0, min(self.max_delay, base * 2 ** attempt))
+        out_of_time = deadline_at is not None and time.time() + delay > deadline_at
+        if kind not in self.retry_on or attempt + 1 >= self.max_attempts or out_of_time:
+            if self.breaker and host and kind != FATAL:
+                self.breaker.record_failure(host)
+            return None
+        count('retries')
+        return delay
+
+    def _deadline_at(self):
+        return time.time() + self.deadline if self.deadline else None
+
+    def call(self, function, host=None, classify_result=None):
+        """Call function() until it succeeds or the policy gives up.
+
+        Exceptions are classified with classify(); results with
+        classify_result, if given, where None means success. The last
+        result is returned, or the last exception raised, on giving up.
+        """
+        deadline_at = self._deadline_at()
+        for attempt in itertools.count():
+            if self.breaker and host:
+                self.breaker.check(host)
+            try:
+                result, error = function(), None
+                kind = classify_result(result) if classify_result else None
+            except Exception as e:
+                result, error, kind = None, e, classify(e)
+            delay = self._next_delay(kind, attempt, deadline_at, host)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return result
+            time.sleep(delay)
+
+    async def acall(self, function, host=None, classify_result=None):
+        """Async call(): function returns an awaitable"""
+        deadline_at = self._deadline_at()
+        for attempt in itertools.count():
+            if self.breaker and host:
+                self.breaker.check(host)
+            try:
+                result, error = await function(), None
+                kind = classify_result(result) if classify_result else None
+            except Exception as e:
+                result, error, kind = None, e, classify(e)
+            delay = self._next_delay(kind, attempt, deadline_at, host)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return result
+            await asyncio.sleep(delay)
+
+
+# Shared by every SSH session in the same process
+default_breaker = CircuitBreaker()
+
+# Lightsail API calls; botocore retries first, this backs off further on top
+API_RETRY = RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=30.0, deadline=120.0,
+                        retry_on=(THROTTLE, TRANSIENT))
+# Calls that are not idempotent, such as create_instances
+API_THROTTLE_RETRY = RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=30.0, deadline=120.0,
+                                 retry_on=(THROTTLE,))
+# Opening the master connection, including while sshd is still starting
+SSH_CONNECT_RETRY = RetryPolicy(max_attempts=6, base_delay=1.0, max_delay=15.0, deadline=90.0,
+                                breaker=default_breaker)
+# Commands and copies are only retried when they never reached the host
+SSH_COMMAND_RETRY = RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=10.0, deadline=60.0,
+                                retry_on=(BOOTING,), breaker=default_breaker)
+NO_RETRY = RetryPolicy(max_attempts=1, deadline=None)
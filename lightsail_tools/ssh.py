@@ -0,0 +1,494 @@
+"""
+SSH Helpers for Lightsail Instances
+===================================
+Connect to Lightsail instances with the temporary key and certificate
+returned by get_instance_access_details.
+
+AsyncSSHSession is the execution engine: it drives ssh/scp through
+asyncio subprocesses over one multiplexed connection per instance, so a
+single event loop can run commands on hundreds of hosts at once.
+SSHSession is the blocking facade used by the deployment scripts; every
+facade runs its engine on one shared event loop, so fleet-wide work can
+drive all of their engines together with run_on_sessions.
+
+Output is captured by default. Pass an OutputStream to print it line by
+line as it arrives instead, prefixed per host, keeping only a bounded tail
+in memory.
+"""
+
+import asyncio
+import collections
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from lightsail_tools.credentials import default_cache
+from lightsail_tools.retry import SSH_COMMAND_RETRY, SSH_CONNECT_RETRY, classify_ssh_result
+from lightsail_tools.tracing import span
+
+SSH_OPTIONS = [
+    '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
+    '-o', 'ConnectTimeout=15', '-o', 'IdentitiesOnly=yes',
+]
+# Seconds an idle master connection outlives its last client; an orphaned
+# one (the deploy was killed before close()) then exits on its own
+CONTROL_PERSIST = 60
+# Longest line read in one piece when streaming output
+STREAM_LIMIT = 1024 * 1024
+
+_print_lock = threading.Lock()
+_engine_loop = None
+_engine_lock = threading.Lock()
+
+
+def create_ssh_files(ssh_details, directory=None):
+    """Create temporary SSH key files"""
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.pem', delete=False, dir=directory) as key_file:
+        key_file.write(ssh_details['privateKey'])
+        key_path = key_file.name
+
+    cert_path = key_path + '-cert.pub'
+    cert_parts = ssh_details['certKey'].split(' ', 2)
+    formatted_cert = f'{cert_parts[0]} {cert_parts[1]}\n' if len(cert_parts) >= 2 else ssh_details['certKey'] + '\n'
+
+    with open(cert_path, 'w') as cert_file:
+        cert_file.write(formatted_cert)
+
+    os.chmod(key_path, 0o600)
+    os.chmod(cert_path, 0o600)
+
+    return key_path, cert_path
+
+
+def engine_loop():
+    """The event loop all SSHSession engines run on, started in a daemon thread on first use"""
+    global _engine_loop
+    with _engine_lock:
+        if _engine_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='ssh-engine', daemon=True).start()
+            _engine_loop = loop
+    return _engine_loop
+
+
+def run_async(coroutine):
+    """Run coroutine on the shared engine loop and wait for its result.
+
+    Callable from any thread but the loop's own; the coroutine sees the
+    caller's context, so trace spans nest under the caller's. If the wait
+    is interrupted the coroutine is cancelled, which kills its processes.
+    """
+    loop = engine_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coroutine.close()
+        raise RuntimeError("run_async called from the engine loop; await the coroutine instead")
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
+
+async def _exec(argv, timeout, stdin_data=None):
+    """Run a process, killing it on timeout or cancellation"""
+    process = await asyncio.create_subprocess_exec(
+        *argv,
+        stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(stdin_data), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise subprocess.TimeoutExpired(argv, timeout)
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    return subprocess.CompletedProcess(
+        argv, process.returncode,
+        stdout.decode(errors='replace'), stderr.decode(errors='replace'),
+    )
+
+
+class OutputStream:
+    """Line sink for streamed command output.
+
+    Every line is printed with prefix as soon as it arrives, the last
+    max_lines are kept in a ring buffer for error reports, and all output
+    is optionally appended to log_path.
+    """
+
+    def __init__(self, prefix='', max_lines=200, log_path=None, echo=True):
+        self.prefix = prefix
+        self.lines = collections.deque(maxlen=max_lines)
+        self.echo = echo
+        self.lock = threading.Lock()
+        self.log_file = None
+        if log_path:
+            if os.path.dirname(log_path):
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            self.log_file = open(log_path, 'a')
+
+    def feed(self, line, stream='stdout'):
+        line = line.rstrip('\r\n')
+        with self.lock:
+            self.lines.append((stream, line))
+            if self.log_file:
+                self.log_file.write(line + '\n')
+                self.log_file.flush()
+        if self.echo:
+            with _print_lock:
+                print(f"{self.prefix}{line}", flush=True)
+
+    def tail(self, count=None, stream=None):
+        """The most recent buffered lines, optionally from one stream only"""
+        with self.lock:
+            lines = [line for name, line in self.lines if stream is None or name == stream]
+        return '\n'.join(lines[-count:] if count else lines)
+
+    def close(self):
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+async def _pump(reader, output, stream):
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            output.feed(f"[line longer than {STREAM_LIMIT} bytes dropped]", stream)
+            continue
+        if not line:
+            return
+        output.feed(line.decode(errors='replace'), stream)
+
+
+async def _exec_streaming(argv, output, timeout):
+    """Run a process, feeding its output to output line by line"""
+    process = await asyncio.create_subprocess_exec(
+        *argv,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=STREAM_LIMIT,
+    )
+    try:
+        await asyncio.wait_for(asyncio.gather(
+            _pump(process.stdout, output, 'stdout'),
+            _pump(process.stderr, output, 'stderr'),
+            process.wait(),
+        ), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise subprocess.TimeoutExpired(argv, timeout)
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    return subprocess.CompletedProcess(
+        argv, process.returncode, output.tail(stream='stdout'), output.tail(stream='stderr'),
+    )
+
+
+def _pump_lines(fileobj, output):
+    for line in iter(fileobj.readline, b''):
+        output.feed(line.decode(errors='replace'))
+
+
+def _describe(command):
+    """First non-blank line of a command, shortened for trace attributes"""
+    for line in command.splitlines():
+        if line.strip():
+            return line.strip()[:80]
+    return ''
+
+
+class _CountingWriter:
+    """Pass writes through to fileobj, counting the bytes"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+class AsyncSSHSession:
+    """Multiplexed SSH connection to a Lightsail instance.
+
+    Access details are fetched once and a single ControlMaster connection is
+    opened; every command and file copy then reuses it instead of doing a
+    full handshake. Connecting is retried under connect_retry; commands and
+    copies are only retried (under command_retry) when they never reached
+    the host.
+    """
+
+    def __init__(self, lightsail, instance_name, region='us-east-1', credentials=None,
+                 connect_retry=SSH_CONNECT_RETRY, command_retry=SSH_COMMAND_RETRY):
+        self.lightsail = lightsail
+        self.instance_name = instance_name
+        self.region = region
+        self.credentials = credentials or default_cache
+        self.connect_retry = connect_retry
+        self.command_retry = command_retry
+        # Circuit breaker key; one per instance
+        self.host = f'{region}/{instance_name}'
+        self.ssh_details = None
+        self.work_dir = None
+        self.key_path = None
+        self.cert_path = None
+        self.control_path = None
+        self._open_lock = None
+
+    @property
+    def target(self):
+        return f'{self.ssh_details["username"]}@{self.ssh_details["ipAddress"]}'
+
+    @property
+    def is_open(self):
+        """Whether the master connection is up; it exits by itself after CONTROL_PERSIST idle seconds"""
+        return self.control_path is not None and os.path.exists(self.control_path)
+
+    def _options(self):
+        options = [
+            '-i', self.key_path, '-o', f'CertificateFile={self.cert_path}',
+            *SSH_OPTIONS,
+            '-o', f'ControlPath={self.control_path}',
+        ]
+        # Lightsail always uses 22; a port is only set by local stand-ins
+        if self.ssh_details.get('port'):
+            options += ['-o', f'Port={self.ssh_details["port"]}']
+        return options
+
+    def ssh_argv(self, command):
+        return ['ssh', *self._options(), self.target, command]
+
+    def scp_argv(self, local_path, remote_path):
+        return ['scp', *self._options(), local_path, f'{self.target}:{remote_path}']
+
+    async def open(self):
+        """Fetch access details and start the master connection"""
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+        async with self._open_lock:
+            if self.is_open:
+                return
+            if self.work_dir:
+                # The master went idle and exited; start a fresh one
+                await self.close()
+            with span('ssh.connect', instance=self.instance_name):
+                await self.connect_retry.acall(self._connect, host=self.host)
+
+    async def _connect(self):
+        self.ssh_details = await asyncio.to_thread(
+            self.credentials.get, self.lightsail, self.instance_name, self.region
+        )
+
+        self.work_dir = tempfile.mkdtemp(prefix='lightsail-ssh-')
+        os.chmod(self.work_dir, 0o700)
+        self.key_path, self.cert_path = create_ssh_files(self.ssh_details, directory=self.work_dir)
+        self.control_path = os.path.join(self.work_dir, 'control')
+
+        # The backgrounded master may keep inherited descriptors open, so
+        # its stderr goes to a file rather than a pipe we would wait on.
+        log_path = os.path.join(self.work_dir, 'master.log')
+        master_argv = [
+            'ssh', *self._options(),
+            '-o', 'ControlMaster=yes', '-o', f'ControlPersist={CONTROL_PERSIST}',
+            '-o', 'ServerAliveInterval=30',
+            '-N', '-f', self.target,
+        ]
+        with open(log_path, 'w') as log_file:
+            process = await asyncio.create_subprocess_exec(
+                *master_argv, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL, stderr=log_file,
+            )
+            try:
+                returncode = await asyncio.wait_for(process.wait(), 60)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                process.kill()
+                await self.close()
+                raise
+        if returncode != 0:
+            with open(log_path) as log_file:
+                error = log_file.read().strip()
+            await self.close()
+            if 'Permission denied' in error:
+                self.credentials.invalidate(self.instance_name, self.region)
+            raise RuntimeError(f"Could not open SSH session: {error}")
+
+    async def run(self, command, timeout=300, output=None, input=None):
+        """Run a command over the shared connection.
+
+        With an OutputStream, output is streamed to it and the returned
+        stdout and stderr only hold its buffered tail. input, if given, is
+        bytes fed to the command's stdin (output is then captured).
+        """
+        await self.open()
+        with span('ssh.run', instance=self.instance_name, command=_describe(command)) as current:
+            if input is not None:
+                current.add('bytes', len(input))
+                attempt = lambda: _exec(self.ssh_argv(command), timeout, input)
+            elif output is None:
+                attempt = lambda: _exec(self.ssh_argv(command), timeout)
+            else:
+                attempt = lambda: _exec_streaming(self.ssh_argv(command), output, timeout)
+            result = await self.command_retry.acall(attempt, host=self.host, classify_result=classify_ssh_result)
+            current.set(exit_code=result.returncode)
+            return result
+
+    async def copy(self, local_path, remote_path, timeout=300):
+        """Copy a local file over the shared connection"""
+        await self.open()
+        with span('ssh.copy', instance=self.instance_name, remote_path=remote_path) as current:
+            current.add('bytes', os.path.getsize(local_path))
+            result = await self.command_retry.acall(
+                lambda: _exec(self.scp_argv(local_path, remote_path), timeout),
+                host=self.host, classify_result=classify_ssh_result,
+            )
+            current.set(exit_code=result.returncode)
+            return result
+
+    async def close(self):
+        """Stop the master connection and remove the key material"""
+        if self.control_path and os.path.exists(self.control_path):
+            try:
+                await _exec(['ssh', '-o', f'ControlPath={self.control_path}', '-O', 'exit', self.target], 15)
+            except Exception:
+                pass
+        if self.work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        self.work_dir = self.key_path = self.cert_path = self.control_path = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class SSHSession:
+    """Blocking wrapper around an AsyncSSHSession on the shared engine loop"""
+
+    def __init__(self, lightsail, instance_name, region='us-east-1', credentials=None,
+                 connect_retry=SSH_CONNECT_RETRY, command_retry=SSH_COMMAND_RETRY):
+        self.engine = AsyncSSHSession(lightsail, instance_name, region, credentials,
+                                      connect_retry, command_retry)
+
+    @property
+    def instance_name(self):
+        return self.engine.instance_name
+
+    @property
+    def host(self):
+        return self.engine.host
+
+    @property
+    def ssh_details(self):
+        return self.engine.ssh_details
+
+    @property
+    def is_open(self):
+        return self.engine.is_open
+
+    def open(self):
+        run_async(self.engine.open())
+
+    def run(self, command, timeout=300, output=None, input=None):
+        return run_async(self.engine.run(command, timeout, output, input))
+
+    def copy(self, local_path, remote_path, timeout=300):
+        return run_async(self.engine.copy(local_path, remote_path, timeout))
+
+    def stream(self, command, write, timeout=300, output=None):
+        """Run a command with stdin fed by write(fileobj), without a temp file.
+
+        Output is collected in an anonymous file so a chatty remote command
+        cannot stall the upload, or read by a thread into output when an
+        OutputStream is given; either way it is returned as stderr.
+        """
+        self.open()
+        argv = self.engine.ssh_argv(command)
+        with span('ssh.stream', instance=self.instance_name, command=_describe(command)) as current, \
+                tempfile.TemporaryFile() as spool:
+            process = subprocess.Popen(
+                argv, stdin=subprocess.PIPE,
+                stdout=spool if output is None else subprocess.PIPE,
+                stderr=spool if output is None else subprocess.STDOUT,
+            )
+            reader = None
+            if output is not None:
+                reader = threading.Thread(target=_pump_lines, args=(process.stdout, output), daemon=True)
+                reader.start()
+            stdin = _CountingWriter(process.stdin)
+            try:
+                write(stdin)
+                process.stdin.close()
+                returncode = process.wait(timeout=timeout)
+            except BaseException:
+                process.kill()
+                process.wait()
+                raise
+            finally:
+                current.add('bytes', stdin.bytes)
+                if reader:
+                    reader.join()
+            current.set(exit_code=returncode)
+            if output is not None:
+                return subprocess.CompletedProcess(argv, returncode, '', output.tail())
+            spool.seek(0)
+            return subprocess.CompletedProcess(argv, returncode, '', spool.read().decode(errors='replace'))
+
+    def close(self):
+        if self.engine.work_dir is not None:
+            run_async(self.engine.close())
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+async def run_on_sessions(sessions, fn, max_concurrency=100):
+    """Await fn(session) for every session from one event loop, at most
+    max_concurrency at a time.
+
+    Returns the results in the order of sessions, with the exception in
+    place of any call that raised.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_one(session):
+        async with semaphore:
+            try:
+                return await fn(session)
+            except Exception as e:
+                return e
+
+    return await asyncio.gather(*(run_one(session) for session in sessions))
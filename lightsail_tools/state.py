@@ -0,0 +1,70 @@
+"""
+Desired State
+=============
+Fingerprints of what a deploy wants (open ports, unit and env files)
+compared with what the instance reports, plus a per-run snapshot of the
+instance so one get_instance call serves every step that needs it. A
+write is only issued when the fingerprints differ.
+"""
+
+import hashlib
+import json
+
+from lightsail_tools.retry import API_RETRY
+
+
+def fingerprint(value):
+    """sha256 of text or bytes as written to disk (matching sha256sum), or of
+    any other JSON-serialisable value in canonical form"""
+    if isinstance(value, str):
+        value = value.encode()
+    elif not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(value).hexdigest()
+
+
+def ports_fingerprint(ports):
+    """Fingerprint of (fromPort, toPort, protocol) tuples, ignoring order and duplicates"""
+    return fingerprint(sorted({(int(f), int(t), p.lower()) for f, t, p in ports}))
+
+
+class InstanceState:
+    """The instance as get_instance last described it, fetched once per run"""
+
+    def __init__(self, lightsail, instance_name):
+        self.lightsail = lightsail
+        self.instance_name = instance_name
+        self.instance = None
+        self.fetched = False
+
+    def get(self, refresh=False):
+        """Return the instance description, or None if it does not exist"""
+        if refresh or not self.fetched:
+            try:
+                response = API_RETRY.call(lambda: self.lightsail.get_instance(instanceName=self.instance_name))
+                self.instance = response['instance']
+            except self.lightsail.exceptions.NotFoundException:
+                self.instance = None
+            self.fetched = True
+        return self.instance
+
+    def update(self, instance):
+        """Use a description obtained elsewhere (a readiness wait, say)"""
+        self.instance = instance
+        self.fetched = instance is not None
+
+    def clear(self):
+        """Fetch again on the next get(), after the instance was changed"""
+        self.instance = None
+        self.fetched = False
+
+    def ports(self):
+        """(fromPort, toPort, protocol) of every open public port"""
+        networking = (self.get() or {}).get('networking') or {}
+        return [(p['fromPort'], p['toPort'], p['protocol']) for p in networking.get('ports', [])]
+
+    def record_ports(self, ports):
+        """Note ports just written with put_instance_public_ports"""
+        if self.instance is not None:
+            networking = self.instance.setdefault('networking', {})
+            networking['ports'] = [{'fromPort': f, 'toPort': t, 'protocol': p} for f, t, p in ports]
@@ -0,0 +1,107 @@
+"""
+Content-Hash Manifests
+======================
+Describe an application tree as {relative path: sha256} so a deploy only
+has to transfer and apply the files that were added, changed or deleted.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+
+MANIFEST_NAME = '.deploy-manifest.json'
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_stream(stream):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_file(path):
+    with open(path, 'rb') as f:
+        return hash_stream(f)
+
+
+def build_manifest(root, paths):
+    """Hash the given paths (relative to root)"""
+    return {rel_path: hash_file(os.path.join(root, rel_path)) for rel_path in paths}
+
+
+def manifest_from_archive(archive_path, prefix=''):
+    """Hash every regular file in a tar archive, stripping prefix from names"""
+    manifest = {}
+    with tarfile.open(archive_path, 'r:*') as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.startswith(prefix):
+                continue
+            rel_path = member.name[len(prefix):]
+            if rel_path == MANIFEST_NAME:
+                continue
+            manifest[rel_path] = hash_stream(tar.extractfile(member))
+    return manifest
+
+
+def diff_manifests(local, remote):
+    """Return (added, changed, deleted) path lists"""
+    remote = remote or {}
+    added = sorted(p for p in local if p not in remote)
+    changed = sorted(p for p in local if p in remote and remote[p] != local[p])
+    deleted = sorted(p for p in remote if p not in local)
+    return added, changed, deleted
+
+
+def build_delta_archive(archive_path, prefix, paths, manifest, delta_path):
+    """Copy only the given members of archive_path into a new tar.gz.
+
+    The new manifest is added under prefix so that extracting the delta
+    also records what is now deployed.
+    """
+    wanted = {prefix + p for p in paths}
+    with tarfile.open(archive_path, 'r:*') as source, tarfile.open(delta_path, 'w:gz') as delta:
+        for member in source:
+            if member.name in wanted and member.isfile():
+                delta.addfile(member, source.extractfile(member))
+        add_bytes(delta, prefix + MANIFEST_NAME, dump_manifest(manifest))
+    return delta_path
+
+
+def add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    info.mtime = time.time()
+    tar.addfile(info, io.BytesIO(data))
+
+
+def dump_manifest(manifest):
+    return json.dumps(manifest, sort_keys=True, separators=(',', ':')).encode()
+
+
+def parse_manifest(text):
+    """Parse a manifest, returning None if it is missing or unreadable"""
+    try:
+        manifest = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return parse_manifest(f.read())
+
+
+def save_manifest(path, manifest):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(dump_manifest(manifest))
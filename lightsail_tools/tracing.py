@@ -0,0 +1,266 @@
+"""
+Deploy Tracing
+==============
+Record nested, timed spans for every deploy phase (API calls, credential
+fetches, SSH connects, uploads, remote steps, health waits) together with
+byte and retry counters, and export them as JSON lines, a summary table or
+Chrome trace events (chrome://tracing or https://ui.perfetto.dev).
+
+Spans nest through a context variable, so nesting follows both threads and
+asyncio tasks. Finished spans are only kept once recording is switched on,
+which scripts do when asked for a trace; otherwise a long-running command
+such as check-nodejs-installation.py --follow would keep every span it
+ever opened.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+_current = contextvars.ContextVar('lightsail_tools_span', default=None)
+
+
+class Span:
+    """One timed phase with free-form attributes and numeric counters"""
+
+    def __init__(self, span_id, name, parent, attrs):
+        self.id = span_id
+        self.name = name
+        self.parent_id = parent.id if parent else None
+        self.path = parent.path + (name,) if parent else (name,)
+        self.attrs = dict(attrs)
+        self.counters = {}
+        self.error = None
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def add(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        record = {
+            'id': self.id, 'parent': self.parent_id, 'name': self.name,
+            'start': round(self.start, 6), 'duration': round(self.duration, 6),
+            'thread': self.thread,
+        }
+        if self.attrs:
+            record['attrs'] = self.attrs
+        if self.counters:
+            record['counters'] = self.counters
+        if self.error:
+            record['error'] = self.error
+        return record
+
+
+class Tracer:
+    """Collects finished spans for one run while recording is on"""
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.spans = []
+        self.recording = False
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def record(self, enabled=True):
+        """Start (or stop) keeping finished spans"""
+        self.recording = enabled
+
+    def reset(self):
+        """Drop every recorded span"""
+        with self.lock:
+            self.spans = []
+
+    def start(self, name, **attrs):
+        """Open a span and make it current; pass the result to finish()"""
+        span = Span(next(self._ids), name, _current.get(), attrs)
+        return span, _current.set(span)
+
+    def finish(self, started, error=None):
+        span, token = started
+        span.end = time.time()
+        if error is not None and span.error is None:
+            span.error = f"{type(error).__name__}: {error}"
+        _current.reset(token)
+        if self.recording:
+            with self.lock:
+                self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        started = self.start(name, **attrs)
+        try:
+            yield started[0]
+        except BaseException as e:
+            # sys.exit() and Ctrl-C end the span without marking it failed
+            self.finish(started, e if isinstance(e, Exception) else None)
+            raise
+        self.finish(started)
+
+    def summary(self):
+        """Aggregate spans by their path of parent names, in the order each first started"""
+        rows = {}
+        for span in sorted(self.spans, key=lambda s: s.start):
+            row = rows.setdefault(span.path, {
+                'name': span.name, 'depth': len(span.path) - 1, 'calls': 0, 'total': 0.0,
+                'max': 0.0, 'bytes': 0, 'retries': 0, 'errors': 0,
+            })
+            row['calls'] += 1
+            row['total'] += span.duration
+            row['max'] = max(row['max'], span.duration)
+            row['bytes'] += span.counters.get('bytes', 0)
+            row['retries'] += span.counters.get('retries', 0)
+            row['errors'] += 1 if span.error else 0
+        return list(rows.values())
+
+    def print_summary(self, file=None):
+        """Print a per-phase timing table (to stderr, so --json output stays clean)"""
+        file = file or sys.stderr
+        rows = self.summary()
+        if not rows:
+            return
+        width = max(len(row['name']) + 2 * row['depth'] for row in rows)
+        width = max(width, 5)
+        print("\n" + "=" * (width + 50), file=file)
+        print(f"{'PHASE':<{width}}  {'CALLS':>5}  {'TOTAL':>8}  {'MAX':>8}  {'BYTES':>10}  {'RETRIES':>7}", file=file)
+        print("-" * (width + 50), file=file)
+        for row in rows:
+            name = '  ' * row['depth'] + row['name']
+            line = (f"{name:<{width}}  {row['calls']:>5}  {row['total']:>7.2f}s  {row['max']:>7.2f}s  "
+                    f"{row['bytes']:>10}  {row['retries']:>7}")
+            if row['errors']:
+                line += f"  ({row['errors']} failed)"
+            print(line, file=file)
+        print("-" * (width + 50), file=file)
+
+    def write_jsonl(self, path):
+        """Append one JSON object per span, tagged with this run's id"""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        with open(path, 'a') as f:
+            for span in spans:
+                f.write(json.dumps(dict(run=self.run_id, **span.to_dict()), default=str) + "\n")
+
+    def write_chrome_trace(self, path):
+        """Write spans as complete ("X") events in Chrome trace-event format"""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        threads = {}
+        events = []
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            args = dict(span.attrs, **span.counters)
+            if span.error:
+                args['error'] = span.error
+            events.append({
+                'name': span.name, 'cat': span.name.split('.')[0], 'ph': 'X',
+                'ts': int(span.start * 1e6), 'dur': int(span.duration * 1e6),
+                'pid': os.getpid(), 'tid': tid, 'args': args,
+            })
+        for name, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                           'args': {'name': name}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+# Shared by every script in the same process
+tracer = Tracer()
+span = tracer.span
+
+
+def current_span():
+    return _current.get()
+
+
+def count(counter, amount=1):
+    """Add to a counter on the current span, if there is one"""
+    current = _current.get()
+    if current is not None:
+        current.add(counter, amount)
+
+
+def traced(name, **attrs):
+    """Decorator running the function inside a span; a False result is marked ok=False"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, **attrs) as current:
+                result = function(*args, **kwargs)
+                if result is False:
+                    current.set(ok=False)
+                return result
+        return wrapper
+    return decorator
+
+
+def instrument_client(client):
+    """Record a span per API call of a boto3 client, with its retry count"""
+    def before_call(model, context, **kwargs):
+        context['lightsail_tools_span'] = tracer.start(f'api.{model.name}')
+
+    def after_call(context, parsed=None, **kwargs):
+        started = context.pop('lightsail_tools_span', None)
+        if started is None:
+            return
+        retries = ((parsed or {}).get('ResponseMetadata') or {}).get('RetryAttempts')
+        if retries:
+            started[0].add('retries', retries)
+        if (parsed or {}).get('Error'):
+            started[0].error = parsed['Error'].get('Code')
+        tracer.finish(started)
+
+    def after_call_error(context, exception=None, **kwargs):
+        started = context.pop('lightsail_tools_span', None)
+        if started is not None:
+            tracer.finish(started, exception)
+
+    events = client.meta.events
+    events.register('before-call', before_call, unique_id='lightsail-tools-trace-before')
+    events.register('after-call', after_call, unique_id='lightsail-tools-trace-after')
+    events.register('after-call-error', after_call_error, unique_id='lightsail-tools-trace-error')
+    return client
+
+
+def add_trace_arguments(parser):
+    """Add --trace, --trace-chrome and --trace-summary to an ArgumentParser"""
+    group = parser.add_argument_group('tracing')
+    group.add_argument('--trace', metavar='PATH',
+                       help="append per-phase spans to a JSON-lines trace file")
+    group.add_argument('--trace-chrome', metavar='PATH',
+                       help="write a Chrome trace-event file (chrome://tracing, Perfetto)")
+    group.add_argument('--trace-summary', action='store_true',
+                       help="print a per-phase timing table when done")
+
+
+def export(jsonl_path=None, chrome_path=None, summary=True):
+    if jsonl_path:
+        tracer.write_jsonl(jsonl_path)
+    if chrome_path:
+        tracer.write_chrome_trace(chrome_path)
+    if summary:
+        tracer.print_summary()
+
+
+def export_on_exit(args):
+    """Record spans and export them when the process exits, if a trace was requested"""
+    if args.trace or args.trace_chrome or args.trace_summary:
+        tracer.record()
+        atexit.register(export, args.trace, args.trace_chrome, summary=args.trace_summary)
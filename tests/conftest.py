@@ -0,0 +1,85 @@
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Scripts and lightsail_tools live at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_script(filename):
+    """Import one of the top-level scripts, whose names are not valid module names"""
+    name = filename[:-3].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def recording():
+    """Keep spans on the shared tracer for the length of one test"""
+    from lightsail_tools.tracing import tracer
+    tracer.reset()
+    tracer.record()
+    yield tracer
+    tracer.record(False)
+    tracer.reset()
+
+
+@pytest.fixture(scope='session')
+def run_command_deployer():
+    return load_script('deploy-with-run-command.py')
+
+
+@pytest.fixture(scope='session')
+def qbr_deployer():
+    return load_script('deploy-qbr-to-lightsail.py')
+
+
+@pytest.fixture(scope='session')
+def nodejs_checker():
+    return load_script('check-nodejs-installation.py')
+
+
+class FakeSession:
+    """Stands in for SSHSession; run answers with respond(command) or raises error"""
+
+    def __init__(self, respond=None, error=None, instance_name='test', region='us-east-1'):
+        self.respond = respond or (lambda command: (0, '', ''))
+        self.error = error
+        self.instance_name = instance_name
+        self.region = region
+        self.commands = []
+
+    @property
+    def host(self):
+        return f"{self.region}/{self.instance_name}"
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def run(self, command, timeout=None, output=None, input=None):
+        self.commands.append(command)
+        if self.error:
+            raise self.error
+        returncode, stdout, stderr = self.respond(command)
+        return subprocess.CompletedProcess(command, returncode, stdout, stderr)
+
+
+class FakeAsyncSession(FakeSession):
+    """Stands in for AsyncSSHSession; stdin given as input is kept in inputs"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inputs = []
+
+    async def run(self, command, timeout=300, output=None, input=None):
+        self.inputs.append(input)
+        return FakeSession.run(self, command, timeout)
@@ -0,0 +1,56 @@
+import os
+import time
+
+import pytest
+
+from lightsail_tools.artifacts import ArtifactCache, removed_on_failure
+
+
+def write(path, text):
+    path.write_text(text)
+    return path.name
+
+
+def test_fingerprint_follows_content_and_parameters(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    paths = [write(src / 'a.php', 'a'), write(src / 'b.php', 'b')]
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    key = cache.fingerprint(str(src), paths, {'level': 6})
+    assert cache.fingerprint(str(src), list(reversed(paths)), {'level': 6}) == key
+    assert cache.fingerprint(str(src), paths, {'level': 9}) != key
+    write(src / 'b.php', 'changed')
+    assert cache.fingerprint(str(src), paths, {'level': 6}) != key
+
+
+def test_put_and_get(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    assert cache.get('k', '.tar.gz') is None
+    built = cache.temp_path('.tar.gz')
+    with open(built, 'w') as f:
+        f.write('archive')
+    path = cache.put('k', '.tar.gz', built)
+    assert cache.get('k', '.tar.gz') == path
+    assert not os.path.exists(built)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_entries=2)
+    for key in ('old', 'mid', 'new'):
+        built = cache.temp_path('.tgz')
+        with open(built, 'w') as f:
+            f.write(key)
+        cache.put(key, '.tgz', built)
+        time.sleep(0.01)
+    assert cache.get('old', '.tgz') is None
+    assert cache.get('mid', '.tgz') and cache.get('new', '.tgz')
+
+
+def test_failed_build_leaves_no_temp_file(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    build_path = cache.temp_path('.tar.gz')
+    with pytest.raises(OSError):
+        with removed_on_failure(build_path), open(build_path, 'wb') as f:
+            f.write(b'partial')
+            raise OSError('disk full')
+    assert os.listdir(cache.cache_dir) == []
@@ -0,0 +1,41 @@
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import ROOT
+from lightsail_tools import aws
+
+
+@pytest.fixture
+def fresh_clients():
+    pytest.importorskip('boto3')
+    aws.clear_clients()
+    yield
+    aws.clear_clients()
+
+
+def test_importing_does_not_load_boto3():
+    code = "import sys, lightsail_tools.aws; print('boto3' in sys.modules)"
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    assert result.stdout.strip() == 'False'
+
+
+def test_clients_are_shared_per_service_and_region(fresh_clients):
+    client = aws.get_client('lightsail', 'us-east-1')
+    assert aws.get_client('lightsail', 'us-east-1') is client
+    assert aws.get_client('lightsail', 'eu-west-1') is not client
+    assert client.meta.config.max_pool_connections == aws.MAX_POOL_CONNECTIONS
+
+
+def test_concurrent_first_use_creates_one_client(fresh_clients):
+    with ThreadPoolExecutor(8) as pool:
+        clients = list(pool.map(lambda _: aws.get_client('lightsail', 'us-west-2'), range(16)))
+    assert all(client is clients[0] for client in clients)
+
+
+def test_clear_clients_forgets_cached_clients(fresh_clients):
+    client = aws.get_client('lightsail', 'us-east-1')
+    aws.clear_clients()
+    assert aws.get_client('lightsail', 'us-east-1') is not client
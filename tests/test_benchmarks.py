@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture(scope='module')
+def bench():
+    return load_script(os.path.join('benchmarks', 'run-benchmarks.py'))
+
+
+def medians(**values):
+    return {name: {'median': value} for name, value in values.items()}
+
+
+def test_compare_needs_relative_and_absolute_slowdown(bench, capsys):
+    baseline = medians(slow=1.0, jitter=0.010, faster=2.0, removed=1.0)
+    results = medians(slow=1.5, jitter=0.020, faster=1.0, added=1.0)
+    assert bench.compare(results, baseline, threshold=0.2, min_delta=0.05) == ['slow']
+    out = capsys.readouterr().out
+    assert 'faster' in out and 'added' not in out
+
+
+def test_compare_without_common_benchmarks(bench, capsys):
+    assert bench.compare(medians(a=1.0), medians(b=1.0), 0.2, 0.05) == []
+    assert 'No benchmarks in common' in capsys.readouterr().out
+
+
+def test_make_tree_is_deterministic(bench, tmp_path):
+    first = bench.make_tree(str(tmp_path / 'a'), 20, 'node')
+    second = bench.make_tree(str(tmp_path / 'b'), 20, 'node')
+    files = sorted(os.path.relpath(os.path.join(d, f), first) for d, _, fs in os.walk(first) for f in fs)
+    assert len(files) == 23 and 'package-lock.json' in files
+    for rel_path in files:
+        with open(os.path.join(first, rel_path)) as a, open(os.path.join(second, rel_path)) as b:
+            assert a.read() == b.read()
+
+
+def test_runner_records_medians_and_fails_on_false(bench, recording):
+    runner = bench.Runner(repeat=3)
+    runner.measure('ok', lambda: True, warmup=1)
+    assert len(runner.results['ok']['runs']) == 3
+    with pytest.raises(bench.BenchmarkError):
+        runner.measure('broken', lambda: False)
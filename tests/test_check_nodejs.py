@@ -0,0 +1,46 @@
+import subprocess
+
+from conftest import FakeSession
+
+
+def test_region_reaches_every_session(nodejs_checker, monkeypatch):
+    regions = []
+
+    def get_session(instance_name, region='us-east-1'):
+        regions.append(region)
+        return FakeSession(lambda command: (0, '', ''))
+
+    monkeypatch.setattr(nodejs_checker, 'get_session', get_session)
+    nodejs_checker.run_batched_probes('inst', region='eu-west-2')
+    nodejs_checker.check_nodejs_installation('inst', region='eu-west-2')
+    assert regions and set(regions) == {'eu-west-2'}
+
+
+PROBES = [('one', 'Section', 'echo hello'), ('two', 'Section', 'exit 3'), ('three', 'Other', 'printf "a\\nb"')]
+
+
+def test_probe_script_round_trip(nodejs_checker):
+    marker = '@@PROBE-test'
+    script = nodejs_checker.build_probe_script(PROBES, marker)
+    output = subprocess.run(['bash', '-c', script], stdout=subprocess.PIPE, universal_newlines=True).stdout
+    results = nodejs_checker.parse_probe_output(output, PROBES, marker)
+    assert [(r['id'], r['exit_code'], r['output']) for r in results] == [
+        ('one', 0, 'hello'), ('two', 3, ''), ('three', 0, 'a\nb'),
+    ]
+
+
+def test_probes_missing_from_output_have_no_exit_code(nodejs_checker):
+    marker = '@@PROBE-test'
+    output = f"{marker} BEGIN one\nhello\n{marker} END one 0\n{marker} BEGIN two\ncut off"
+    results = nodejs_checker.parse_probe_output(output, PROBES, marker)
+    assert [r['exit_code'] for r in results] == [0, None, None]
+
+
+def test_batched_probes_are_one_round_trip(nodejs_checker, monkeypatch):
+    session = FakeSession(lambda command: (0, subprocess.run(['bash', '-c', command], stdout=subprocess.PIPE,
+                                                             universal_newlines=True).stdout, ''))
+    monkeypatch.setattr(nodejs_checker, 'get_session', lambda name, region='us-east-1': session)
+    report = nodejs_checker.run_batched_probes('inst', PROBES)
+    assert report['success']
+    assert len(session.commands) == 1
+    assert report['probes'][0]['output'] == 'hello'
@@ -0,0 +1,59 @@
+import os
+import subprocess
+
+from lightsail_tools.checkpoints import CHECKPOINT_DIR, StepProgress, checkpointed_script, script_id
+from lightsail_tools.state import fingerprint
+
+
+def run_script(commands, home):
+    script = home / 'script.sh'
+    script.write_text(checkpointed_script(commands))
+    return subprocess.run(['bash', str(script)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True, env=dict(os.environ, HOME=str(home)), timeout=60)
+
+
+def checkpoint_path(home, commands):
+    return home / CHECKPOINT_DIR / script_id(commands)
+
+
+def test_failing_and_list_leaves_no_checkpoint(tmp_path):
+    commands = ['true', 'cd /nonexistent-dir && echo removed', 'echo never']
+    result = run_script(commands, tmp_path)
+    assert result.returncode != 0
+    assert 'removed' not in result.stdout
+    assert 'never' not in result.stdout
+    assert '##step 2/3 failed' in result.stdout
+    assert checkpoint_path(tmp_path, commands).read_text().split() == [fingerprint([1, 'true'])[:12]]
+
+
+def test_resume_skips_completed_steps(tmp_path):
+    flag = tmp_path / 'flag'
+    commands = ['echo one', f'test -e {flag}', 'echo three']
+    assert run_script(commands, tmp_path).returncode != 0
+    flag.touch()
+    result = run_script(commands, tmp_path)
+    assert result.returncode == 0
+    assert '##step 1/3 skip' in result.stdout
+    assert 'one' not in result.stdout.splitlines()
+    assert 'three' in result.stdout.splitlines()
+    assert not checkpoint_path(tmp_path, commands).exists()
+
+
+def test_multiline_step_fails_on_first_error(tmp_path):
+    commands = ['false\necho after']
+    result = run_script(commands, tmp_path)
+    assert result.returncode != 0
+    assert 'after' not in result.stdout
+
+
+def test_step_progress_records_timings_and_failure():
+    progress = StepProgress(echo=False)
+    for line in ['##step 1/3 skip 0', '##step 2/3 start 0', '##step 2/3 done 1500',
+                 '##step 3/3 start 0', '##step 3/3 failed 20', 'plain output']:
+        progress.feed(line)
+    assert progress.skipped == {1}
+    assert progress.timings == {2: 1500, 3: 20}
+    assert progress.failed == 3
+    assert progress.total == 3
+    progress.feed('##step 3/3 done 30')
+    assert progress.failed is None
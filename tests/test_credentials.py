@@ -0,0 +1,50 @@
+import os
+import stat
+import time
+import types
+
+from lightsail_tools.credentials import CredentialCache
+
+
+class FakeLightsail:
+    exceptions = types.SimpleNamespace(NotFoundException=LookupError)
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.calls = 0
+
+    def get_instance_access_details(self, instanceName):
+        self.calls += 1
+        return {'accessDetails': {'instanceName': instanceName, 'privateKey': f'key{self.calls}',
+                                  'expiresAt': time.time() + self.ttl}}
+
+
+def test_one_api_call_per_instance_and_region():
+    cache, lightsail = CredentialCache(), FakeLightsail()
+    assert cache.get(lightsail, 'a', 'us-east-1') == cache.get(lightsail, 'a', 'us-east-1')
+    cache.get(lightsail, 'a', 'eu-west-2')
+    assert lightsail.calls == 2
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'entries': 2}
+
+
+def test_entries_close_to_expiry_are_refreshed():
+    cache, lightsail = CredentialCache(refresh_margin=300), FakeLightsail(ttl=60)
+    cache.get(lightsail, 'a', 'us-east-1')
+    cache.get(lightsail, 'a', 'us-east-1')
+    assert lightsail.calls == 2
+
+
+def test_invalidate_forces_a_new_call(tmp_path):
+    cache, lightsail = CredentialCache(str(tmp_path)), FakeLightsail()
+    cache.get(lightsail, 'a', 'us-east-1')
+    cache.invalidate('a', 'us-east-1')
+    assert cache.get(lightsail, 'a', 'us-east-1')['privateKey'] == 'key2'
+
+
+def test_disk_cache_is_shared_and_private(tmp_path):
+    lightsail = FakeLightsail()
+    CredentialCache(str(tmp_path)).get(lightsail, 'a', 'us-east-1')
+    assert CredentialCache(str(tmp_path)).get(lightsail, 'a', 'us-east-1')['privateKey'] == 'key1'
+    assert lightsail.calls == 1
+    for name in os.listdir(tmp_path):
+        assert stat.S_IMODE(os.stat(tmp_path / name).st_mode) == 0o600
@@ -0,0 +1,136 @@
+import io
+import os
+import subprocess
+import sys
+import tarfile
+
+import pytest
+
+from conftest import FakeSession
+
+
+class FakeInstanceState:
+    def __init__(self, instance=None, error=None):
+        self.instance = instance
+        self.error = error
+
+    def get(self, refresh=False):
+        if self.error:
+            raise self.error
+        return self.instance
+
+    def ports(self):
+        return []
+
+
+@pytest.fixture
+def deployer(qbr_deployer, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'index.php').write_text('<?php echo 1;\n')
+    deployer = qbr_deployer.LightsailQBRDeployer('qbr')
+    monkeypatch.setattr(deployer, 'bundle_price', lambda: None)
+    return deployer
+
+
+def test_plan_fails_when_instance_cannot_be_described(deployer):
+    deployer._instance_state = FakeInstanceState(error=RuntimeError('throttled'))
+    with pytest.raises(RuntimeError):
+        deployer.plan_deployment()
+
+
+def test_plan_fails_when_instance_cannot_be_reached(deployer):
+    deployer._instance_state = FakeInstanceState({'name': 'qbr'})
+    deployer.session = FakeSession(error=ConnectionError('connection refused'))
+    with pytest.raises(RuntimeError):
+        deployer.plan_deployment()
+
+
+def test_plan_creates_instance_only_when_not_found(deployer):
+    deployer._instance_state = FakeInstanceState(None)
+    plan = deployer.plan_deployment()
+    assert plan.changes('instance')
+    assert plan.changes('files')
+
+
+def test_unreachable_instance_means_full_deploy(deployer, qbr_deployer):
+    qbr_deployer.save_manifest(deployer.manifest_cache_path, deployer.app_manifest())
+    deployer.session = FakeSession(error=ConnectionError('connection refused'))
+    assert deployer.fetch_remote_manifest() is None
+    assert deployer.fetch_remote_manifest(use_cache=True) == deployer.app_manifest()
+
+
+def test_script_only_run_does_not_cache_manifest(deployer, monkeypatch):
+    monkeypatch.setattr(deployer, 'database_migration_commands', lambda: [])
+    deployer.session = FakeSession(error=ConnectionError('connection refused'))
+    commands = deployer.deploy_application_files(bulk=False)
+    assert commands
+    assert deployer.execute_deployment_commands(commands, remote=False)
+    assert not os.path.exists(deployer.manifest_cache_path)
+
+
+class StreamingSession(FakeSession):
+    """Keeps what write() sends to stdin, like SSHSession.stream would"""
+
+    def stream(self, command, write, timeout=300, output=None):
+        self.commands.append(command)
+        self.uploaded = io.BytesIO()
+        write(self.uploaded)
+        return subprocess.CompletedProcess(command, 0, b'', b'')
+
+
+def test_bulk_upload_sends_one_archive_with_the_manifest(deployer, qbr_deployer):
+    deployer.session = StreamingSession()
+    manifest = deployer.app_manifest()
+    commands = deployer.bulk_file_commands(['index.php'], ['old.php'], manifest)
+    assert len(deployer.session.commands) == 1
+    deployer.session.uploaded.seek(0)
+    with tarfile.open(fileobj=deployer.session.uploaded, mode='r:gz') as tar:
+        assert tar.extractfile('index.php').read() == b'<?php echo 1;\n'
+        assert qbr_deployer.parse_manifest(tar.extractfile(qbr_deployer.MANIFEST_NAME).read()) == manifest
+    assert any('tar -xzf' in c for c in commands)
+    assert any('rm -f -- old.php' in c for c in commands)
+
+
+def test_mysql_failure_is_an_error_not_an_empty_database(deployer):
+    def respond(command):
+        if 'schema_migrations' in command:
+            return 1, '', "ERROR 1045 (28000): Access denied for user 'qbr_user'@'localhost'"
+        return 0, '', ''
+
+    deployer._instance_state = FakeInstanceState({'name': 'qbr'})
+    deployer.session = FakeSession(respond)
+    with pytest.raises(RuntimeError, match='Access denied'):
+        deployer.plan_deployment()
+    assert deployer.database_migration_commands() is None
+
+
+@pytest.mark.parametrize('regressions, code', [([], None), (['p95 10.0ms → 50.0ms'], 1)])
+def test_load_probe_regression_fails_the_run(qbr_deployer, monkeypatch, tmp_path, regressions, code):
+    monkeypatch.chdir(tmp_path)
+
+    class Deployer:
+        def __init__(self, instance_name, region):
+            pass
+
+        def check_instance_exists(self):
+            return True
+
+        def deploy_application_files(self, **kwargs):
+            return []
+
+        def execute_deployment_commands(self, commands, remote):
+            return True
+
+        def check_load(self, load_probe):
+            return regressions
+
+        configure_instance_ports = close_session = get_instance_info = lambda self: None
+
+    monkeypatch.setattr(qbr_deployer, 'LightsailQBRDeployer', Deployer)
+    monkeypatch.setattr(sys, 'argv', ['deploy-qbr-to-lightsail.py', '--load-probe'])
+    if code is None:
+        qbr_deployer.main()
+    else:
+        with pytest.raises(SystemExit) as exit_info:
+            qbr_deployer.main()
+        assert exit_info.value.code == code
@@ -0,0 +1,147 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import FakeSession
+
+
+def parse(module, monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['deploy-with-run-command.py', *argv])
+    return module.parse_args()
+
+
+def test_rollback_takes_instance_name(run_command_deployer, monkeypatch):
+    args = parse(run_command_deployer, monkeypatch, '--rollback', 'inst')
+    assert args.rollback
+    assert args.instance_name == 'inst'
+    assert args.release is None
+
+
+def test_rollback_to_release(run_command_deployer, monkeypatch):
+    args = parse(run_command_deployer, monkeypatch, 'inst', '--rollback', '--release', '20250101000000')
+    assert args.instance_name == 'inst'
+    assert args.release == '20250101000000'
+
+
+def test_release_requires_rollback(run_command_deployer, monkeypatch):
+    with pytest.raises(SystemExit):
+        parse(run_command_deployer, monkeypatch, 'inst', 'app.tar.gz', '--release', '1')
+
+
+def test_deploy_arguments(run_command_deployer, monkeypatch):
+    args = parse(run_command_deployer, monkeypatch, 'inst', 'app.tar.gz', '{"PORT": "3000"}')
+    assert not args.rollback
+    assert (args.instance_name, args.app_archive_path, args.env_vars) == ('inst', 'app.tar.gz', {'PORT': '3000'})
+
+
+def test_plan_fails_when_remote_state_cannot_be_read(run_command_deployer, tmp_path):
+    (tmp_path / 'server.js').write_text('console.log(1)\n')
+    deployer = run_command_deployer.LightsailDeployer('inst', lightsail=object())
+    deployer.session = FakeSession(error=ConnectionError('no route to host'))
+    assert deployer.plan(str(tmp_path)) is None
+
+
+def test_plan_from_empty_instance_is_a_full_deploy(run_command_deployer, tmp_path):
+    (tmp_path / 'server.js').write_text('console.log(1)\n')
+    deployer = run_command_deployer.LightsailDeployer('inst', lightsail=object())
+    deployer.session = FakeSession()
+    plan = deployer.plan(str(tmp_path))
+    assert plan.changes('files')
+    assert plan.changes('service')
+
+
+@pytest.mark.parametrize('remote, expected', [
+    (None, True),
+    ({'server.js': '1', 'package.json': 'p', 'package-lock.json': 'l'}, False),
+    ({'server.js': 'old', 'package.json': 'p', 'package-lock.json': 'l'}, False),
+    ({'server.js': '1', 'package.json': 'p', 'package-lock.json': 'old'}, True),
+    ({'server.js': '1', 'package.json': 'p'}, True),
+])
+def test_dependencies_changed(run_command_deployer, remote, expected):
+    deployer = run_command_deployer.LightsailDeployer('inst', lightsail=object())
+    local = {'server.js': '1', 'package.json': 'p', 'package-lock.json': 'l'}
+    assert deployer.dependencies_changed(local, remote) is expected
+
+
+@pytest.fixture
+def releases(run_command_deployer, tmp_path, monkeypatch):
+    """A releases/ tree on local disk; commands run in bash with sudo as a no-op wrapper"""
+    (tmp_path / 'releases').mkdir()
+    for release_id in ('20250101000000', '20250102000000', '20250103000000', '20250104000000'):
+        (tmp_path / 'releases' / release_id).mkdir()
+    monkeypatch.setattr(run_command_deployer, 'RELEASES_DIR', str(tmp_path / 'releases'))
+    monkeypatch.setattr(run_command_deployer, 'CURRENT_DIR', str(tmp_path / 'current'))
+    deployer = run_command_deployer.LightsailDeployer('inst', lightsail=object())
+
+    def bash(command):
+        result = subprocess.run(['bash', '-c', 'sudo() { "$@"; }\n' + command],
+                                capture_output=True, text=True)
+        return result.returncode, result.stdout, result.stderr
+
+    deployer.session = FakeSession(bash)
+    deployer.switched = []
+    monkeypatch.setattr(deployer, 'switch_release', lambda release_dir: deployer.switched.append(
+        os.path.basename(release_dir)) or True)
+    monkeypatch.setattr(deployer, 'wait_for_health', lambda: True)
+    monkeypatch.setattr(deployer, 'close_session', lambda: None)
+    return deployer, tmp_path
+
+
+def make_live(tmp_path, release_id):
+    current = tmp_path / 'current'
+    if current.is_symlink():
+        current.unlink()
+    current.symlink_to(tmp_path / 'releases' / release_id)
+
+
+def test_live_release(releases):
+    deployer, tmp_path = releases
+    assert deployer.live_release() is None
+    make_live(tmp_path, '20250102000000')
+    assert deployer.live_release() == '20250102000000'
+
+
+def test_rollback_falls_back_to_the_next_older_release_id(releases):
+    deployer, tmp_path = releases
+    make_live(tmp_path, '20250103000000')
+    # mtimes must not matter: make the newest release look oldest
+    os.utime(tmp_path / 'releases' / '20250104000000', (0, 0))
+    assert deployer.rollback()
+    assert deployer.switched == ['20250102000000']
+
+
+def test_rollback_without_an_older_release(releases):
+    deployer, tmp_path = releases
+    make_live(tmp_path, '20250101000000')
+    assert not deployer.rollback()
+    assert deployer.switched == []
+
+
+def test_prune_keeps_the_newest_release_ids_and_the_live_one(releases):
+    deployer, tmp_path = releases
+    make_live(tmp_path, '20250101000000')
+    for release_id in ('20250103000000', '20250104000000'):
+        os.utime(tmp_path / 'releases' / release_id, (0, 0))
+    deployer.prune_releases(keep=2)
+    assert sorted(os.listdir(tmp_path / 'releases')) == ['20250101000000', '20250104000000']
+
+
+def test_regressed_release_rolls_back_to_the_previously_live_one(releases, run_command_deployer, monkeypatch):
+    deployer, tmp_path = releases
+    monkeypatch.setattr(run_command_deployer, 'print_results', lambda *args: None)
+    make_live(tmp_path, '20250104000000')
+
+    class RegressingProbe:
+        rollback = True
+
+        def run(self, session, save_path):
+            return {}
+
+        def compare(self, results, baseline):
+            return ['p95 10.0ms → 50.0ms']
+
+    assert not deployer.check_load(RegressingProbe(), None, str(tmp_path / 'current'),
+                                   previous_release='20250101000000')
+    assert deployer.switched == ['20250101000000']
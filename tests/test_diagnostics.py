@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+from conftest import FakeAsyncSession
+from lightsail_tools import diagnostics
+from lightsail_tools.diagnostics import MISSING_EXIT, PROBE_PATH, cached_source, run_probe, summarize
+
+
+def probe_host(uploaded_first=False):
+    """A host that has the probe cached unless uploaded_first, and stores it when sent"""
+    has_probe = [not uploaded_first]
+
+    def respond(command):
+        if command.startswith('mkdir -p'):
+            has_probe[0] = True
+            return 0, '', ''
+        if not has_probe[0]:
+            return MISSING_EXIT, '', ''
+        return 0, 'noise\n' + json.dumps({'host': {'hostname': 'h'}}) + '\n', ''
+    return FakeAsyncSession(respond)
+
+
+def test_cached_path_follows_script_content():
+    source, remote_path = cached_source(PROBE_PATH)
+    assert remote_path.startswith(diagnostics.REMOTE_DIR + '/probe-')
+    assert remote_path.endswith('.py')
+    assert cached_source(PROBE_PATH) == (source, remote_path)
+
+
+def test_probe_runs_in_one_round_trip_when_cached():
+    session = probe_host()
+    report = asyncio.run(run_probe(session))
+    assert report['success'] and not report['uploaded']
+    assert report['host'] == {'hostname': 'h'}
+    assert len(session.commands) == 1
+
+
+def test_probe_is_uploaded_when_missing():
+    session = probe_host(uploaded_first=True)
+    report = asyncio.run(run_probe(session))
+    assert report['success'] and report['uploaded']
+    assert len(session.commands) == 3
+    assert session.inputs[1] == cached_source(PROBE_PATH)[0]
+
+
+def test_probe_failure_is_reported():
+    session = FakeAsyncSession(error=ConnectionError('refused'))
+    report = asyncio.run(run_probe(session))
+    assert report == {'success': False, 'uploaded': False, 'error': 'refused'}
+
+
+def test_summarize_counts_versions_and_problems():
+    node = {'version': 'v20.1.0', 'source': 'apt:nodejs', 'path': '/usr/bin/node'}
+    reports = {
+        'a': {'success': True, 'runtimes': {'node': node, 'npm': None},
+              'services': {'nginx': {'enabled': 'enabled', 'active': 'failed'}},
+              'disk': [{'path': '/', 'percent': 95.0}]},
+        'b': {'success': True, 'runtimes': {'node': node, 'npm': None}, 'cloud_init': {'status': 'running'}},
+        'c': {'success': False, 'error': 'timeout'},
+    }
+    summary = summarize(reports)
+    assert summary['failed'] == ['c']
+    assert summary['runtimes']['node'] == {'v20.1.0 (apt:nodejs)': 2}
+    assert summary['runtimes']['npm'] == {'missing': 2}
+    assert summary['problems'] == {'a': ['nginx failed', '/ 95% full'], 'b': ['cloud-init running']}
+
+
+def test_snapshot_with_missing_values_still_prints(capsys):
+    report = {
+        'success': True, 'host': {'hostname': 'h', 'kernel': '6.1', 'load': [0.5, 0.25, 0.0]},
+        'runtimes': {'node': {'version': 'v20.11.0', 'source': 'apt', 'path': '/usr/bin/node'}, 'npm': None},
+        'packages': {'apt': {'nodejs': '20.11.0-1nodesource1'}, 'snap': {'node': None},
+                     'repositories': ['nodesource.list']},
+        'memory': {'total': 2 * 2**30, 'available': None},
+        'disk': [{'path': '/', 'percent': None, 'free': None}],
+        'cloud_init': {},
+    }
+    diagnostics.print_snapshot('web', report)
+    out = capsys.readouterr().out
+    assert 'apt nodejs 20.11.0-1nodesource1, snap node, repositories nodesource.list' in out
+    assert 'Memory: ? available of 2048 MB, load 0.50 0.25 0.00' in out
+    assert 'Disk /: ? used, ? free' in out
+    assert 'npm      ❌ not installed' in out
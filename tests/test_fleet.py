@@ -0,0 +1,69 @@
+import threading
+import time
+
+from lightsail_tools.fleet import find_instances_by_tag, run_fleet
+
+
+def test_run_fleet_bounds_concurrency_by_max_unavailable():
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def deploy(name):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return True
+
+    names = [f"web-{i}" for i in range(6)]
+    results = run_fleet(names, deploy, max_concurrency=5, max_unavailable=2)
+    assert [r.instance_name for r in results] == names
+    assert all(r.succeeded for r in results)
+    assert peak[0] == 2
+
+
+def test_run_fleet_finishes_each_batch_before_the_next():
+    order = []
+
+    def deploy(name):
+        order.append(('start', name))
+        time.sleep(0.01 if name != 'a' else 0.05)
+        order.append(('end', name))
+        return True
+
+    run_fleet(['a', 'b', 'c'], deploy, max_concurrency=4, batch_size=2)
+    assert order.index(('start', 'c')) > order.index(('end', 'a'))
+
+
+def test_run_fleet_stops_when_failure_rate_is_exceeded():
+    def deploy(name):
+        if name == 'bad':
+            raise RuntimeError('boom')
+        return True
+
+    results = run_fleet(['bad', 'b', 'c'], deploy, max_concurrency=1, max_failure_rate=0.5)
+    assert [r.status for r in results] == ['failed', 'skipped', 'skipped']
+    assert results[0].error == 'boom'
+
+
+def test_run_fleet_reports_false_as_failed():
+    results = run_fleet(['a'], lambda name: False)
+    assert results[0].status == 'failed' and results[0].error is None
+
+
+def test_find_instances_by_tag_follows_pages():
+    pages = {
+        None: {'instances': [{'name': 'a', 'tags': [{'key': 'role', 'value': 'web'}]},
+                             {'name': 'b', 'tags': [{'key': 'role', 'value': 'db'}]}],
+               'nextPageToken': 't1'},
+        't1': {'instances': [{'name': 'c', 'tags': [{'key': 'role', 'value': 'web'}]}]},
+    }
+
+    class Lightsail:
+        def get_instances(self, pageToken=None):
+            return pages[pageToken]
+
+    assert find_instances_by_tag(Lightsail(), 'role', 'web') == ['a', 'c']
+    assert find_instances_by_tag(Lightsail(), 'role') == ['a', 'b', 'c']
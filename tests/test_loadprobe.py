@@ -0,0 +1,90 @@
+import json
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from lightsail_tools import remote_loadtest
+from lightsail_tools.loadprobe import LOADTEST_PATH, LoadProbe, comparable
+
+
+def results(**overrides):
+    base = {'base_url': 'http://localhost:3000', 'concurrency': 10, 'requests': 300,
+            'p50': 10.0, 'p95': 20.0, 'p99': 40.0, 'rps': 500.0, 'error_rate': 0.0,
+            'endpoints': {'/': {'p95': 20.0, 'error_rate': 0.0}}}
+    base.update(overrides)
+    return base
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert remote_loadtest.percentile(values, 0.5) == 50
+    assert remote_loadtest.percentile(values, 0.99) == 99
+    assert remote_loadtest.percentile([7], 0.95) == 7
+    assert remote_loadtest.percentile([], 0.5) is None
+
+
+def test_summarize_leaves_errors_out_of_latencies():
+    summary = remote_loadtest.summarize([(5.0, None), (1000.0, 'timeout'), (15.0, None), (10.0, None)], 2.0)
+    assert summary['requests'] == 4 and summary['errors'] == 1
+    assert summary['error_rate'] == 0.25 and summary['rps'] == 2.0
+    assert (summary['p50'], summary['p99']) == (10.0, 15.0)
+
+
+def test_comparable_needs_the_same_burst():
+    assert comparable(results(), results(p95=99.0))
+    assert not comparable(results(), results(concurrency=20))
+    assert not comparable(results(), None)
+
+
+def test_compare_flags_slower_percentiles_errors_and_throughput():
+    probe = LoadProbe(threshold=0.2)
+    now = results(p95=30.0, rps=300.0, error_rate=0.05,
+                  endpoints={'/': {'p95': 30.0, 'error_rate': 0.05}})
+    regressions = probe.compare(now, results())
+    assert 'p95 20.0ms → 30.0ms' in regressions
+    assert '/ p95 20.0ms → 30.0ms' in regressions
+    assert 'error rate 0.0% → 5.0%' in regressions
+    assert 'throughput 500 → 300 req/s' in regressions
+
+
+def test_compare_ignores_noise_and_other_bursts():
+    probe = LoadProbe(threshold=0.2)
+    # +50% but only 3ms slower
+    assert probe.compare(results(p50=9.0), results(p50=6.0)) == []
+    assert probe.compare(results(p95=99.0), results(concurrency=20)) == []
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200 if self.path == '/' else 404)
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_loadtest_script_reports_per_path_results(server, tmp_path):
+    save = tmp_path / 'results.json'
+    result = subprocess.run(
+        [sys.executable, LOADTEST_PATH, '--base-url', server, '--paths', '/,/missing',
+         '--requests', '5', '--concurrency', '2', '--warmup', '0', '--save', str(save)],
+        capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert report['requests'] == 10 and report['errors'] == 5
+    assert report['endpoints']['/']['errors'] == 0
+    assert report['endpoints']['/missing']['p95'] is None
+    assert json.loads(save.read_text()) == report
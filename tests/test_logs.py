@@ -0,0 +1,29 @@
+import asyncio
+import base64
+import gzip
+import json
+
+from conftest import FakeAsyncSession
+from lightsail_tools.logs import LogPositions, fetch_new
+
+
+def reply(logs):
+    payload = gzip.compress(json.dumps({'logs': logs}).encode())
+    return 0, base64.b64encode(payload).decode() + '\n', ''
+
+
+def test_positions_advance_only_for_logs_that_were_read(tmp_path):
+    positions = LogPositions(str(tmp_path / 'positions.json'))
+    session = FakeAsyncSession(lambda command: reply({
+        '/var/log/app.log': {'lines': ['a'], 'offset': 10, 'inode': 5, 'skip': True},
+        'unit:app': {'lines': [], 'cursor': 's=1'},
+        '/var/log/missing.log': {'error': 'No such file'},
+    }))
+    fetched = asyncio.run(fetch_new(session, positions, ['/var/log/app.log', 'unit:app', '/var/log/missing.log']))
+    assert fetched['/var/log/app.log']['lines'] == ['a']
+    assert positions.get(session.host) == {
+        '/var/log/app.log': {'offset': 10, 'inode': 5, 'skip': True},
+        'unit:app': {'cursor': 's=1'},
+    }
+    positions.save()
+    assert LogPositions(positions.path).get(session.host) == positions.get(session.host)
@@ -0,0 +1,83 @@
+import os
+import subprocess
+
+import pytest
+
+from lightsail_tools import migrations
+from lightsail_tools.migrations import (
+    changed_migrations, load_migrations, migration_commands, parse_applied, pending_migrations,
+)
+
+
+@pytest.fixture
+def migration_dir(tmp_path):
+    (tmp_path / '0002_add_index.sql').write_text('CREATE INDEX i ON t (c)')
+    (tmp_path / '0001_initial_schema.sql').write_text("CREATE TABLE t (c VARCHAR(10) DEFAULT 'it''s');\n")
+    (tmp_path / 'README.md').write_text('not a migration')
+    return tmp_path
+
+
+def test_load_migrations_in_number_order(migration_dir):
+    assert [m.version for m in load_migrations(str(migration_dir))] == ['0001_initial_schema', '0002_add_index']
+    assert load_migrations(str(migration_dir / 'missing')) == []
+
+
+def test_duplicate_numbers_are_rejected(migration_dir):
+    (migration_dir / '0002_other.sql').write_text('SELECT 1')
+    with pytest.raises(ValueError):
+        load_migrations(str(migration_dir))
+
+
+def test_parse_applied():
+    assert parse_applied('0001_initial_schema\tabc\n\n0002_add_index\t\n') == {
+        '0001_initial_schema': 'abc', '0002_add_index': ''}
+    assert parse_applied('') == {}
+
+
+def test_pending_and_changed(migration_dir):
+    first, second = load_migrations(str(migration_dir))
+    applied = {first.version: 'edited-since'}
+    assert pending_migrations([first, second], applied) == [second]
+    assert changed_migrations([first, second], applied) == [first]
+    assert changed_migrations([first, second], {first.version: first.checksum}) == []
+    # Rows recorded by the baseline have no checksum to compare with
+    assert changed_migrations([first], {first.version: ''}) == []
+
+
+def test_migration_commands(migration_dir):
+    assert migration_commands([], 'mysql') == []
+    first, second = load_migrations(str(migration_dir))
+    commands = migration_commands([first, second], 'mysql', baseline=first.version, baseline_table='t')
+    assert migrations.VERSION_TABLE in commands[0]
+    assert len(commands) == 4
+    assert 'SHOW TABLES' in commands[1] and 'START TRANSACTION' not in commands[1]
+    assert "START TRANSACTION;\nCREATE INDEX i ON t (c);\nINSERT INTO" in commands[3]
+    assert commands[3].endswith(f"COMMIT;\n{migrations.HEREDOC_MARKER}\nfi")
+
+
+FAKE_MYSQL = '''#!/bin/bash
+echo "mysql: [Warning] Using a password on the command line interface can be insecure." >&2
+case "$FAKE_MYSQL" in
+    rows) printf '0001_initial_schema\\tabc\\n' ;;
+    no-table) echo "ERROR 1146 (42S02) at line 1: Table 'db.schema_migrations' doesn't exist" >&2; exit 1 ;;
+    denied) echo "ERROR 1045 (28000): Access denied for user 'qbr_user'@'localhost'" >&2; exit 1 ;;
+esac
+'''
+
+
+@pytest.mark.parametrize('mode, returncode, applied', [
+    ('rows', 0, {'0001_initial_schema': 'abc'}),
+    ('no-table', 0, {}),
+    ('denied', 1, None),
+])
+def test_applied_query_only_treats_a_missing_table_as_empty(tmp_path, mode, returncode, applied):
+    mysql = tmp_path / 'mysql'
+    mysql.write_text(FAKE_MYSQL)
+    mysql.chmod(0o755)
+    result = subprocess.run(['bash', '-c', migrations.applied_query(str(mysql))], capture_output=True,
+                            text=True, env={'FAKE_MYSQL': mode, 'PATH': os.environ['PATH']})
+    assert result.returncode == returncode
+    if applied is None:
+        assert 'Access denied' in result.stderr
+    else:
+        assert parse_applied(result.stdout) == applied
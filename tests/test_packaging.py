@@ -0,0 +1,65 @@
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+
+from lightsail_tools import packaging
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for rel_path in ('app.js', 'lib/util.js', 'lib/util.pyc', '.env', '.git/HEAD', '__pycache__/x.pyc'):
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(rel_path.encode())
+    return str(tmp_path)
+
+
+def test_iter_files_skips_hidden_and_excluded(tree):
+    assert list(packaging.iter_files(tree, exclude_suffixes=('.pyc',))) == ['app.js', os.path.join('lib', 'util.js')]
+
+
+def test_parallel_gzip_writer_round_trips_across_blocks():
+    data = os.urandom(10000) + b'a' * 10000
+    out = io.BytesIO()
+    writer = packaging.ParallelGzipWriter(out, threads=2, chunk_size=1024)
+    for i in range(0, len(data), 777):
+        writer.write(data[i:i + 777])
+    writer.close()
+    assert gzip.decompress(out.getvalue()) == data
+
+
+def test_parallel_gzip_writer_empty_input_is_valid_gzip():
+    out = io.BytesIO()
+    packaging.ParallelGzipWriter(out).close()
+    assert gzip.decompress(out.getvalue()) == b''
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'none'])
+def test_write_package_adds_prefix_and_extra_members(tree, compression):
+    out = io.BytesIO()
+    packaging.write_package(tree, out, prefix='app/', extra={'app/manifest.json': b'{}'},
+                            compression=compression)
+    out.seek(0)
+    with tarfile.open(fileobj=out, mode='r:*') as tar:
+        names = tar.getnames()
+        assert tar.extractfile('app/app.js').read() == b'app.js'
+        assert tar.extractfile('app/manifest.json').read() == b'{}'
+    assert 'app/.env' not in names and 'app/lib/util.js' in names
+
+
+def test_open_compressed_rejects_unknown_compression():
+    with pytest.raises(ValueError):
+        packaging.open_compressed(io.BytesIO(), 'lz4')
+
+
+def test_failed_write_does_not_finish_the_archive(tree):
+    out = io.BytesIO()
+    with pytest.raises(FileNotFoundError):
+        packaging.write_package(tree, out, paths=['app.js', 'missing.js'])
+    out.seek(0)
+    with pytest.raises((tarfile.ReadError, EOFError)):
+        with tarfile.open(fileobj=out, mode='r:gz') as tar:
+            tar.getmembers()
@@ -0,0 +1,47 @@
+import json
+import tarfile
+
+from lightsail_tools.plan import Plan, format_bytes, source_sizes, write_plans
+
+
+def test_plan_totals_only_count_changes():
+    plan = Plan('web')
+    plan.change('files', '2 changed', transfer_bytes=2048, remote_steps=3)
+    plan.keep('service')
+    assert plan.changed
+    assert plan.changes('files') and not plan.changes('service') and not plan.changes('ports')
+    assert (plan.transfer_bytes, plan.remote_steps) == (2048, 3)
+
+
+def test_plan_with_only_kept_steps_has_no_changes(capsys):
+    plan = Plan('web')
+    plan.keep('files')
+    assert not plan.changed
+    plan.print_summary()
+    assert 'No changes' in capsys.readouterr().out
+
+
+def test_format_bytes():
+    assert format_bytes(512) == '512 B'
+    assert format_bytes(1536) == '1.5 KB'
+    assert format_bytes(3 * 1024 ** 3) == '3.0 GB'
+
+
+def test_source_sizes_from_directory_and_archive(tmp_path):
+    source = tmp_path / 'app'
+    source.mkdir()
+    (source / 'a.js').write_bytes(b'12345')
+    (source / 'b.js').write_bytes(b'12')
+    assert source_sizes(str(source), ['a.js', 'b.js']) == 7
+    archive = tmp_path / 'app.tar.gz'
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(source, arcname='app')
+    assert source_sizes(str(archive), ['a.js'], prefix='app/') == 5
+
+
+def test_write_plans(tmp_path):
+    plan = Plan('web')
+    plan.change('ports', 'open 443')
+    path = tmp_path / 'plan.json'
+    write_plans(str(path), [plan])
+    assert json.loads(path.read_text()) == [plan.to_dict()]
@@ -0,0 +1,91 @@
+import types
+
+import pytest
+
+from lightsail_tools import provisioning
+from lightsail_tools.readiness import ReadinessReport
+
+
+class FakeLightsail:
+    exceptions = types.SimpleNamespace(NotFoundException=LookupError)
+
+    def __init__(self, region, snapshots=None, fail_create=False):
+        self.region = region
+        self.snapshots = dict(snapshots or {})
+        self.fail_create = fail_create
+        self.calls = []
+
+    def get_instance_snapshot(self, instanceSnapshotName):
+        if instanceSnapshotName not in self.snapshots:
+            raise LookupError(instanceSnapshotName)
+        return {'instanceSnapshot': {'state': self.snapshots[instanceSnapshotName]}}
+
+    def copy_snapshot(self, sourceSnapshotName, targetSnapshotName, sourceRegion):
+        self.calls.append(('copy_snapshot', sourceRegion))
+        self.snapshots[targetSnapshotName] = 'available'
+
+    def create_instances_from_snapshot(self, **kwargs):
+        self.calls.append(('create_instances_from_snapshot', kwargs))
+        if self.fail_create:
+            raise RuntimeError('quota exceeded')
+
+    def create_instances(self, **kwargs):
+        self.calls.append(('create_instances', kwargs))
+        if self.fail_create:
+            raise RuntimeError('quota exceeded')
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    clients = {}
+    monkeypatch.setattr(provisioning, 'get_client', lambda service, region: clients[region])
+
+    def ready(lightsail, name, region, timeout, health_url=None):
+        report = ReadinessReport()
+        report.ready = True
+        return report
+
+    monkeypatch.setattr(provisioning, 'wait_until_ready', ready)
+    return clients
+
+
+def test_golden_snapshot_name_changes_with_its_inputs():
+    name = provisioning.golden_snapshot_name('qbr', 'lamp', 'small_3_0', '#!/bin/bash\n')
+    assert name.startswith('qbr-golden-')
+    assert name == provisioning.golden_snapshot_name('qbr', 'lamp', 'small_3_0', '#!/bin/bash\n')
+    assert name != provisioning.golden_snapshot_name('qbr', 'lamp', 'small_3_0', '#!/bin/sh\n')
+
+
+def test_create_instances_from_snapshot_or_blueprint():
+    lightsail = FakeLightsail('us-east-1')
+    provisioning.create_instances(lightsail, 'us-east-1', ['a'], 'small', snapshot_name='golden')
+    provisioning.create_instances(lightsail, 'us-east-1', ['b'], 'small', blueprint_id='lamp', user_data='x')
+    (first, first_args), (second, second_args) = lightsail.calls
+    assert first == 'create_instances_from_snapshot' and first_args['instanceSnapshotName'] == 'golden'
+    assert second == 'create_instances' and second_args['blueprintId'] == 'lamp'
+    assert first_args['availabilityZone'] == 'us-east-1a'
+
+
+def test_wait_for_snapshot_fails_on_error_state():
+    lightsail = FakeLightsail('us-east-1', {'golden': 'error'})
+    assert provisioning.wait_for_snapshot(lightsail, 'golden', timeout=5) is False
+
+
+def test_provision_copies_the_snapshot_to_other_regions(clients):
+    name = provisioning.golden_snapshot_name('qbr', 'lamp', 'small', '')
+    clients['us-east-1'] = FakeLightsail('us-east-1', {name: 'available'})
+    clients['eu-west-1'] = FakeLightsail('eu-west-1')
+    results = provisioning.provision({'us-east-1': ['a'], 'eu-west-1': ['b', 'c']}, 'lamp', 'small', '',
+                                     snapshot_prefix='qbr')
+    assert [(r.instance_name, r.status) for r in results] == [
+        ('us-east-1/a', 'success'), ('eu-west-1/b', 'success'), ('eu-west-1/c', 'success')]
+    assert ('copy_snapshot', 'us-east-1') in clients['eu-west-1'].calls
+    assert not any(call[0] == 'copy_snapshot' for call in clients['us-east-1'].calls)
+
+
+def test_provision_reports_a_failed_region(clients):
+    clients['us-east-1'] = FakeLightsail('us-east-1')
+    clients['eu-west-1'] = FakeLightsail('eu-west-1', fail_create=True)
+    results = provisioning.provision({'us-east-1': ['a'], 'eu-west-1': ['b']}, 'lamp', 'small', '')
+    assert [(r.instance_name, r.status) for r in results] == [('us-east-1/a', 'success'), ('eu-west-1/b', 'failed')]
+    assert results[1].error == 'quota exceeded'
@@ -0,0 +1,53 @@
+from lightsail_tools import readiness
+
+
+class FakeLightsail:
+    """get_instance walks through the given states, repeating the last one"""
+
+    def __init__(self, *states):
+        self.states = list(states)
+
+    def get_instance(self, instanceName):
+        state = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        return {'instance': {'name': instanceName, 'state': {'name': state}}}
+
+
+def test_poll_retries_exceptions_until_truthy():
+    calls = []
+
+    def check():
+        calls.append(1)
+        if len(calls) < 3:
+            raise OSError('not yet')
+        return 'ready'
+
+    assert readiness.poll(check, timeout=5, initial_delay=0.001, max_delay=0.001) == 'ready'
+    assert len(calls) == 3
+
+
+def test_poll_returns_none_on_timeout():
+    assert readiness.poll(lambda: False, timeout=0.05, initial_delay=0.01, max_delay=0.01) is None
+
+
+def test_wait_for_running_returns_the_instance(monkeypatch):
+    monkeypatch.setattr(readiness.time, 'sleep', lambda seconds: None)
+    instance = readiness.wait_for_running(FakeLightsail('pending', 'running'), 'web', timeout=5)
+    assert instance['state']['name'] == 'running'
+
+
+def test_wait_for_running_gives_up_on_unexpected_state():
+    assert readiness.wait_for_running(FakeLightsail('stopped'), 'web', timeout=5) is None
+
+
+def test_wait_until_ready_records_the_failed_phase():
+    report = readiness.wait_until_ready(FakeLightsail('stopped'), 'web', timeout=5)
+    assert not report.ready
+    assert report.failed_phase == 'running'
+    assert [name for name, _, _ in report.phases] == ['running']
+
+
+def test_wait_until_ready_without_remote_phases():
+    report = readiness.wait_until_ready(FakeLightsail('running'), 'web', timeout=5,
+                                        check_cloud_init=False)
+    assert report.ready and report.failed_phase is None
+    assert report.instance['name'] == 'web'
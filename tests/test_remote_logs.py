@@ -0,0 +1,68 @@
+import os
+
+from lightsail_tools.remote_logs import complete_lines, read_file
+
+
+def follow(path, position, max_bytes):
+    """read_file, returning the lines and the position to pass next time"""
+    result = read_file(str(path), position, 10, max_bytes)
+    position = {'offset': result['offset'], 'inode': result['inode']}
+    if result['skip']:
+        position['skip'] = True
+    return result, position
+
+
+def test_complete_lines_keeps_partial_line():
+    assert complete_lines(b'a\nb\nc', 100) == (['a', 'b'], 4, False)
+
+
+def test_complete_lines_skips_rest_of_truncated_line():
+    assert complete_lines(b'tail of long line\nnext\n', 100, skip=True) == (['next'], 23, False)
+    assert complete_lines(b'still the long line', 100, skip=True) == ([], 19, True)
+
+
+def test_reads_only_new_lines(tmp_path):
+    log = tmp_path / 'app.log'
+    log.write_text('old\n')
+    result, position = follow(log, {}, 1000)
+    assert result['lines'] == ['old']
+    with open(log, 'a') as f:
+        f.write('new\npartial')
+    result, position = follow(log, position, 1000)
+    assert result['lines'] == ['new']
+    with open(log, 'a') as f:
+        f.write(' line\n')
+    result, position = follow(log, position, 1000)
+    assert result['lines'] == ['partial line']
+
+
+def test_line_longer_than_a_read_is_truncated_and_skipped(tmp_path):
+    log = tmp_path / 'app.log'
+    log.write_text('')
+    _, position = follow(log, {}, 16)
+    log.write_text('x' * 40 + '\nafter\n')
+    result, position = follow(log, position, 16)
+    assert len(result['lines']) == 1 and 'truncated' in result['lines'][0]
+    assert result['more']
+    seen = []
+    for _ in range(5):
+        result, position = follow(log, position, 16)
+        seen += result['lines']
+    assert seen == ['after']
+    assert position['offset'] == os.path.getsize(log)
+
+
+def test_rotated_file_is_drained_before_the_new_one(tmp_path):
+    log = tmp_path / 'app.log'
+    log.write_text('')
+    _, position = follow(log, {}, 10)
+    log.write_text(''.join(f'line{i}\n' for i in range(6)))
+    os.rename(log, str(log) + '.1')
+    log.write_text('fresh\n')
+    seen, rotated = [], 0
+    for _ in range(10):
+        result, position = follow(log, position, 10)
+        seen += result['lines']
+        rotated += result['rotated']
+    assert seen == [f'line{i}' for i in range(6)] + ['fresh']
+    assert rotated == 1
@@ -0,0 +1,120 @@
+import asyncio
+import subprocess
+
+import pytest
+
+from lightsail_tools import retry
+from lightsail_tools.retry import (
+    BOOTING, FATAL, THROTTLE, TRANSIENT, CircuitBreaker, CircuitOpenError, RetryPolicy, classify,
+    classify_ssh_result,
+)
+
+
+class ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class EndpointConnectionError(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(retry.time, 'sleep', lambda seconds: None)
+
+
+@pytest.mark.parametrize('error, kind', [
+    (ClientError('ThrottlingException'), THROTTLE),
+    (ClientError('ServiceUnavailable'), TRANSIENT),
+    (ClientError('NotFoundException'), FATAL),
+    (EndpointConnectionError('down'), TRANSIENT),
+    (subprocess.TimeoutExpired('ssh', 5), TRANSIENT),
+    (RuntimeError('ssh: connect to host 192.0.2.1 port 22: Connection refused'), BOOTING),
+    (RuntimeError('Connection reset by peer'), TRANSIENT),
+    (CircuitOpenError('open'), FATAL),
+    (ValueError('bad input'), FATAL),
+])
+def test_classify(error, kind):
+    assert classify(error) == kind
+
+
+def test_classify_ssh_result_only_looks_at_ssh_errors():
+    refused = subprocess.CompletedProcess('ssh', 255, '', 'Connection refused')
+    assert classify_ssh_result(refused) == BOOTING
+    assert classify_ssh_result(subprocess.CompletedProcess('ssh', 1, '', 'Connection refused')) is None
+    assert classify_ssh_result(subprocess.CompletedProcess('ssh', 255, '', 'host key changed')) is None
+
+
+def test_retries_until_success():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ClientError('Throttling')
+        return 'ok'
+
+    assert RetryPolicy(max_attempts=5).call(flaky) == 'ok'
+    assert len(attempts) == 3
+
+
+def test_fatal_errors_are_not_retried():
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ClientError('AccessDeniedException')
+
+    with pytest.raises(ClientError):
+        RetryPolicy(max_attempts=5).call(broken)
+    assert len(attempts) == 1
+
+
+def test_gives_up_after_max_attempts_with_the_last_result():
+    results = iter([subprocess.CompletedProcess('ssh', 255, '', 'Connection refused')] * 3)
+    policy = RetryPolicy(max_attempts=3)
+    result = policy.call(lambda: next(results), classify_result=classify_ssh_result)
+    assert result.returncode == 255
+
+
+def test_async_call_retries():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise ConnectionError('reset')
+        return 'ok'
+
+    assert asyncio.run(RetryPolicy(base_delay=0).acall(flaky)) == 'ok'
+
+
+def test_breaker_opens_after_repeated_failures_and_half_opens(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retry.time, 'time', lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    policy = RetryPolicy(max_attempts=1, deadline=None, breaker=breaker)
+
+    def unreachable():
+        raise ConnectionError('timed out')
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            policy.call(unreachable, host='web')
+    with pytest.raises(CircuitOpenError):
+        policy.call(lambda: 'ok', host='web')
+    assert policy.call(lambda: 'ok', host='other') == 'ok'
+
+    now[0] += 61
+    assert policy.call(lambda: 'ok', host='web') == 'ok'
+    breaker.check('web')
+
+
+def test_fatal_errors_do_not_count_against_the_host():
+    breaker = CircuitBreaker(failure_threshold=1)
+    policy = RetryPolicy(max_attempts=1, breaker=breaker)
+    with pytest.raises(ValueError):
+        policy.call(lambda: int('x'), host='web')
+    breaker.check('web')
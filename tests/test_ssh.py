@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+import types
+
+import pytest
+
+from lightsail_tools.credentials import CredentialCache
+from lightsail_tools.ssh import CONTROL_PERSIST, OutputStream, SSHSession, run_async, run_on_sessions
+from lightsail_tools.tracing import span, tracer
+
+
+def test_run_on_sessions_bounds_concurrency_and_keeps_order():
+    running, peak = set(), []
+
+    async def work(name):
+        running.add(name)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.discard(name)
+        if name == 'b':
+            raise ValueError('unreachable')
+        return name.upper()
+
+    results = run_async(run_on_sessions(['a', 'b', 'c', 'd', 'e'], work, max_concurrency=2))
+    assert results[0] == 'A' and results[2:] == ['C', 'D', 'E']
+    assert isinstance(results[1], ValueError)
+    assert max(peak) == 2
+
+
+def test_run_async_nests_spans_under_the_caller(recording):
+    async def inner():
+        with span('inner'):
+            await asyncio.sleep(0)
+
+    with span('outer'):
+        run_async(inner())
+    assert [s.path for s in tracer.spans if s.name == 'inner'] == [('outer', 'inner')]
+
+
+def test_run_async_refuses_to_block_its_own_loop():
+    async def nested():
+        run_async(asyncio.sleep(0))
+
+    with pytest.raises(RuntimeError):
+        run_async(nested())
+
+
+FAKE_SSH = '''#!/bin/bash
+# Logs every call; a master (-N) creates its control socket, -O exit removes it
+echo "$*" >> "$FAKE_SSH_LOG"
+for a in "$@"; do case "$a" in ControlPath=*) control="${a#ControlPath=}";; esac; done
+for a in "$@"; do case "$a" in -N) touch "$control"; exit 0;; -O) rm -f "$control"; exit 0;; esac; done
+exec bash -c "${@: -1}"
+'''
+
+
+class FakeLightsail:
+    exceptions = types.SimpleNamespace(NotFoundException=LookupError)
+
+    def get_instance_access_details(self, instanceName):
+        return {'accessDetails': {'instanceName': instanceName, 'username': 'ubuntu', 'ipAddress': '192.0.2.1',
+                                  'privateKey': 'key', 'certKey': 'ssh-rsa-cert-v01@openssh.com AAAA comment',
+                                  'expiresAt': time.time() + 3600}}
+
+
+@pytest.fixture
+def ssh_log(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'ssh').write_text(FAKE_SSH)
+    (bin_dir / 'ssh').chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('FAKE_SSH_LOG', str(tmp_path / 'ssh.log'))
+    return tmp_path / 'ssh.log'
+
+
+def test_session_reuses_one_master_connection(ssh_log):
+    session = SSHSession(FakeLightsail(), 'web', credentials=CredentialCache())
+    assert session.run('echo one').stdout == 'one\n'
+    assert session.run('echo two', input=b'').stdout == 'two\n'
+    work_dir = session.engine.work_dir
+    assert oct(os.stat(session.engine.key_path).st_mode & 0o777) == '0o600'
+    session.close()
+    calls = ssh_log.read_text().splitlines()
+    masters = [call for call in calls if ' -N ' in f' {call} ']
+    assert len(masters) == 1
+    assert f'ControlPersist={CONTROL_PERSIST}' in masters[0]
+    assert any(' -O exit' in call for call in calls)
+    assert not os.path.exists(work_dir)
+
+
+def test_session_restarts_an_idle_master(ssh_log):
+    session = SSHSession(FakeLightsail(), 'web', credentials=CredentialCache())
+    session.run('true')
+    old_dir = session.engine.work_dir
+    os.unlink(session.engine.control_path)
+    session.run('true')
+    assert session.is_open and session.engine.work_dir != old_dir
+    assert not os.path.exists(old_dir)
+    session.close()
+
+
+def test_output_stream_keeps_the_last_lines_per_stream(tmp_path):
+    log_path = tmp_path / 'logs' / 'deploy.log'
+    with OutputStream(max_lines=3, log_path=str(log_path), echo=False) as output:
+        for i in range(4):
+            output.feed(f"line {i}\n")
+        output.feed("oops\r\n", 'stderr')
+        assert output.tail() == 'line 2\nline 3\noops'
+        assert output.tail(1, stream='stdout') == 'line 3'
+    assert log_path.read_text().splitlines() == ['line 0', 'line 1', 'line 2', 'line 3', 'oops']
+
+
+def test_streamed_run_feeds_lines_as_they_arrive(ssh_log, capsys):
+    session = SSHSession(FakeLightsail(), 'web', credentials=CredentialCache())
+    output = OutputStream(prefix='[web] ')
+    result = session.run('echo one; echo two >&2; exit 3', output=output)
+    session.close()
+    assert result.returncode == 3
+    assert (result.stdout, result.stderr) == ('one', 'two')
+    assert sorted(capsys.readouterr().out.splitlines()) == ['[web] one', '[web] two']
@@ -0,0 +1,67 @@
+import hashlib
+import types
+
+from lightsail_tools.state import InstanceState, fingerprint, ports_fingerprint
+
+
+class FakeLightsail:
+    exceptions = types.SimpleNamespace(NotFoundException=LookupError)
+
+    def __init__(self, instance=None):
+        self.instance = instance
+        self.calls = 0
+
+    def get_instance(self, instanceName):
+        self.calls += 1
+        if self.instance is None:
+            raise LookupError(instanceName)
+        return {'instance': dict(self.instance)}
+
+
+def test_fingerprint_of_text_matches_sha256sum():
+    assert fingerprint('[Unit]\n') == hashlib.sha256(b'[Unit]\n').hexdigest()
+    assert fingerprint(b'[Unit]\n') == fingerprint('[Unit]\n')
+    assert fingerprint({'b': 1, 'a': 2}) == fingerprint({'a': 2, 'b': 1})
+
+
+def test_ports_fingerprint_ignores_order_duplicates_and_case():
+    assert ports_fingerprint([(22, 22, 'TCP'), ('80', 80, 'tcp')]) == \
+        ports_fingerprint([(80, 80, 'tcp'), (22, 22, 'tcp'), (22, 22, 'tcp')])
+    assert ports_fingerprint([(22, 22, 'tcp')]) != ports_fingerprint([(22, 22, 'udp')])
+
+
+def test_instance_state_is_fetched_once():
+    lightsail = FakeLightsail({'name': 'web', 'networking': {'ports': [
+        {'fromPort': 22, 'toPort': 22, 'protocol': 'tcp'}]}})
+    state = InstanceState(lightsail, 'web')
+    assert state.get()['name'] == 'web'
+    assert state.ports() == [(22, 22, 'tcp')]
+    assert lightsail.calls == 1
+    state.get(refresh=True)
+    assert lightsail.calls == 2
+
+
+def test_missing_instance_is_none_and_cached():
+    lightsail = FakeLightsail()
+    state = InstanceState(lightsail, 'web')
+    assert state.get() is None and state.ports() == []
+    assert lightsail.calls == 1
+
+
+def test_record_ports_and_clear():
+    lightsail = FakeLightsail({'name': 'web'})
+    state = InstanceState(lightsail, 'web')
+    state.get()
+    state.record_ports([(80, 80, 'tcp')])
+    assert state.ports() == [(80, 80, 'tcp')]
+    state.clear()
+    assert state.ports() == []
+    assert lightsail.calls == 2
+
+
+def test_update_uses_a_description_from_elsewhere():
+    lightsail = FakeLightsail()
+    state = InstanceState(lightsail, 'web')
+    state.update({'name': 'web'})
+    assert state.get() == {'name': 'web'}
+    assert lightsail.calls == 0
@@ -0,0 +1,59 @@
+import hashlib
+import tarfile
+
+from lightsail_tools import sync
+
+
+def make_archive(path, files):
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in files.items():
+            sync.add_bytes(tar, name, data)
+    return str(path)
+
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_diff_manifests():
+    local = {'a': '1', 'b': '2', 'c': '3'}
+    remote = {'b': '2', 'c': 'old', 'd': '4'}
+    assert sync.diff_manifests(local, remote) == (['a'], ['c'], ['d'])
+    assert sync.diff_manifests(local, None) == (['a', 'b', 'c'], [], [])
+
+
+def test_build_manifest_hashes_relative_paths(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'x.js').write_bytes(b'x')
+    assert sync.build_manifest(str(tmp_path), ['sub/x.js']) == {'sub/x.js': sha(b'x')}
+
+
+def test_manifest_from_archive_strips_prefix_and_skips_manifest(tmp_path):
+    archive = make_archive(tmp_path / 'app.tar.gz', {
+        'app/index.js': b'index', 'app/' + sync.MANIFEST_NAME: b'{}', 'other/file': b'no',
+    })
+    assert sync.manifest_from_archive(archive, 'app/') == {'index.js': sha(b'index')}
+
+
+def test_build_delta_archive_keeps_only_changed_files_and_the_manifest(tmp_path):
+    archive = make_archive(tmp_path / 'app.tar.gz', {'app/a': b'a', 'app/b': b'b'})
+    manifest = {'a': sha(b'a'), 'b': sha(b'b')}
+    delta = sync.build_delta_archive(archive, 'app/', ['b'], manifest, str(tmp_path / 'delta.tar.gz'))
+    with tarfile.open(delta) as tar:
+        assert sorted(tar.getnames()) == ['app/' + sync.MANIFEST_NAME, 'app/b']
+        assert tar.extractfile('app/b').read() == b'b'
+        assert sync.parse_manifest(tar.extractfile('app/' + sync.MANIFEST_NAME).read()) == manifest
+
+
+def test_parse_manifest_rejects_unreadable_text():
+    assert sync.parse_manifest('{"a": "1"}') == {'a': '1'}
+    assert sync.parse_manifest('') is None
+    assert sync.parse_manifest('[1]') is None
+    assert sync.parse_manifest(None) is None
+
+
+def test_save_and_load_manifest(tmp_path):
+    path = str(tmp_path / 'cache' / 'manifest.json')
+    assert sync.load_manifest(path) is None
+    sync.save_manifest(path, {'a': '1'})
+    assert sync.load_manifest(path) == {'a': '1'}
@@ -0,0 +1,71 @@
+import argparse
+import json
+
+import pytest
+
+from lightsail_tools import tracing
+from lightsail_tools.tracing import add_trace_arguments, export_on_exit, span, tracer
+
+
+@pytest.fixture
+def registered(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tracer, 'recording', False)
+    monkeypatch.setattr(tracing.atexit, 'register', lambda fn, *args, **kwargs: calls.append((args, kwargs)))
+    return calls
+
+
+def parse(*argv):
+    parser = argparse.ArgumentParser()
+    add_trace_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def test_trace_file_alone_prints_no_summary(registered):
+    export_on_exit(parse('--trace', 'trace.jsonl'))
+    assert registered == [(('trace.jsonl', None), {'summary': False})]
+    assert tracer.recording
+
+
+def test_trace_summary_prints_summary(registered):
+    export_on_exit(parse('--trace-summary'))
+    assert registered == [((None, None), {'summary': True})]
+
+
+def test_no_trace_options_register_nothing(registered):
+    export_on_exit(parse())
+    assert registered == []
+    assert not tracer.recording
+
+
+def test_spans_are_not_kept_unless_recording(registered):
+    tracer.reset()
+    with span('follow.round') as current:
+        current.add('bytes', 10)
+    assert tracer.spans == []
+
+
+def test_spans_nest_and_summarize(tmp_path, recording):
+    with span('deploy'):
+        for _ in range(2):
+            with span('ssh.run') as current:
+                current.add('bytes', 10)
+    rows = {row['name']: row for row in tracer.summary()}
+    assert rows['deploy']['depth'] == 0
+    assert rows['ssh.run']['depth'] == 1
+    assert rows['ssh.run']['calls'] == 2
+    assert rows['ssh.run']['bytes'] == 20
+
+    path = tmp_path / 'trace.jsonl'
+    tracer.write_jsonl(str(path))
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    parents = {r['id']: r['parent'] for r in records}
+    deploy = next(r['id'] for r in records if r['name'] == 'deploy')
+    assert [parents[r['id']] for r in records if r['name'] == 'ssh.run'] == [deploy, deploy]
+
+
+def test_failed_span_records_error(recording):
+    with pytest.raises(ValueError):
+        with span('step'):
+            raise ValueError('boom')
+    assert tracer.spans[0].error == 'ValueError: boom'